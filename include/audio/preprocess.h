@@ -25,6 +25,44 @@ extern "C" {
 */
 size_t get_num_mfcc();
 
+/**
+ * @brief Get number of mel bands.
+ * 
+ * @return Number of mel bands.
+*/
+size_t get_num_mels();
+
+/**
+ * @brief Get hop length between frames.
+ * 
+ * @return Hop length in samples.
+*/
+size_t get_hop_length();
+
+/**
+ * @brief Get window length of a frame.
+ * 
+ * @return Window length in samples.
+*/
+size_t get_win_length();
+
+/**
+ * @brief Get number of MFCC frames computed for a signal.
+ * 
+ * @param num_samples [in] Size of the input audio signal.
+ * 
+ * @return Number of frames.
+*/
+size_t get_num_frames(size_t num_samples);
+
+/**
+ * @brief Get exponent of the fixed-point MFCC features, i.e. a value v of
+ * mfcc_fixed_batch() or mfcc_fixed_stream_push() represents v * 2^exponent.
+ * 
+ * @return Exponent of the fixed-point MFCC features.
+*/
+int get_mfcc_fixed_exponent();
+
 /**
  * @brief Initialization of MFCC preprocessing module. Memory sizes allocated.
  * 
@@ -42,18 +80,205 @@ esp_err_t malloc_mfcc_module();
  * 
  * @param wav_values [in] Input audio signal.
  * @param num_samples [in] Size of the input audio signal.
- * @param output_mfcc [out] Output MFCC feature.
+ * @param output [out] Contiguous, caller-owned buffer of at least 
+ * get_num_frames(num_samples) * get_num_mfcc() floats. Frame i is stored at 
+ * output[i * N_MFCC].
  * @param output_frames [out] Number of frames in the output MFCC feature.
  * 
+ * @return Error values according to ESP-IDF coding style.
+*/
+esp_err_t mfcc(int16_t *wav_values, size_t num_samples, 
+               float *output, size_t *output_frames);
+
+/**
+ * @brief Calculate MFCC of a batch of equally long clips. Window, mel 
+ * filter bank and FFT tables are built once for the whole batch.
  * 
- * @pre output_mfcc must not be allocated before calling this function.
- * Otherwise, memory leak will occur.
+ * @param clips [in] Contiguous num_clips x num_samples audio signals.
+ * @param num_clips [in] Number of clips.
+ * @param num_samples [in] Size of each audio signal.
+ * @param output [out] Buffer of at least num_clips * 
+ * get_num_frames(num_samples) * get_num_mfcc() floats. Clip i, frame j is 
+ * stored at output[(i * num_frames + j) * N_MFCC].
  * 
  * @return Error values according to ESP-IDF coding style.
 */
-esp_err_t mfcc(int16_t *wav_values, size_t num_samples, 
-               float ***output, size_t *output_frames);
+esp_err_t mfcc_batch(int16_t *clips, size_t num_clips, size_t num_samples, 
+                     float *output);
+
+
+/**
+ * @brief Reset the streaming MFCC interface, i.e., discard buffered samples.
+ * 
+ * @return ESP_OK.
+*/
+esp_err_t mfcc_stream_reset();
+
+/**
+ * @brief Calculate MFCC incrementally. Samples are appended to an internal
+ * window of the last WIN_LENGTH_SAMPLES samples, and a frame is emitted 
+ * every time the window is full, after which it moves by the hop length.
+ * Only the window is kept in memory, so audio can be processed while it is 
+ * being recorded.
+ * 
+ * Note: The module must be initialized with malloc_mfcc_module() and 
+ * mfcc_stream_reset() must be called before a new signal is started.
+ * Do not call mfcc() or mfcc_batch() in between, as they 
+ * release the FFT tables.
+ * 
+ * @param samples [in] Next chunk of the input audio signal.
+ * @param num_samples [in] Size of the chunk.
+ * @param output [out] Buffer for at least max_frames * get_num_mfcc() floats.
+ * Frame i of this call is stored at output[i * N_MFCC].
+ * @param max_frames [in] Max. number of frames to emit. Further frames are
+ * dropped.
+ * @param output_frames [out] Number of frames emitted by this call.
+ * 
+ * @return Error values according to ESP-IDF coding style.
+*/
+esp_err_t mfcc_stream_push(const int16_t *samples, size_t num_samples, 
+                           float *output, size_t max_frames, 
+                           size_t *output_frames);
+
+/**
+ * @brief Calculate MFCC of equally long clips in fixed-point arithmetic 
+ * (int16 FFT, integer mel filter bank, log2 lookup table and integer DCT). 
+ * The PC build is bit-exact with the ESP32, so it can be used to simulate 
+ * the device. Features differ from mfcc() by quantization errors, apart from
+ * mel bands without any energy, whose log is clamped differently.
+ * 
+ * @param clips [in] num_clips * num_samples input samples, clip after clip.
+ * @param num_clips [in] Number of clips.
+ * @param num_samples [in] Size of each clip.
+ * @param output [out] Buffer for num_clips * get_num_frames(num_samples) *
+ * get_num_mfcc() values, scaled by 2^-get_mfcc_fixed_exponent().
+ * 
+ * @return Error values according to ESP-IDF coding style.
+*/
+esp_err_t mfcc_fixed_batch(int16_t *clips, size_t num_clips, size_t num_samples,
+                           int16_t *output);
+
+/**
+ * @brief Fixed-point counterpart of mfcc_stream_push(), see 
+ * mfcc_fixed_batch(). Shares the stream state with mfcc_stream_push().
+ * 
+ * @param samples [in] Next chunk of the input audio signal.
+ * @param num_samples [in] Size of the chunk.
+ * @param output [out] Buffer for at least max_frames * get_num_mfcc() values.
+ * @param max_frames [in] Max. number of frames to emit.
+ * @param output_frames [out] Number of frames emitted by this call.
+ * 
+ * @return Error values according to ESP-IDF coding style.
+*/
+esp_err_t mfcc_fixed_stream_push(const int16_t *samples, size_t num_samples, 
+                                 int16_t *output, size_t max_frames, 
+                                 size_t *output_frames);
+
+/**
+ * @brief Counterpart of mfcc_stream_push() for peak normalized features. 
+ * Emits the log mel energies in dB of each frame, before they are clamped to
+ * the floor of mfcc(), and tracks the peak of the samples pushed since 
+ * mfcc_stream_reset(). mfcc_stream_normalize() computes the MFCCs once the 
+ * signal is complete.
+ * 
+ * @param samples [in] Next chunk of the input audio signal.
+ * @param num_samples [in] Size of the chunk.
+ * @param output [out] Buffer for at least max_frames * get_num_mels() floats.
+ * Frame i of this call is stored at output[i * N_MELS].
+ * @param max_frames [in] Max. number of frames to emit.
+ * @param output_frames [out] Number of frames emitted by this call.
+ * 
+ * @return Error values according to ESP-IDF coding style.
+*/
+esp_err_t mel_stream_push(const int16_t *samples, size_t num_samples, 
+                          float *output, size_t max_frames, 
+                          size_t *output_frames);
 
+/**
+ * @brief Fixed-point counterpart of mel_stream_push(). Log mel energies are 
+ * given as log2 with 16 fractional bits.
+*/
+esp_err_t mel_fixed_stream_push(const int16_t *samples, size_t num_samples, 
+                                int32_t *output, size_t max_frames, 
+                                size_t *output_frames);
+
+/**
+ * @brief Compute the MFCCs of the frames emitted by mel_stream_push() as if 
+ * the signal had been scaled to a peak of INT16_MAX beforehand, as the 
+ * training clips are. Must be called before mfcc_stream_reset().
+ * 
+ * @param mels [in] num_frames * get_num_mels() log mel energies.
+ * @param num_frames [in] Number of frames.
+ * @param output [out] Buffer for num_frames * get_num_mfcc() floats.
+ * 
+ * @return Error values according to ESP-IDF coding style.
+*/
+esp_err_t mfcc_stream_normalize(const float *mels, size_t num_frames, 
+                                float *output);
+
+/**
+ * @brief Fixed-point counterpart of mfcc_stream_normalize(), see 
+ * mel_fixed_stream_push().
+*/
+esp_err_t mfcc_fixed_stream_normalize(const int32_t *mels, size_t num_frames, 
+                                      int16_t *output);
+
+/**
+ * @brief Update a running min/max with the given MFCC values, e.g. with the 
+ * frames of each mfcc_stream_push() call. min_value and max_value must be 
+ * initialized with FLT_MAX and -FLT_MAX.
+ * 
+ * @param values [in] MFCC values.
+ * @param num_values [in] Number of values.
+ * @param min_value [in, out] Running minimum.
+ * @param max_value [in, out] Running maximum.
+*/
+void mfcc_range_update(const float *values, size_t num_values, 
+                       float *min_value, float *max_value);
+
+/**
+ * @brief Fixed-point counterpart of mfcc_range_update(). min_value and 
+ * max_value must be initialized with INT16_MAX and INT16_MIN.
+*/
+void mfcc_fixed_range_update(const int16_t *values, size_t num_values, 
+                             int16_t *min_value, int16_t *max_value);
+
+/**
+ * @brief Normalize MFCC values to [0, 1] by their min/max and quantize them
+ * to the model input in a single pass. Each value v becomes 
+ * min(floor((v - min) / (max - min) * 2^-exponent), 2^(bits - 1) - 1), 
+ * evaluated in single precision, or 0 if max == min. This is the same 
+ * specification as quantize_features() in audio_processing.py, so the model
+ * input matches the training features bit for bit.
+ * 
+ * bits is the range of the training features (input_bits of 
+ * preprocess_audio), independent of the output type: an int16_t model input 
+ * with bits = 8 holds the same values as the int8_t one.
+ * 
+ * @param values [in] MFCC values.
+ * @param num_values [in] Number of values.
+ * @param min_value [in] Minimum of the values.
+ * @param max_value [in] Maximum of the values.
+ * @param exponent [in] Exponent of the model input.
+ * @param bits [in] Bits of the value range, 8 or 16 (at most output_bits).
+ * @param output_bits [in] 8 (output is int8_t) or 16 (output is int16_t).
+ * @param output [out] Buffer for num_values quantized values.
+ * 
+ * @return Error values according to ESP-IDF coding style.
+*/
+esp_err_t mfcc_quantize(const float *values, size_t num_values, 
+                        float min_value, float max_value, int exponent, 
+                        int bits, int output_bits, void *output);
+
+/**
+ * @brief Fixed-point counterpart of mfcc_quantize(). Values are converted to
+ * float (exactly) before quantization, so the result equals mfcc_quantize() 
+ * of the dequantized values.
+*/
+esp_err_t mfcc_fixed_quantize(const int16_t *values, size_t num_values, 
+                              int16_t min_value, int16_t max_value, 
+                              int exponent, int bits, int output_bits, 
+                              void *output);
 
 /**
  * @brief Free memory allocated for MFCC preprocessing module.
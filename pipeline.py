@@ -18,12 +18,25 @@ logger = logging.getLogger(__name__)
 PATH = pathlib.Path(__file__).parent.resolve()
 
 DURATION = 5
+SLICE_HOP = 2.5
+MIN_RMS_DB = -40
 NUM_SPECIES = 3
 SAMPLE_RATE = 16000
+MFCC_FIXED_POINT = False  # Match CONFIG_MFCC_FIXED_POINT of the ESP32 build
+MFCC_BACKEND = "c"  # "c" (preprocess.cpp) or "numpy" (no C library needed)
+INPUT_EXPONENT = -7  # Match input_exponent of src/esp32/main.cpp
+INPUT_BITS = 8  # Match INPUT_BITS of src/esp32/main.cpp (for int8 and int16)
+CALIBRATION_SAMPLES = 2048  # Max. number of calibration samples
+CALIBRATION_CONVERGENCE = False  # Report the convergence of calibration ranges
+BENCHMARK_DATASET = False  # Report the input pipeline throughput before training
+NUM_WORKERS = os.cpu_count()
 
 DATA_DIR = PATH / "data"
 AUDIO_DIR = DATA_DIR / "audio"
+PCM_DIR = DATA_DIR / f"pcm_{SAMPLE_RATE}"
 ANNOTATION_PATH = DATA_DIR / "annotation.csv"
+SLICED_ANNOTATION_PATH = DATA_DIR / "annotation_sliced.csv"
+API_CACHE_DIR = DATA_DIR / "xeno_canto_cache"
 MODEL_DIR = PATH / "src" / "model"
 TEMPLATE_DIR = PATH / "src" / "templates"
 
@@ -65,13 +78,9 @@ if __name__ == "__main__":
             logger.info("Removing existing annotation file.")
             os.remove(ANNOTATION_PATH)
 
-        if os.path.isfile(DATA_DIR / H5FILE):
-            logger.info("Removing existing h5 file.")
-            os.remove(DATA_DIR / H5FILE)
-
         # Download xeno canto audio
         species_map = xeno_canto.download_xeno_canto_audio(
-            query, NUM_SPECIES, AUDIO_DIR, ANNOTATION_PATH, ASSETS_DIR
+            query, NUM_SPECIES, AUDIO_DIR, ANNOTATION_PATH, ASSETS_DIR, API_CACHE_DIR
         )
 
         # Download esc50 audio
@@ -90,9 +99,36 @@ if __name__ == "__main__":
     else:
         logger.info("Audio files already downloaded.")
 
-    # Convert audio signal to MFCC
+    # Decode and resample audio files once to 16 kHz PCM
+    audio_processing.transcode_audio(
+        AUDIO_DIR, PCM_DIR, ANNOTATION_PATH, SAMPLE_RATE, num_workers=NUM_WORKERS
+    )
+
+    # Cut recordings into overlapping windows, skipping near-silent ones
+    audio_processing.slice_audio(
+        ANNOTATION_PATH,
+        SLICED_ANNOTATION_PATH,
+        PCM_DIR,
+        SAMPLE_RATE,
+        DURATION,
+        SLICE_HOP,
+        min_rms_db=MIN_RMS_DB,
+    )
+
+    # Convert audio signal to MFCC (only new or changed audio files)
     audio_processing.preprocess_audio(
-        DATA_DIR, AUDIO_DIR, ANNOTATION_PATH, SAMPLE_RATE, DURATION, H5FILE
+        DATA_DIR,
+        AUDIO_DIR,
+        SLICED_ANNOTATION_PATH,
+        SAMPLE_RATE,
+        DURATION,
+        H5FILE,
+        num_workers=NUM_WORKERS,
+        pcm_dir=PCM_DIR,
+        fixed_point=MFCC_FIXED_POINT,
+        input_exponent=INPUT_EXPONENT,
+        input_bits=INPUT_BITS,
+        backend=MFCC_BACKEND,
     )
 
     # Generate datasets
@@ -100,9 +136,13 @@ if __name__ == "__main__":
     mfcc_shape = mfcc_example.squeeze().shape
 
     train_dataset, test_dataset, train_size, test_size = tensorflow.get_dataset(
-        DATA_DIR, ANNOTATION_PATH, H5FILE, mfcc_shape
+        DATA_DIR, SLICED_ANNOTATION_PATH, H5FILE, mfcc_shape
     )
 
+    # Measure input pipeline throughput (samples/sec)
+    if BENCHMARK_DATASET:
+        tensorflow.benchmark_dataset(train_dataset)
+
     # Initialize model
     birdnet_model = birdnet.birdnet_model(MODEL_NAME, mfcc_shape, NUM_SPECIES + 1)
     birdnet_model.summary()
@@ -123,6 +163,32 @@ if __name__ == "__main__":
     target_chip = "esp32s3"
     granularity = "per-tensor"
 
+    # Read the datasets once for all evaluations
+    eval_datasets = {
+        "train": quantization.materialize_dataset(train_dataset),
+        "test": quantization.materialize_dataset(test_dataset),
+    }
+
+    # Convert the trained model to onnx once for all bit widths (cached per checkpoint)
+    model_proto = quantization.convert_model(birdnet_model, MODEL_DIR, MODEL_NAME)
+
+    # Stream a stratified sub-sample of the test dataset for calibration
+    labels = pd.read_csv(SLICED_ANNOTATION_PATH).sort_values("idx")["class_id"]
+    calibration_reader = quantization.CalibrationReader(
+        DATA_DIR / H5FILE,
+        labels.to_numpy(),
+        range(train_size, train_size + test_size),
+        num_samples=CALIBRATION_SAMPLES,
+    )
+    calibration_data = quantization.load_calibration_data(
+        MODEL_DIR, MODEL_NAME, calibration_reader
+    )
+    if CALIBRATION_CONVERGENCE:
+        # Extra inference pass over the calibration data, in stream order
+        quantization.calibration_convergence(
+            model_proto, quantization.iterate_batches(calibration_data)
+        )
+
     # Quantize and evaluate model
     for quantization_bit in ["int8", "int16"]:
 
@@ -135,7 +201,8 @@ if __name__ == "__main__":
             MODEL_NAME,
             quantization_bit,
             calibrator=calibrator,
-            calibration_dataset=test_dataset,
+            calibration_dataset=calibration_data,
+            model_proto=model_proto,
         )
 
         # visualization.plot_quantized_confusion_matrices(
@@ -151,19 +218,23 @@ if __name__ == "__main__":
         #     class_names=["WR", "CW", "CB", "Other"],
         # )
 
-        acc_train, acc_train_quant = quantization.evaluate_model(
+        results = quantization.evaluate_model(
             MODEL_DIR,
             MODEL_NAME,
             quantization_bit,
-            train_dataset,
-            train_size,
+            eval_datasets,
             evaluator,
+            num_classes=NUM_SPECIES + 1,
+            granularity=granularity,
         )
-        acc_test, acc_test_quant = quantization.evaluate_model(
-            MODEL_DIR, MODEL_NAME, quantization_bit, test_dataset, test_size, evaluator
-        )
 
-        evaluation = f"acc_train: {acc_train}, acc_train_quant: {acc_train_quant}, acc_test: {acc_test}, acc_test_quant: {acc_test_quant}"
+        for name, result in results.items():
+            for model_type, metrics in result.items():
+                logger.info(
+                    f"{quantization_bit} {name} {model_type}: f1 per class {metrics['f1']}, confusion matrix\n{metrics['confusion_matrix']}"
+                )
+
+        evaluation = f"acc_train: {results['train']['float']['accuracy']}, acc_train_quant: {results['train']['quantized']['accuracy']}, acc_test: {results['test']['float']['accuracy']}, acc_test_quant: {results['test']['quantized']['accuracy']}"
 
         # Extract NN layer information
         input_exponent, layer_information = template_constructor.get_layer_information(
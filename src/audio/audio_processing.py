@@ -6,82 +6,595 @@
 # This file provides the functions for preprocessing audio files.
 #
 # IMPORTANT:
-# Follow the instructions in src/audio/setup.py and set the correct path to the C library.
+# Follow the instructions in src/audio/setup.py to build the C library, or use
+# the NumPy backend (backend="numpy"), which does not need it.
 
 import os
+import json
 import h5py
 import ctypes
+import functools
+import hashlib
 import librosa
+import multiprocessing
 import pathlib
 import numpy as np
 import pandas as pd
-from typing import List
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Path to C library
-# CDLL = "build/lib.macosx-10.9-x86_64-cpython-38/preprocess.cpython-38-darwin.so"
-CDLL = "build/lib.linux-x86_64-cpython-38/preprocess.cpython-38-x86_64-linux-gnu.so"
+# Path to C library, e.g.
+# "build/lib.linux-x86_64-cpython-38/preprocess.cpython-38-x86_64-linux-gnu.so".
+# If None, the newest build of src/audio/setup.py is used (see _find_library).
+CDLL = os.environ.get("PREPROCESS_CDLL")
 
+# Parameters of preprocess.cpp, mirrored by the NumPy backend (see mfcc_numpy_batch)
+SAMPLE_RATE = 16000
+HOP_LENGTH_SAMPLES = 256
+WIN_LENGTH_SAMPLES = 1024
+N_MELS = 40
+N_MFCC = 32
 
-def mfcc(audio_data: np.array):
-    """Compute MFCC features via C interface.
+BACKENDS = ("c", "numpy")
 
-    :param audio_data: raw audio data
-    :return: MFCC features
+
+def _find_library() -> str:
+    """Find the C library built by src/audio/setup.py (or the gcc command in
+    preprocess.cpp) in the repository, independent of platform and Python version.
+
+    :raises FileNotFoundError: if the C library is not built
+    :return: path of the newest build
+    """
+    root = pathlib.Path(__file__).resolve().parents[2]
+    candidates = list(root.glob("build/lib.*/preprocess*.so"))
+    candidates += list(root.glob("src/audio/preprocess*.so"))
+    if not candidates:
+        raise FileNotFoundError(
+            "C library not found, build it with src/audio/setup.py, set "
+            "PREPROCESS_CDLL or use the NumPy backend"
+        )
+    return str(max(candidates, key=os.path.getmtime))
+
+
+@functools.lru_cache(maxsize=None)
+def _load_library() -> ctypes.CDLL:
+    """Load the C library once and declare the signatures of its interface.
+
+    :return: loaded C library
     """
 
-    lib = ctypes.CDLL(CDLL)
+    lib = ctypes.CDLL(CDLL if CDLL is not None else _find_library())
+
+    lib.get_num_mfcc.restype = ctypes.c_size_t
+    lib.get_num_mels.restype = ctypes.c_size_t
+    lib.get_hop_length.restype = ctypes.c_size_t
+    lib.get_win_length.restype = ctypes.c_size_t
+    lib.get_num_frames.argtypes = [ctypes.c_size_t]
+    lib.get_num_frames.restype = ctypes.c_size_t
+    lib.get_mfcc_fixed_exponent.restype = ctypes.c_int
 
     lib.mfcc.argtypes = [
-        ctypes.POINTER(ctypes.c_int16),
+        np.ctypeslib.ndpointer(dtype=np.int16, ndim=1, flags="C_CONTIGUOUS"),
         ctypes.c_size_t,
-        ctypes.POINTER(ctypes.POINTER(ctypes.POINTER(ctypes.c_float))),
+        np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags="C_CONTIGUOUS"),
         ctypes.POINTER(ctypes.c_size_t),
     ]
-
     lib.mfcc.restype = ctypes.c_int
 
-    audio_data = np.array(audio_data, dtype=np.int16)
-    audio_values_ptr = ctypes.cast(
-        audio_data.ctypes.data, ctypes.POINTER(ctypes.c_int16)
-    )
+    lib.mfcc_batch.argtypes = [
+        np.ctypeslib.ndpointer(dtype=np.int16, ndim=2, flags="C_CONTIGUOUS"),
+        ctypes.c_size_t,
+        ctypes.c_size_t,
+        np.ctypeslib.ndpointer(dtype=np.float32, ndim=3, flags="C_CONTIGUOUS"),
+    ]
+    lib.mfcc_batch.restype = ctypes.c_int
+
+    lib.mfcc_fixed_batch.argtypes = [
+        np.ctypeslib.ndpointer(dtype=np.int16, ndim=2, flags="C_CONTIGUOUS"),
+        ctypes.c_size_t,
+        ctypes.c_size_t,
+        np.ctypeslib.ndpointer(dtype=np.int16, ndim=3, flags="C_CONTIGUOUS"),
+    ]
+    lib.mfcc_fixed_batch.restype = ctypes.c_int
+
+    lib.mfcc_stream_push.argtypes = [
+        np.ctypeslib.ndpointer(dtype=np.int16, ndim=1, flags="C_CONTIGUOUS"),
+        ctypes.c_size_t,
+        np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags="C_CONTIGUOUS"),
+        ctypes.c_size_t,
+        ctypes.POINTER(ctypes.c_size_t),
+    ]
+    lib.mfcc_stream_push.restype = ctypes.c_int
+
+    lib.mel_stream_push.argtypes = lib.mfcc_stream_push.argtypes
+    lib.mel_stream_push.restype = ctypes.c_int
+
+    lib.mfcc_stream_normalize.argtypes = [
+        np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags="C_CONTIGUOUS"),
+        ctypes.c_size_t,
+        np.ctypeslib.ndpointer(dtype=np.float32, ndim=2, flags="C_CONTIGUOUS"),
+    ]
+    lib.mfcc_stream_normalize.restype = ctypes.c_int
+
+    lib.mel_fixed_stream_push.argtypes = [
+        np.ctypeslib.ndpointer(dtype=np.int16, ndim=1, flags="C_CONTIGUOUS"),
+        ctypes.c_size_t,
+        np.ctypeslib.ndpointer(dtype=np.int32, ndim=2, flags="C_CONTIGUOUS"),
+        ctypes.c_size_t,
+        ctypes.POINTER(ctypes.c_size_t),
+    ]
+    lib.mel_fixed_stream_push.restype = ctypes.c_int
+
+    lib.mfcc_fixed_stream_normalize.argtypes = [
+        np.ctypeslib.ndpointer(dtype=np.int32, ndim=2, flags="C_CONTIGUOUS"),
+        ctypes.c_size_t,
+        np.ctypeslib.ndpointer(dtype=np.int16, ndim=2, flags="C_CONTIGUOUS"),
+    ]
+    lib.mfcc_fixed_stream_normalize.restype = ctypes.c_int
+
+    return lib
+
+
+def mfcc(audio_data: np.array, out: np.array = None) -> np.array:
+    """Compute MFCC features via C interface.
+
+    The C library writes the features directly into a contiguous float32
+    buffer of shape (frames, N_MFCC), so no per-element copy is needed.
+
+    :param audio_data: raw audio data
+    :param out: optional preallocated (frames, N_MFCC) float32 buffer
+    :return: MFCC features
+    """
+
+    lib = _load_library()
+
+    audio_data = np.ascontiguousarray(audio_data, dtype=np.int16)
+    num_frames = lib.get_num_frames(len(audio_data))
+    num_mfcc = lib.get_num_mfcc()
+
+    if out is None:
+        out = np.empty((num_frames, num_mfcc), dtype=np.float32)
+    assert out.shape == (num_frames, num_mfcc), "out has wrong shape"
 
     output_frames = ctypes.c_size_t()
-    output = ctypes.POINTER(ctypes.POINTER(ctypes.c_float))()
 
     lib.malloc_mfcc_module()
-    lib.mfcc(
-        audio_values_ptr,
-        len(audio_data),
-        ctypes.byref(output),
-        ctypes.byref(output_frames),
-    )
+    ret = lib.mfcc(audio_data, len(audio_data), out, ctypes.byref(output_frames))
+    lib.free_mfcc_module()
+
+    if ret != 0:
+        raise RuntimeError(f"MFCC computation failed with error {ret}")
+
+    return out
+
+
+def mfcc_batch(clips: np.array, out: np.array = None) -> np.array:
+    """Compute MFCC features of equally long clips with a single C call.
+
+    :param clips: raw audio data of shape (clips, samples)
+    :param out: optional preallocated (clips, frames, N_MFCC) float32 buffer
+    :return: MFCC features of shape (clips, frames, N_MFCC)
+    """
+
+    lib = _load_library()
+
+    clips = np.ascontiguousarray(clips, dtype=np.int16)
+    num_clips, num_samples = clips.shape
+    num_frames = lib.get_num_frames(num_samples)
+    num_mfcc = lib.get_num_mfcc()
+
+    if out is None:
+        out = np.empty((num_clips, num_frames, num_mfcc), dtype=np.float32)
+    assert out.shape == (num_clips, num_frames, num_mfcc), "out has wrong shape"
+
+    lib.malloc_mfcc_module()
+    ret = lib.mfcc_batch(clips, num_clips, num_samples, out)
+    lib.free_mfcc_module()
+
+    if ret != 0:
+        raise RuntimeError(f"MFCC computation failed with error {ret}")
+
+    return out
+
+
+def mfcc_fixed_batch(clips: np.array) -> np.array:
+    """Compute MFCC features of equally long clips with the fixed-point pipeline
+    of the ESP32. The C library is bit-exact with the device, so this simulates
+    the features seen by the deployed model.
+
+    :param clips: raw audio data of shape (clips, samples)
+    :return: MFCC features of shape (clips, frames, N_MFCC), dequantized to float32
+    """
+
+    lib = _load_library()
+
+    clips = np.ascontiguousarray(clips, dtype=np.int16)
+    num_clips, num_samples = clips.shape
+    num_frames = lib.get_num_frames(num_samples)
+    num_mfcc = lib.get_num_mfcc()
+
+    out = np.empty((num_clips, num_frames, num_mfcc), dtype=np.int16)
+
+    lib.malloc_mfcc_module()
+    ret = lib.mfcc_fixed_batch(clips, num_clips, num_samples, out)
     lib.free_mfcc_module()
 
-    num_mfcc = int(lib.get_num_mfcc())
+    if ret != 0:
+        raise RuntimeError(f"MFCC computation failed with error {ret}")
+
+    return np.ldexp(out, lib.get_mfcc_fixed_exponent(), dtype=np.float32)
+
+
+def mfcc_stream(
+    chunks: Iterable[np.array],
+    max_frames: int = None,
+    normalize: bool = False,
+    fixed: bool = False,
+) -> np.array:
+    """Compute MFCC features of a signal delivered in chunks via the streaming
+    C interface, as done on the ESP32 while recording.
+
+    :param chunks: consecutive chunks of raw audio data
+    :param max_frames: max. number of frames, defaults to None (unlimited)
+    :param normalize: compute the features as if the signal had been peak
+        normalized like the training clips (see _load_audio), defaults to False
+    :param fixed: use the fixed-point pipeline (requires normalize), defaults to False
+    :return: MFCC features of shape (frames, N_MFCC), dequantized to float32 if fixed
+    """
+
+    lib = _load_library()
+    num_mfcc = lib.get_num_mfcc()
+    hop_length = lib.get_hop_length()
+
+    if normalize:
+        # Log mel energies are kept until the peak of the signal is known
+        num_values, dtype = lib.get_num_mels(), np.int32 if fixed else np.float32
+        push = lib.mel_fixed_stream_push if fixed else lib.mel_stream_push
+    else:
+        assert not fixed, "fixed requires normalize"
+        num_values, dtype, push = num_mfcc, np.float32, lib.mfcc_stream_push
+
+    frames = []
+    num_frames = 0
+    output_frames = ctypes.c_size_t()
+
+    lib.malloc_mfcc_module()
+    lib.mfcc_stream_reset()
+
+    try:
+        for chunk in chunks:
+            chunk = np.ascontiguousarray(chunk, dtype=np.int16)
+            capacity = len(chunk) // hop_length + 1
+            if max_frames is not None:
+                capacity = min(capacity, max_frames - num_frames)
+
+            out = np.empty((capacity, num_values), dtype=dtype)
+            ret = push(chunk, len(chunk), out, capacity, ctypes.byref(output_frames))
+            if ret != 0:
+                raise RuntimeError(f"MFCC computation failed with error {ret}")
+
+            frames.append(out[: output_frames.value])
+            num_frames += output_frames.value
+
+        frames = np.concatenate(frames) if frames else np.empty((0, num_values), dtype)
+
+        if normalize:
+            mels = np.ascontiguousarray(frames)
+            frames = np.empty((len(mels), num_mfcc), np.int16 if fixed else np.float32)
+            if fixed:
+                ret = lib.mfcc_fixed_stream_normalize(mels, len(mels), frames)
+            else:
+                ret = lib.mfcc_stream_normalize(mels, len(mels), frames)
+            if ret != 0:
+                raise RuntimeError(f"MFCC computation failed with error {ret}")
+
+    finally:
+        lib.free_mfcc_module()
+
+    if fixed:
+        return np.ldexp(frames, lib.get_mfcc_fixed_exponent(), dtype=np.float32)
+    return frames
+
+
+def _hann_window(win_length: int) -> np.array:
+    """Symmetric Hann window as computed by dsps_wind_hann_f32.
+
+    :param win_length: window length
+    :return: float32 window
+    """
+    len_mult = np.float32(1) / np.float32(win_length - 1)
+    angle = np.arange(win_length) * 2 * np.pi * np.float64(len_mult)
+    cos = np.cos(angle.astype(np.float32).astype(np.float64)).astype(np.float32)
+    return (0.5 * (1 - cos.astype(np.float64))).astype(np.float32)
+
 
-    mfcc = np.zeros((output_frames.value, num_mfcc))
+@functools.lru_cache(maxsize=None)
+def _mel_filters(sampling_rate: int, num_fft: int, num_mels: int) -> np.array:
+    """Mel filter bank as computed by mel_filters in preprocess.cpp: HTK mel
+    scale from 0 Hz to Nyquist, triangular filters with Slaney normalization.
+
+    :param sampling_rate: sampling_rate
+    :param num_fft: FFT length
+    :param num_mels: number of mel bands
+    :return: float32 weights of shape (num_fft // 2 + 1, num_mels)
+    """
+    h = np.float32(sampling_rate) / np.float32(num_fft)
+    fft_freq = (np.arange(num_fft // 2 + 1, dtype=np.float32) * h).astype(np.float64)
+
+    max_mel = 2595.0 * np.log10(1.0 + (sampling_rate // 2) / 700.0)
+    mel_freq = np.arange(num_mels + 2) * max_mel / (num_mels + 1)
+    mel_freq = 700.0 * (10.0 ** (mel_freq / 2595.0) - 1.0)
+
+    lower = mel_freq[np.newaxis, :-2]
+    center = mel_freq[np.newaxis, 1:-1]
+    upper = mel_freq[np.newaxis, 2:]
+    freq = fft_freq[:, np.newaxis]
+
+    rising = ((freq - lower) / (center - lower)).astype(np.float32)
+    falling = ((upper - freq) / (upper - center)).astype(np.float32)
+    weights = np.where(freq < center, rising, falling).astype(np.float64)
+    weights = (weights * (2.0 / (upper - lower))).astype(np.float32)
+
+    return np.where((freq >= lower) & (freq <= upper), weights, np.float32(0))
 
-    for i in range(output_frames.value):
-        for j in range(num_mfcc):
-            mfcc[i][j] = output[i][j]
 
-    return mfcc
+@functools.lru_cache(maxsize=None)
+def _dct_basis(num_mfcc: int, num_mels: int) -> np.array:
+    """Orthonormal DCT-II basis as computed by dct_basis in preprocess.cpp,
+    without the first coefficient. Rows are premultiplied by 2, the remaining
+    scaling is sqrt(1 / (2 * num_mels)).
+
+    :param num_mfcc: number of kept coefficients
+    :param num_mels: number of mel bands
+    :return: float32 basis of shape (num_mfcc, num_mels)
+    """
+    factor = np.float32(np.pi / (2 * num_mels))
+    i = np.arange(1, num_mfcc + 1, dtype=np.float32)[:, np.newaxis]
+    j = np.arange(num_mels, dtype=np.float32)[np.newaxis, :]
+    angle = (factor * i * (2 * j + 1)).astype(np.float64)
+    return 2 * np.cos(angle).astype(np.float32)
 
 
-def _load_audio(audio_path: pathlib.Path, sampling_rate: int, duration: int):
+def _get_frame_starts(num_samples: int, hop_length: int, win_length: int) -> np.array:
+    """Get the first sample of each frame as in preprocess.cpp (no padding,
+    get_num_frames frames).
+
+    :param num_samples: number of samples of a clip
+    :param hop_length: hop between frames in samples
+    :param win_length: frame length in samples
+    :return: frame starts
+    """
+    num_frames = max(num_samples - win_length, 0) // hop_length
+    return np.arange(num_frames) * hop_length
+
+
+def _frame_power_spectra(
+    clips: np.array, starts: np.array, win_length: int = WIN_LENGTH_SAMPLES
+) -> np.array:
+    """Power spectra of the windowed frames of equally long clips.
+
+    :param clips: raw audio data of shape (clips, samples)
+    :param starts: first sample of each frame
+    :param win_length: frame length in samples (FFT length)
+    :return: float32 power spectra of shape (clips, frames, win_length // 2 + 1)
+    """
+    clips = np.asarray(clips, dtype=np.int16)
+
+    frames = np.lib.stride_tricks.sliding_window_view(clips, win_length, axis=1)
+    frames = frames[:, starts]
+    frames = frames * (_hann_window(win_length) / np.float32(np.iinfo(np.int16).max))
+
+    spectra = np.fft.rfft(frames.astype(np.float32), axis=-1)
+    return np.square(spectra.real) + np.square(spectra.imag)
+
+
+def _power_spectra(
+    clips: np.array,
+    hop_length: int = HOP_LENGTH_SAMPLES,
+    win_length: int = WIN_LENGTH_SAMPLES,
+) -> np.array:
+    """Power spectra of the windowed frames of equally long clips, framed as
+    in preprocess.cpp.
+
+    :param clips: raw audio data of shape (clips, samples)
+    :param hop_length: hop between frames in samples
+    :param win_length: frame length in samples (FFT length)
+    :return: float32 power spectra of shape (clips, frames, win_length // 2 + 1)
+    """
+    starts = _get_frame_starts(np.shape(clips)[1], hop_length, win_length)
+    return _frame_power_spectra(clips, starts, win_length)
+
+
+def _power_to_mel_db(
+    power: np.array, sampling_rate: int = SAMPLE_RATE, num_mels: int = N_MELS
+) -> np.array:
+    """Mel filter bank and dB conversion of power spectra, as in mfcc_frame
+    of preprocess.cpp.
+
+    :param power: power spectra of shape (..., num_fft // 2 + 1)
+    :param sampling_rate: sampling_rate
+    :param num_mels: number of mel bands
+    :return: float32 log mel energies of shape (..., num_mels)
+    """
+    num_fft = 2 * (power.shape[-1] - 1)
+    mel_weights = _mel_filters(sampling_rate, num_fft, num_mels)
+
+    # Mel energies are accumulated in double precision as in preprocess.cpp
+    mel_power = np.matmul(power, mel_weights, dtype=np.float64)
+    return (10.0 * np.log10(np.maximum(mel_power, 1e-10))).astype(np.float32)
+
+
+def _mel_db_to_mfcc(mel_db: np.array, num_mfcc: int = N_MFCC) -> np.array:
+    """DCT of log mel energies, as in mfcc_frame of preprocess.cpp.
+
+    :param mel_db: log mel energies of shape (..., num_mels)
+    :param num_mfcc: number of MFCC coefficients
+    :return: float32 MFCC features of shape (..., num_mfcc)
+    """
+    num_mels = mel_db.shape[-1]
+    mfcc = np.matmul(mel_db, _dct_basis(num_mfcc, num_mels).T)
+    return (np.sqrt(1.0 / (2 * num_mels)) * mfcc).astype(np.float32)
+
+
+def _power_to_mfcc(
+    power: np.array,
+    sampling_rate: int = SAMPLE_RATE,
+    num_mels: int = N_MELS,
+    num_mfcc: int = N_MFCC,
+) -> np.array:
+    """Mel filter bank, dB conversion and DCT of power spectra, as in
+    mfcc_frame of preprocess.cpp.
+
+    :param power: power spectra of shape (..., num_fft // 2 + 1)
+    :param sampling_rate: sampling_rate
+    :param num_mels: number of mel bands
+    :param num_mfcc: number of MFCC coefficients
+    :return: float32 MFCC features of shape (..., num_mfcc)
+    """
+    return _mel_db_to_mfcc(_power_to_mel_db(power, sampling_rate, num_mels), num_mfcc)
+
+
+def mfcc_numpy_batch(clips: np.array, out: np.array = None) -> np.array:
+    """Compute MFCC features of equally long clips in NumPy, vectorized over
+    clips and frames. Reproduces the float pipeline of preprocess.cpp (same
+    window, framing, mel filter bank, dB and DCT conventions) up to float32
+    rounding, so it needs no C library and serves as reference for it.
+
+    :param clips: raw audio data of shape (clips, samples)
+    :param out: optional preallocated (clips, frames, N_MFCC) float32 buffer
+    :return: MFCC features of shape (clips, frames, N_MFCC)
+    """
+    mfcc = _power_to_mfcc(_power_spectra(clips))
+
+    if out is None:
+        return mfcc
+    assert out.shape == mfcc.shape, "out has wrong shape"
+    out[...] = mfcc
+    return out
+
+
+def _mfcc_features(
+    clips: np.array, backend: str = "c", fixed_point: bool = False
+) -> np.array:
+    """Compute MFCC features of equally long clips with the given backend.
+
+    :param clips: raw audio data of shape (clips, samples)
+    :param backend: "c" (preprocess.cpp) or "numpy", defaults to "c"
+    :param fixed_point: use the fixed-point pipeline of the ESP32, defaults to False
+    :raises ValueError: if the backend is unknown or does not support fixed_point
+    :return: MFCC features of shape (clips, frames, N_MFCC)
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}")
+    if backend == "numpy":
+        if fixed_point:
+            raise ValueError("The fixed-point pipeline requires the C backend")
+        return mfcc_numpy_batch(clips)
+    return mfcc_fixed_batch(clips) if fixed_point else mfcc_batch(clips)
+
+
+def _get_feature_config(config: Dict) -> Dict:
+    """Complete a feature configuration of a parameter sweep with the
+    parameters of preprocess.cpp.
+
+    :param config: any of hop_length, win_length, num_mels and num_mfcc
+    :raises ValueError: if the configuration is invalid
+    :return: complete feature configuration
+    """
+    defaults = {
+        "hop_length": HOP_LENGTH_SAMPLES,
+        "win_length": WIN_LENGTH_SAMPLES,
+        "num_mels": N_MELS,
+        "num_mfcc": N_MFCC,
+    }
+    unknown = set(config) - set(defaults)
+    if unknown:
+        raise ValueError(f"Unknown feature parameters {sorted(unknown)}")
+
+    config = {**defaults, **config}
+    if config["num_mfcc"] >= config["num_mels"]:
+        raise ValueError("num_mfcc must be less than num_mels")
+    return config
+
+
+def get_config_name(config: Dict) -> str:
+    """Get the name of a feature configuration, e.g. "hop256_win1024_mels40_mfcc32",
+    which is also its group in the HDF5 file of preprocess_sweep.
+
+    :param config: feature configuration (see _get_feature_config)
+    :return: name of the configuration
+    """
+    config = _get_feature_config(config)
+    return (
+        f"hop{config['hop_length']}_win{config['win_length']}"
+        f"_mels{config['num_mels']}_mfcc{config['num_mfcc']}"
+    )
+
+
+def mfcc_sweep_batch(
+    clips: np.array, configs: List[Dict], sampling_rate: int = SAMPLE_RATE
+) -> Dict[str, np.array]:
+    """Compute MFCC features of equally long clips for several feature
+    configurations with the NumPy backend (see mfcc_numpy_batch).
+
+    Shared stages are computed once: configurations with the same window
+    length share the power spectra of the union of their frames, and
+    configurations with the same hop length and number of mel bands also
+    share the log mel energies.
+
+    :param clips: raw audio data of shape (clips, samples)
+    :param configs: feature configurations (see _get_feature_config)
+    :param sampling_rate: sampling_rate, defaults to SAMPLE_RATE
+    :return: MFCC features of shape (clips, frames, num_mfcc) by configuration name
+    """
+    configs = [_get_feature_config(config) for config in configs]
+    num_samples = np.shape(clips)[1]
+
+    features = {}
+    for win_length in sorted({config["win_length"] for config in configs}):
+        group = [config for config in configs if config["win_length"] == win_length]
+
+        frame_starts = {
+            hop_length: _get_frame_starts(num_samples, hop_length, win_length)
+            for hop_length in {config["hop_length"] for config in group}
+        }
+        starts = np.unique(np.concatenate(list(frame_starts.values())))
+        power = _frame_power_spectra(clips, starts, win_length)
+
+        mel_db = {}
+        for config in group:
+            hop_length, num_mels = config["hop_length"], config["num_mels"]
+            if (hop_length, num_mels) not in mel_db:
+                frames = np.searchsorted(starts, frame_starts[hop_length])
+                mel_db[hop_length, num_mels] = _power_to_mel_db(
+                    power[:, frames], sampling_rate, num_mels
+                )
+
+            features[get_config_name(config)] = _mel_db_to_mfcc(
+                mel_db[hop_length, num_mels], config["num_mfcc"]
+            )
+
+    return features
+
+
+def _load_audio(
+    audio_path: pathlib.Path, sampling_rate: int, duration: int, offset: float = 0.0
+):
     """Load audio file, normalize and convert to int16.
 
     :param audio_path: audio file path
     :param sampling_rate: sampling_rate
     :param duration: duration in seconds
+    :param offset: start in seconds, defaults to 0.0
     :return: audio data
     """
-    y, sr = librosa.load(audio_path, sr=sampling_rate, duration=duration, mono=True)
+    y, sr = librosa.load(
+        audio_path, sr=sampling_rate, offset=offset, duration=duration, mono=True
+    )
     y = librosa.util.fix_length(y, size=int(sampling_rate * duration))
     y = y / np.max(np.abs(y))
     y = np.round(y * 32767).astype(np.int16)
@@ -89,12 +602,214 @@ def _load_audio(audio_path: pathlib.Path, sampling_rate: int, duration: int):
     return y
 
 
+def _load_pcm(
+    pcm_path: pathlib.Path, sampling_rate: int, duration: int, offset: float = 0.0
+):
+    """Load transcoded PCM audio (see transcode_audio), normalize and convert to int16.
+
+    :param pcm_path: PCM .npy file path
+    :param sampling_rate: sampling_rate of the PCM file
+    :param duration: duration in seconds
+    :param offset: start in seconds, defaults to 0.0
+    :return: audio data
+    """
+    size = int(sampling_rate * duration)
+    start = int(round(sampling_rate * offset))
+    y = np.load(pcm_path, mmap_mode="r")[start : start + size].astype(np.float32)
+    y = np.pad(y, (0, size - len(y)))
+    y = y / np.max(np.abs(y))
+    y = np.round(y * 32767).astype(np.int16)
+
+    return y
+
+
+def _load_clip(path: str, sampling_rate: int, duration: int, offset: float = 0.0):
+    """Load audio from a transcoded PCM file (.npy) or an audio file.
+
+    :param path: PCM or audio file path
+    :param sampling_rate: sampling_rate
+    :param duration: duration in seconds
+    :param offset: start in seconds, defaults to 0.0
+    :return: audio data
+    """
+    if str(path).endswith(".npy"):
+        return _load_pcm(path, sampling_rate, duration, offset)
+    return _load_audio(path, sampling_rate, duration, offset)
+
+
+def _get_pcm_path(pcm_dir: pathlib.Path, file_name: str) -> str:
+    """Get the path of the transcoded PCM file of an audio file.
+
+    :param pcm_dir: PCM directory
+    :param file_name: audio file name
+    :return: PCM file path
+    """
+    return os.path.join(pcm_dir, f"{file_name}.npy")
+
+
+def _transcode_audio(paths: Tuple[str, str], sampling_rate: int) -> None:
+    """Decode and resample an audio file to normalized mono int16 PCM.
+
+    :param paths: audio file path and PCM file path
+    :param sampling_rate: sampling_rate
+    """
+    audio_path, pcm_path = paths
+    y, _ = librosa.load(audio_path, sr=sampling_rate, mono=True)
+    y = y / np.max(np.abs(y))
+    y = np.round(y * 32767).astype(np.int16)
+
+    tmp_path = pcm_path + ".tmp"
+    with open(tmp_path, "wb") as file:
+        np.save(file, y)
+    os.replace(tmp_path, pcm_path)
+
+
+def transcode_audio(
+    audio_dir: pathlib.Path,
+    pcm_dir: pathlib.Path,
+    annotation_path: pathlib.Path,
+    sampling_rate: int,
+    num_workers: int = 1,
+) -> None:
+    """Transcode all audio files once to normalized mono int16 PCM.
+
+    Each file is decoded and resampled in full and stored as .npy file in
+    pcm_dir, which can be memory-mapped. Files whose PCM file is newer than
+    the audio file are skipped.
+
+    :param audio_dir: audio directory
+    :param pcm_dir: PCM directory, specific to sampling_rate
+    :param annotation_path: annotation file path
+    :param sampling_rate: sampling_rate
+    :param num_workers: number of worker processes, defaults to 1
+    """
+
+    os.makedirs(pcm_dir, exist_ok=True)
+    df = pd.read_csv(annotation_path)
+
+    jobs = []
+    for file_name in df["file_name"].unique():
+        audio_path = os.path.join(audio_dir, file_name)
+        pcm_path = _get_pcm_path(pcm_dir, file_name)
+        if not os.path.isfile(pcm_path) or os.path.getmtime(
+            pcm_path
+        ) < os.path.getmtime(audio_path):
+            jobs.append((audio_path, pcm_path))
+
+    logger.info(f"Transcoding {len(jobs)} audio files to PCM")
+
+    worker_fn = functools.partial(_transcode_audio, sampling_rate=sampling_rate)
+    if num_workers > 1:
+        with multiprocessing.Pool(num_workers) as pool:
+            pool.map(worker_fn, jobs, chunksize=16)
+    else:
+        for job in jobs:
+            worker_fn(job)
+
+
+def _get_offsets(df: pd.DataFrame) -> np.array:
+    """Get the start of each annotated clip (see slice_audio).
+
+    :param df: annotation
+    :return: offsets in seconds
+    """
+    if "offset" not in df:
+        return np.zeros(len(df))
+    return df["offset"].fillna(0).to_numpy(dtype=np.float64)
+
+
+def _get_slice_offsets(
+    pcm_path: str,
+    sampling_rate: int,
+    duration: int,
+    hop: float,
+    min_rms_db: Optional[float],
+) -> np.array:
+    """Get the offsets of the sliding windows of a PCM file.
+
+    :param pcm_path: PCM file path
+    :param sampling_rate: sampling_rate
+    :param duration: window duration in seconds
+    :param hop: hop between windows in seconds
+    :param min_rms_db: min. window RMS relative to full scale or None
+    :return: offsets in seconds of the windows to keep
+    """
+    y = np.load(pcm_path, mmap_mode="r")
+    size = int(sampling_rate * duration)
+    hop_size = int(sampling_rate * hop)
+
+    starts = np.arange(0, max(len(y) - size, 0) + 1, hop_size)
+
+    if min_rms_db is not None and len(y) >= size:
+        # Window energies from the cumulative sum of squares
+        energy = np.concatenate(([0.0], np.cumsum(np.square(y, dtype=np.float64))))
+        rms = np.sqrt((energy[starts + size] - energy[starts]) / size) / 32767
+        rms_db = 20 * np.log10(np.maximum(rms, 1e-10))
+
+        # Keep at least the loudest window of each recording
+        keep = rms_db >= min_rms_db
+        keep[np.argmax(rms_db)] = True
+        starts = starts[keep]
+
+    return starts / sampling_rate
+
+
+def slice_audio(
+    annotation_path: pathlib.Path,
+    sliced_annotation_path: pathlib.Path,
+    pcm_dir: pathlib.Path,
+    sampling_rate: int,
+    duration: int,
+    hop: float,
+    min_rms_db: Optional[float] = None,
+    seed: int = 0,
+) -> None:
+    """Cut each recording into overlapping windows with one annotation row each.
+
+    Works on the transcoded PCM files (see transcode_audio), so no file is
+    decoded again. The slice column holds the window number and the offset
+    column its start in seconds. Recordings are shuffled, but the slices of a
+    recording get consecutive idxs, so train and test data do not share
+    recordings (except at the split point).
+
+    :param annotation_path: annotation file path (one row per recording)
+    :param sliced_annotation_path: annotation file path for the slices
+    :param pcm_dir: PCM directory
+    :param sampling_rate: sampling_rate
+    :param duration: window duration in seconds
+    :param hop: hop between windows in seconds
+    :param min_rms_db: skip windows whose RMS relative to full scale is
+        below this value, defaults to None
+    :param seed: shuffle seed, defaults to 0
+    """
+
+    df = pd.read_csv(annotation_path)
+    df = df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+    offsets = [
+        _get_slice_offsets(
+            _get_pcm_path(pcm_dir, name), sampling_rate, duration, hop, min_rms_db
+        )
+        for name in df["file_name"]
+    ]
+    num_slices = np.array([len(o) for o in offsets])
+
+    df = df.loc[df.index.repeat(num_slices)].reset_index(drop=True)
+    df["slice"] = np.concatenate([np.arange(n) for n in num_slices])
+    df["offset"] = np.concatenate(offsets)
+    df["idx"] = np.arange(len(df))
+    df.to_csv(sliced_annotation_path, index=False)
+
+    logger.info(f"Sliced {len(num_slices)} recordings into {len(df)} windows")
+
+
 def load_audio(
     idxs: List[int],
     audio_dir: pathlib.Path,
     annotation_path: pathlib.Path,
     sampling_rate: int,
     duration: int,
+    pcm_dir: pathlib.Path = None,
 ) -> np.array:
     """Load audio files.
 
@@ -103,6 +818,7 @@ def load_audio(
     :param annotation_path: annotation file path
     :param sampling_rate: sampling_rate
     :param duration: duration in seconds
+    :param pcm_dir: PCM directory (see transcode_audio), defaults to None
     :return: audio data
     """
 
@@ -110,9 +826,12 @@ def load_audio(
     df = df[df["idx"].isin(idxs)]
 
     y_all = []
-    for idx, row in df.iterrows():
-        file_ = os.path.join(audio_dir, row["file_name"])
-        y = _load_audio(file_, sampling_rate, duration)
+    for (idx, row), offset in zip(df.iterrows(), _get_offsets(df)):
+        if pcm_dir is not None:
+            file_ = _get_pcm_path(pcm_dir, row["file_name"])
+        else:
+            file_ = os.path.join(audio_dir, row["file_name"])
+        y = _load_clip(file_, sampling_rate, duration, offset)
         y_all.append(y)
 
     y_all = np.vstack(y_all)
@@ -125,6 +844,10 @@ def get_features(
     annotation_path: pathlib.Path,
     sampling_rate: int,
     duration: int,
+    pcm_dir: pathlib.Path = None,
+    input_exponent: Optional[int] = None,
+    input_bits: int = 8,
+    backend: str = "c",
 ) -> np.array:
     """Get normalized MFCC features.
 
@@ -133,19 +856,143 @@ def get_features(
     :param annotation_path: annotation file path
     :param sampling_rate: sampling_rate
     :param duration: duration in seconds
+    :param pcm_dir: PCM directory (see transcode_audio), defaults to None
+    :param input_exponent: see finalize_features, defaults to None
+    :param input_bits: see finalize_features, defaults to 8
+    :param backend: "c" or "numpy" (see mfcc_numpy_batch), defaults to "c"
     :return: MFCC features
     """
-    y_in = load_audio(idxs, audio_dir, annotation_path, sampling_rate, duration)
-    y_out = []
-    for y in y_in:
-        out = mfcc(y)
-        # Normalize MFCC features to [0, 1]
-        out = (out - np.min(out)) / (np.max(out) - np.min(out))
-        y_out.append(out)
-    y_out = np.array(y_out)
+    y_in = load_audio(
+        idxs, audio_dir, annotation_path, sampling_rate, duration, pcm_dir
+    )
+    y_out = finalize_features(_mfcc_features(y_in, backend), input_exponent, input_bits)
     return y_out
 
 
+def _normalize(features: np.array) -> np.array:
+    """Normalize MFCC features of each clip to [0, 1].
+
+    :param features: MFCC features of shape (clips, frames, N_MFCC)
+    :return: normalized MFCC features
+    """
+    f_min = np.min(features, axis=(1, 2), keepdims=True)
+    f_max = np.max(features, axis=(1, 2), keepdims=True)
+    return (features - f_min) / (f_max - f_min)
+
+
+def quantize_features(features: np.array, exponent: int, bits: int = 8) -> np.array:
+    """Normalize MFCC features of each clip to [0, 1] and quantize them to the
+    model input, vectorized over the batch. Same specification as mfcc_quantize
+    in preprocess.cpp, so the result matches the ESP32 bit for bit: in float32,
+    each value v becomes min(floor((v - min) / (max - min) * 2^-exponent),
+    2^(bits - 1) - 1), and 0 if max == min.
+
+    :param features: MFCC features of shape (clips, frames, N_MFCC)
+    :param exponent: exponent of the model input
+    :param bits: 8 or 16, defaults to 8
+    :return: quantized features, int8 or int16
+    """
+    assert bits in (8, 16), "bits must be 8 or 16"
+
+    features = np.asarray(features, dtype=np.float32)
+    f_min = np.min(features, axis=(1, 2), keepdims=True)
+    f_range = np.max(features, axis=(1, 2), keepdims=True) - f_min
+    scale = np.float32(2.0**-exponent)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        quant = np.floor((features - f_min) / f_range * scale)
+    quant = np.where(f_range > 0, np.minimum(quant, 2 ** (bits - 1) - 1), 0)
+
+    return quant.astype(np.int8 if bits == 8 else np.int16)
+
+
+def finalize_features(
+    features: np.array, input_exponent: Optional[int] = None, input_bits: int = 8
+) -> np.array:
+    """Turn MFCC features into model input. Features of each clip are normalized
+    to [0, 1]. If input_exponent is given, they are additionally quantized as on
+    the ESP32 (see quantize_features) and dequantized, so training sees exactly
+    the input of the device.
+
+    :param features: MFCC features of shape (clips, frames, N_MFCC)
+    :param input_exponent: exponent of the model input, defaults to None
+    :param input_bits: bits of the value range of the model input, defaults to 8.
+        The ESP32 uses 8 for int8 and int16 models (INPUT_BITS in main.cpp)
+    :return: model input as float32
+    """
+    if input_exponent is None:
+        return _normalize(features)
+
+    quant = quantize_features(features, input_exponent, input_bits)
+    return np.ldexp(quant, input_exponent, dtype=np.float32)
+
+
+def _get_chunk_features(
+    chunk: Tuple[np.array, List[str], np.array],
+    sampling_rate: int,
+    duration: int,
+    fixed_point: bool = False,
+    input_exponent: Optional[int] = None,
+    input_bits: int = 8,
+    backend: str = "c",
+) -> Tuple[np.array, np.array]:
+    """Load a chunk of audio files and compute their normalized MFCC features.
+    Runs inside the worker processes of preprocess_audio.
+
+    :param chunk: idxs, audio (or PCM) file paths and offsets of the chunk
+    :param sampling_rate: sampling_rate
+    :param duration: duration in seconds
+    :param fixed_point: use the fixed-point pipeline of the ESP32, defaults to False
+    :param input_exponent: see finalize_features, defaults to None
+    :param input_bits: see finalize_features, defaults to 8
+    :param backend: "c" or "numpy" (see mfcc_numpy_batch), defaults to "c"
+    :return: idxs and MFCC features of the chunk
+    """
+    idxs, file_paths, offsets = chunk
+    y = np.vstack(
+        [
+            _load_clip(path, sampling_rate, duration, offset)
+            for path, offset in zip(file_paths, offsets)
+        ]
+    )
+    features = _mfcc_features(y, backend, fixed_point)
+    return idxs, finalize_features(features, input_exponent, input_bits)
+
+
+def _get_chunk_sweep_features(
+    chunk: Tuple[np.array, List[str], np.array],
+    sampling_rate: int,
+    duration: int,
+    configs: List[Dict],
+    input_exponent: Optional[int] = None,
+    input_bits: int = 8,
+) -> Tuple[np.array, Dict[str, np.array]]:
+    """Load a chunk of audio files and compute their normalized MFCC features
+    for several feature configurations. Runs inside the worker processes of
+    preprocess_sweep.
+
+    :param chunk: idxs, audio (or PCM) file paths and offsets of the chunk
+    :param sampling_rate: sampling_rate
+    :param duration: duration in seconds
+    :param configs: feature configurations (see _get_feature_config)
+    :param input_exponent: see finalize_features, defaults to None
+    :param input_bits: see finalize_features, defaults to 8
+    :return: idxs and MFCC features of the chunk by configuration name
+    """
+    idxs, file_paths, offsets = chunk
+    y = np.vstack(
+        [
+            _load_clip(path, sampling_rate, duration, offset)
+            for path, offset in zip(file_paths, offsets)
+        ]
+    )
+    features = mfcc_sweep_batch(y, configs, sampling_rate)
+    return idxs, {
+        name: finalize_features(mfcc, input_exponent, input_bits)
+        for name, mfcc in features.items()
+    }
+
+
 def statistics(y: np.array):
     """Compute statistics.
 
@@ -163,6 +1010,200 @@ def statistics(y: np.array):
     return stats
 
 
+def _get_feature_params(sampling_rate: int, duration: int, backend: str = "c") -> Dict:
+    """Get the parameters that determine the MFCC features of a clip.
+
+    :param sampling_rate: sampling_rate
+    :param duration: duration in seconds
+    :param backend: "c" or "numpy", defaults to "c"
+    :return: dictionary of feature parameters
+    """
+    params = {"sampling_rate": sampling_rate, "duration": duration}
+
+    if backend == "numpy":
+        params.update(
+            {
+                "hop_length": HOP_LENGTH_SAMPLES,
+                "win_length": WIN_LENGTH_SAMPLES,
+                "num_mels": N_MELS,
+                "num_mfcc": N_MFCC,
+                "backend": backend,
+            }
+        )
+    else:
+        lib = _load_library()
+        params.update(
+            {
+                "hop_length": lib.get_hop_length(),
+                "win_length": lib.get_win_length(),
+                "num_mels": lib.get_num_mels(),
+                "num_mfcc": lib.get_num_mfcc(),
+            }
+        )
+    return params
+
+
+def _get_file_digest(file_path: str) -> str:
+    """Hash the content of an audio file.
+
+    :param file_path: audio file path
+    :return: hex digest of the file
+    """
+    h = hashlib.sha1()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _read_digest_cache(h5path: pathlib.Path) -> Dict[str, Tuple[int, int, str]]:
+    """Read the file digests stored in the "digest" group of the HDF5 file.
+
+    :param h5path: HDF5 file path
+    :return: size, modification time in ns and digest by audio file path
+    """
+    if not os.path.exists(h5path):
+        return {}
+
+    with h5py.File(h5path, "r") as f:
+        if "digest" not in f:
+            return {}
+        group = f["digest"]
+        return {
+            path.decode(): (int(size), int(mtime_ns), digest.decode())
+            for path, size, mtime_ns, digest in zip(
+                group["path"][:],
+                group["size"][:],
+                group["mtime_ns"][:],
+                group["digest"][:],
+            )
+        }
+
+
+def _write_digest_cache(f: h5py.File, entries: Dict[str, Tuple[int, int, str]]):
+    """Replace the "digest" group of an open HDF5 file (see _read_digest_cache).
+
+    :param f: HDF5 file opened for writing
+    :param entries: size, modification time in ns and digest by audio file path
+    """
+    if "digest" in f:
+        del f["digest"]
+
+    group = f.create_group("digest")
+    paths = list(entries)
+    group.create_dataset("path", data=np.array([p.encode() for p in paths], dtype="S"))
+    group.create_dataset(
+        "size", data=np.array([entries[p][0] for p in paths], dtype=np.int64)
+    )
+    group.create_dataset(
+        "mtime_ns", data=np.array([entries[p][1] for p in paths], dtype=np.int64)
+    )
+    group.create_dataset(
+        "digest", data=np.array([entries[p][2].encode() for p in paths], dtype="S40")
+    )
+
+
+def _get_file_digests(
+    file_paths: List[str],
+    h5path: pathlib.Path,
+    pool=None,
+    chunk_size: int = 64,
+) -> Tuple[Dict[str, Tuple[int, int, str]], bool]:
+    """Get the digests of audio files. Digests stored in the HDF5 file are
+    reused as long as size and modification time of the file are unchanged,
+    so unchanged files are not read again.
+
+    :param file_paths: unique audio file paths
+    :param h5path: HDF5 file path
+    :param pool: worker pool to hash the files, defaults to None
+    :param chunk_size: number of files per task, defaults to 64
+    :return: size, modification time in ns and digest by audio file path, and
+        whether any file was hashed (so the stored digests are outdated)
+    """
+    cache = _read_digest_cache(h5path)
+
+    entries = {}
+    stale = []
+    for path in file_paths:
+        stat = os.stat(path)
+        entry = cache.get(path)
+        if entry is not None and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+            entries[path] = entry
+        else:
+            entries[path] = (stat.st_size, stat.st_mtime_ns, None)
+            stale.append(path)
+
+    if pool is not None:
+        digests = pool.map(_get_file_digest, stale, chunksize=chunk_size)
+    else:
+        digests = list(map(_get_file_digest, stale))
+
+    for path, digest in zip(stale, digests):
+        entries[path] = (*entries[path][:2], digest)
+
+    logger.info(
+        f"File digests: {len(file_paths) - len(stale)} reused, {len(stale)} hashed"
+    )
+
+    return entries, len(stale) > 0
+
+
+def _get_feature_key(file_digest: str, offset: float, params: Dict) -> bytes:
+    """Combine the hash of an audio file with the clip offset and the feature
+    parameters.
+
+    :param file_digest: hex digest of the audio file
+    :param offset: start of the clip in seconds
+    :param params: feature parameters
+    :return: hex digest identifying the features of the clip
+    """
+    h = hashlib.sha1(json.dumps(params, sort_keys=True).encode())
+    h.update(f"{file_digest}:{offset:.6f}".encode())
+    return h.hexdigest().encode()
+
+
+def _copy_rows(
+    src: h5py.Dataset,
+    dst: h5py.Dataset,
+    src_rows: np.array,
+    dst_rows: np.array,
+    chunk_size: int,
+) -> None:
+    """Copy rows of src to (other) rows of dst in chunks.
+
+    :param src: source dataset
+    :param dst: destination dataset
+    :param src_rows: rows to read from src
+    :param dst_rows: rows to write to dst
+    :param chunk_size: number of rows per read
+    """
+    order = np.argsort(dst_rows)
+    src_rows, dst_rows = src_rows[order], dst_rows[order]
+
+    for i in range(0, len(dst_rows), chunk_size):
+        # h5py requires increasing, unique indices
+        rows, inverse = np.unique(src_rows[i : i + chunk_size], return_inverse=True)
+        dst[dst_rows[i : i + chunk_size]] = src[rows][inverse]
+
+
+def _get_compression_kwargs(compression: Optional[str]) -> Dict:
+    """Get h5py dataset arguments for a compression filter.
+
+    :param compression: None, "lzf", "gzip" or "blosc" (requires hdf5plugin)
+    :raises ValueError: if compression is unknown
+    :return: keyword arguments for create_dataset
+    """
+    if compression is None:
+        return {}
+    if compression in ("lzf", "gzip"):
+        return {"compression": compression}
+    if compression == "blosc":
+        import hdf5plugin
+
+        return dict(hdf5plugin.Blosc(cname="lz4", shuffle=hdf5plugin.Blosc.SHUFFLE))
+    raise ValueError(f"Unknown compression {compression}")
+
+
 def preprocess_audio(
     data_dir: pathlib.Path,
     audio_dir: pathlib.Path,
@@ -170,50 +1211,518 @@ def preprocess_audio(
     sampling_rate: int,
     duration: int,
     h5file: str,
+    num_workers: int = 1,
+    chunk_size: int = 64,
+    dtype: str = "float32",
+    compression: Optional[str] = None,
+    pcm_dir: pathlib.Path = None,
+    fixed_point: bool = False,
+    input_exponent: Optional[int] = None,
+    input_bits: int = 8,
+    backend: str = "c",
 ) -> None:
     """Preprocess audio files.
 
+    Every row of the HDF5 file is keyed by a hash of its audio file, the clip
+    offset and the feature parameters (see _get_feature_key). Rows whose key is already
+    present are reused, so only new or changed files are processed. File hashes
+    are stored in the HDF5 file and only recomputed for files whose size or
+    modification time changed (see _get_file_digests).
+
+    Chunks of audio files are decoded and converted to MFCC features by a pool
+    of worker processes, while this process streams the finished chunks into
+    the HDF5 file.
+
     :param data_dir: data directory
     :param audio_dir: audio directory
     :param annotation_path: annotation file path
     :param sampling_rate: sampling_rate
     :param duration: duration in seconds
     :param h5file: HDF5 file name
+    :param num_workers: number of worker processes, defaults to 1
+    :param chunk_size: number of files per chunk, defaults to 64
+    :param dtype: feature dtype, "float16" or "float32", defaults to "float32"
+    :param compression: None, "lzf", "gzip" or "blosc", defaults to None
+    :param pcm_dir: read transcoded PCM from this directory instead of decoding
+        the audio files (see transcode_audio), defaults to None
+    :param fixed_point: compute the features with the fixed-point pipeline of
+        the ESP32 (see mfcc_fixed_batch), defaults to False
+    :param input_exponent: quantize the features to the model input of the
+        ESP32 with this exponent (see finalize_features), defaults to None
+    :param input_bits: bits of the model input, defaults to 8
+    :param backend: compute the features with the C library ("c") or with
+        NumPy ("numpy", see mfcc_numpy_batch), defaults to "c"
     """
 
     h5path = data_dir / h5file
-    if not os.path.exists(h5path):
-        df = pd.read_csv(annotation_path)
-
-        with h5py.File(h5path, "w") as f:
-            shape_mfcc = get_features(
-                [0], audio_dir, annotation_path, sampling_rate, duration
-            ).shape
-            f.create_dataset("data", shape=(len(df), *shape_mfcc))
-            logger.info(f"Creating HDF5 with shape {(len(df), *shape_mfcc)}")
-
-            for _, row in df.iterrows():
-                idx = row["idx"]
-                mfcc = get_features(
-                    [idx], audio_dir, annotation_path, sampling_rate, duration
+    df = pd.read_csv(annotation_path).sort_values("idx")
+
+    idxs = df["idx"].to_numpy(dtype=np.int64)
+    offsets = _get_offsets(df)
+    file_paths = [os.path.join(audio_dir, name) for name in df["file_name"]]
+
+    # Keys hash the audio files, features are computed from PCM if available
+    if pcm_dir is not None:
+        feature_paths = [_get_pcm_path(pcm_dir, name) for name in df["file_name"]]
+    else:
+        feature_paths = file_paths
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}")
+
+    params = _get_feature_params(sampling_rate, duration, backend)
+    params["source"] = "pcm" if pcm_dir is not None else "audio"
+    if fixed_point:
+        params["fixed_point"] = True
+    if input_exponent is not None:
+        params["input_exponent"] = input_exponent
+        params["input_bits"] = input_bits
+    num_frames = (sampling_rate * duration - params["win_length"]) // params[
+        "hop_length"
+    ]
+    shape = (len(df), 1, num_frames, params["num_mfcc"])
+
+    pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
+
+    try:
+        # Slices of a recording share its file digest
+        unique_paths = list(dict.fromkeys(file_paths))
+        digest_entries, rehashed = _get_file_digests(
+            unique_paths, h5path, pool, chunk_size
+        )
+        digests = {path: entry[2] for path, entry in digest_entries.items()}
+
+        keys = [
+            _get_feature_key(digests[path], offset, params)
+            for path, offset in zip(file_paths, offsets)
+        ]
+        keys = np.array(keys, dtype="S40")
+
+        # Features are reused if shape and dtype match, the layout if also
+        # the compression matches
+        old_keys = np.array([], dtype="S40")
+        same_layout = False
+        if os.path.exists(h5path):
+            with h5py.File(h5path, "r") as f:
+                data = f["data"]
+                if (
+                    "key" in f
+                    and data.shape[1:] == shape[1:]
+                    and data.dtype == np.dtype(dtype)
+                ):
+                    old_keys = f["key"][:]
+                    same_layout = data.attrs.get("compression", "") == (
+                        compression or ""
+                    )
+
+        # Rows that are up to date, rows that moved and rows to compute
+        in_place = np.array(
+            [i < len(old_keys) and old_keys[i] == key for i, key in zip(idxs, keys)],
+            dtype=bool,
+        )
+
+        # Prefer up to date rows as copy source, they are never overwritten
+        old_rows = {key: row for row, key in enumerate(old_keys)}
+        old_rows.update({old_keys[i]: i for i in idxs[in_place]})
+        preserved = set(idxs[in_place])
+
+        cached = np.array([key in old_rows for key in keys], dtype=bool)
+        moved = cached & ~in_place
+        missing = ~cached
+
+        logger.info(
+            f"Features: {in_place.sum()} up to date, {moved.sum()} moved, {missing.sum()} to compute"
+        )
+
+        if (
+            same_layout
+            and not missing.any()
+            and not moved.any()
+            and len(old_keys) == len(df)
+        ):
+            logger.info("HDF5 file is up to date. Skipping preprocessing.")
+            if rehashed:
+                with h5py.File(h5path, "a") as f:
+                    _write_digest_cache(f, digest_entries)
+            return
+
+        # Rows can be updated in place unless moved features would be
+        # copied from rows that are overwritten
+        moved_rows = np.array([old_rows[key] for key in keys[moved]], dtype=np.int64)
+
+        if not same_layout or not preserved.issuperset(moved_rows):
+            write_path = h5path.with_suffix(".tmp.h5")
+            mode = "w"
+        else:
+            write_path = h5path
+            mode = "a"
+
+        with h5py.File(write_path, mode) as f:
+            if mode == "w":
+                f.create_dataset(
+                    "data",
+                    shape=shape,
+                    dtype=dtype,
+                    maxshape=(None, *shape[1:]),
+                    chunks=(1, *shape[1:]),
+                    **_get_compression_kwargs(compression),
+                )
+                f["data"].attrs["compression"] = compression or ""
+                f.create_dataset("key", shape=(len(df),), maxshape=(None,), dtype="S40")
+                logger.info(f"Creating HDF5 with shape {shape}")
+
+                if cached.any():
+                    with h5py.File(h5path, "r") as f_old:
+                        _copy_rows(
+                            f_old["data"],
+                            f["data"],
+                            np.array([old_rows[key] for key in keys[cached]]),
+                            idxs[cached],
+                            chunk_size,
+                        )
+            else:
+                f["data"].resize(len(df), axis=0)
+                f["key"].resize(len(df), axis=0)
+                f["key"][idxs[~in_place]] = b""
+
+                _copy_rows(f["data"], f["data"], moved_rows, idxs[moved], chunk_size)
+
+            f["data"].attrs.update(params)
+            _write_digest_cache(f, digest_entries)
+
+            missing_idxs = idxs[missing]
+            missing_paths = [path for path, m in zip(feature_paths, missing) if m]
+            missing_offsets = offsets[missing]
+            chunks = [
+                (
+                    missing_idxs[i : i + chunk_size],
+                    missing_paths[i : i + chunk_size],
+                    missing_offsets[i : i + chunk_size],
                 )
+                for i in range(0, len(missing_idxs), chunk_size)
+            ]
+            worker_fn = functools.partial(
+                _get_chunk_features,
+                sampling_rate=sampling_rate,
+                duration=duration,
+                fixed_point=fixed_point,
+                input_exponent=input_exponent,
+                input_bits=input_bits,
+                backend=backend,
+            )
+            results = (
+                pool.imap_unordered(worker_fn, chunks)
+                if pool is not None
+                else map(worker_fn, chunks)
+            )
+
+            for chunk_idxs, mfcc in results:
+                order = np.argsort(chunk_idxs)
+                f["data"][chunk_idxs[order], :, :, :] = mfcc[order, np.newaxis]
+
+            # Keys are written last, so interrupted runs are recomputed
+            f["key"][idxs] = keys
+
+        if write_path != h5path:
+            os.replace(write_path, h5path)
+
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def preprocess_sweep(
+    data_dir: pathlib.Path,
+    audio_dir: pathlib.Path,
+    annotation_path: pathlib.Path,
+    sampling_rate: int,
+    duration: int,
+    h5file: str,
+    configs: List[Dict],
+    num_workers: int = 1,
+    chunk_size: int = 64,
+    dtype: str = "float32",
+    compression: Optional[str] = None,
+    pcm_dir: pathlib.Path = None,
+    input_exponent: Optional[int] = None,
+    input_bits: int = 8,
+) -> List[str]:
+    """Preprocess audio files for several feature configurations in one pass.
+
+    Each clip is decoded, framed and transformed once (see mfcc_sweep_batch).
+    The features of each configuration are written to their own group of the
+    HDF5 file, named by get_config_name, with "data" and "key" datasets as in
+    preprocess_audio, so they can be read with FeatureReader(path, group).
+    Rows are reused if their key is up to date, so adding a configuration
+    only computes that configuration.
+
+    :param data_dir: data directory
+    :param audio_dir: audio directory
+    :param annotation_path: annotation file path
+    :param sampling_rate: sampling_rate
+    :param duration: duration in seconds
+    :param h5file: HDF5 file name
+    :param configs: feature configurations, dictionaries with any of
+        hop_length, win_length, num_mels and num_mfcc (see _get_feature_config)
+    :param num_workers: number of worker processes, defaults to 1
+    :param chunk_size: number of files per chunk, defaults to 64
+    :param dtype: feature dtype, "float16" or "float32", defaults to "float32"
+    :param compression: None, "lzf", "gzip" or "blosc", defaults to None
+    :param pcm_dir: PCM directory (see transcode_audio), defaults to None
+    :param input_exponent: see finalize_features, defaults to None
+    :param input_bits: see finalize_features, defaults to 8
+    :return: group names of the configurations
+    """
 
-                f["data"][idx, :, :, :] = mfcc
+    h5path = data_dir / h5file
+    df = pd.read_csv(annotation_path).sort_values("idx")
+
+    idxs = df["idx"].to_numpy(dtype=np.int64)
+    offsets = _get_offsets(df)
+    file_paths = [os.path.join(audio_dir, name) for name in df["file_name"]]
 
+    if pcm_dir is not None:
+        feature_paths = [_get_pcm_path(pcm_dir, name) for name in df["file_name"]]
     else:
-        logger.info("HDF5 file already exists. Skipping preprocessing.")
+        feature_paths = file_paths
+
+    configs = [_get_feature_config(config) for config in configs]
+    names = [get_config_name(config) for config in configs]
+    configs = list(dict(zip(names, configs)).values())
+    names = list(dict.fromkeys(names))
 
+    pool = multiprocessing.Pool(num_workers) if num_workers > 1 else None
 
-def load_features(idxs: List[int], h5_path: pathlib.Path) -> np.array:
+    try:
+        unique_paths = list(dict.fromkeys(file_paths))
+        digest_entries, rehashed = _get_file_digests(
+            unique_paths, h5path, pool, chunk_size
+        )
+        digests = {path: entry[2] for path, entry in digest_entries.items()}
+
+        with h5py.File(h5path, "a") as f:
+            if rehashed:
+                _write_digest_cache(f, digest_entries)
+
+            keys = {}
+            stale = {}
+
+            for name, config in zip(names, configs):
+                # Same parameters as preprocess_audio with the NumPy backend
+                params = _get_feature_params(sampling_rate, duration, "numpy")
+                params.update(config)
+                params["source"] = "pcm" if pcm_dir is not None else "audio"
+                if input_exponent is not None:
+                    params["input_exponent"] = input_exponent
+                    params["input_bits"] = input_bits
+
+                keys[name] = np.array(
+                    [
+                        _get_feature_key(digests[path], offset, params)
+                        for path, offset in zip(file_paths, offsets)
+                    ],
+                    dtype="S40",
+                )
+
+                num_frames = (
+                    sampling_rate * duration - config["win_length"]
+                ) // config["hop_length"]
+                shape = (len(df), 1, num_frames, config["num_mfcc"])
+
+                group = f.get(name)
+                if group is not None and (
+                    group["data"].shape[1:] != shape[1:]
+                    or group["data"].dtype != np.dtype(dtype)
+                    or group["data"].attrs.get("compression", "") != (compression or "")
+                ):
+                    del f[name]
+                    group = None
+
+                if group is None:
+                    group = f.create_group(name)
+                    group.create_dataset(
+                        "data",
+                        shape=shape,
+                        dtype=dtype,
+                        maxshape=(None, *shape[1:]),
+                        chunks=(1, *shape[1:]),
+                        **_get_compression_kwargs(compression),
+                    )
+                    group["data"].attrs["compression"] = compression or ""
+                    group.create_dataset(
+                        "key", shape=(len(df),), maxshape=(None,), dtype="S40"
+                    )
+                    logger.info(f"Creating group {name} with shape {shape}")
+
+                old_keys = group["key"][:]
+                stale[name] = np.array(
+                    [
+                        i >= len(old_keys) or old_keys[i] != key
+                        for i, key in zip(idxs, keys[name])
+                    ],
+                    dtype=bool,
+                )
+
+                group["data"].resize(len(df), axis=0)
+                group["key"].resize(len(df), axis=0)
+                group["data"].attrs.update(params)
+
+            # Only configurations with stale rows are computed, for the union
+            # of their stale rows
+            stale_names = [name for name in names if stale[name].any()]
+            stale_configs = [
+                config for name, config in zip(names, configs) if stale[name].any()
+            ]
+            missing = np.logical_or.reduce([stale[name] for name in names])
+
+            logger.info(
+                f"Features: {len(df) - missing.sum()} up to date, {missing.sum()} to compute for {len(stale_names)} of {len(names)} configurations"
+            )
+
+            for name in stale_names:
+                f[name]["key"][idxs[missing]] = b""
+
+            missing_idxs = idxs[missing]
+            missing_paths = [path for path, m in zip(feature_paths, missing) if m]
+            missing_offsets = offsets[missing]
+            chunks = [
+                (
+                    missing_idxs[i : i + chunk_size],
+                    missing_paths[i : i + chunk_size],
+                    missing_offsets[i : i + chunk_size],
+                )
+                for i in range(0, len(missing_idxs), chunk_size)
+            ]
+            worker_fn = functools.partial(
+                _get_chunk_sweep_features,
+                sampling_rate=sampling_rate,
+                duration=duration,
+                configs=stale_configs,
+                input_exponent=input_exponent,
+                input_bits=input_bits,
+            )
+            results = (
+                pool.imap_unordered(worker_fn, chunks)
+                if pool is not None
+                else map(worker_fn, chunks)
+            )
+
+            for chunk_idxs, features in results:
+                order = np.argsort(chunk_idxs)
+                for name, mfcc in features.items():
+                    f[name]["data"][chunk_idxs[order], :, :, :] = mfcc[
+                        order, np.newaxis
+                    ]
+
+            # Keys are written last, so interrupted runs are recomputed
+            for name in stale_names:
+                f[name]["key"][idxs] = keys[name]
+
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    return names
+
+
+class FeatureReader:
+
+    """Random-access reader for processed MFCC features.
+
+    Keeps a single handle open for all reads. Supports the HDF5 store and raw
+    .npy files (see export_features_npy), which are memory-mapped. For the
+    HDF5 file of preprocess_sweep, group selects the feature configuration.
+    """
+
+    def __init__(self, path: pathlib.Path, group: Optional[str] = None):
+        self._file = None
+        if pathlib.Path(path).suffix == ".npy":
+            self._data = np.load(path, mmap_mode="r")
+        else:
+            self._file = h5py.File(path, "r")
+            root = self._file[group] if group is not None else self._file
+            self._data = root["data"]
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self._data.shape
+
+    def __len__(self) -> int:
+        return self._data.shape[0]
+
+    def __getitem__(self, idxs) -> np.array:
+        if self._file is not None and not isinstance(idxs, (int, np.integer, slice)):
+            # h5py requires increasing, unique indices
+            rows, inverse = np.unique(np.asarray(idxs), return_inverse=True)
+            return np.asarray(self._data[rows], dtype=np.float32)[inverse]
+        return np.asarray(self._data[idxs], dtype=np.float32)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def export_features_npy(
+    h5_path: pathlib.Path, npy_path: pathlib.Path, chunk_size: int = 1024
+) -> None:
+    """Export the HDF5 features to a raw .npy file that can be memory-mapped.
+
+    :param h5_path: HDF5 file path
+    :param npy_path: .npy file path
+    :param chunk_size: number of rows per copy, defaults to 1024
+    """
+
+    with h5py.File(h5_path, "r") as f:
+        data = f["data"]
+        out = np.lib.format.open_memmap(
+            npy_path, mode="w+", dtype=data.dtype, shape=data.shape
+        )
+        for i in range(0, data.shape[0], chunk_size):
+            out[i : i + chunk_size] = data[i : i + chunk_size]
+        out.flush()
+
+
+def get_feature_digest(
+    h5_path: pathlib.Path, idxs: Iterable[int], group: Optional[str] = None
+) -> str:
+    """Hash the keys of processed features, which identify their content (see
+    _get_feature_key), e.g. to key data derived from them.
+
+    :param h5_path: HDF5 file path
+    :param idxs: idxs of files in annotation file
+    :param group: feature configuration (see preprocess_sweep), defaults to None
+    :return: hex digest of the features
+    """
+
+    with h5py.File(h5_path, "r") as f:
+        root = f[group] if group is not None else f
+        keys = root["key"][:]
+
+    return hashlib.sha1(
+        keys[np.asarray(list(idxs), dtype=np.int64)].tobytes()
+    ).hexdigest()
+
+
+def load_features(
+    idxs: List[int], h5_path: pathlib.Path, group: Optional[str] = None
+) -> np.array:
     """Load processed mfcc features.
 
+    For repeated reads, prefer a FeatureReader, which keeps the file open.
+
     :param idx: idxs of files in annotation file
-    :param h5_path: HDF5 file path
+    :param h5_path: HDF5 or .npy file path
+    :param group: feature configuration (see preprocess_sweep), defaults to None
     :return: MFCC features
     """
 
-    with h5py.File(h5_path, "r") as f:
-        data = f["data"][idxs, :, :, :]
-        data = np.array(data, dtype=np.float32)
+    with FeatureReader(h5_path, group) as reader:
+        data = reader[idxs]
 
     return data
@@ -14,14 +14,16 @@
 #include "audio/preprocess.h"
 
 #include <math.h>
+#include <stdlib.h>
+#include <string.h>
 
 
 #ifndef RUN_PC
 
+#include "sdkconfig.h"
 #include "esp_log.h"
 #include "dsps_fft2r.h" // For FFT computation
 #include "dsps_wind_hann.h" // For Hann windowing function
-#include "dsps_dct.h" // For DCT computation
 
 #else
 
@@ -38,7 +40,6 @@
 #include "sim_dsp/aux_err.h"
 #include "sim_dsp/aux_fft.h"
 #include "sim_dsp/aux_wind.h"
-#include "sim_dsp/aux_dct.h"
 
 #endif
 
@@ -57,6 +58,30 @@ static const char *PREPROCESS_TAG = "PREPROCESS";
 #define WIN_LENGTH_SAMPLES 1024     // for ESP-IDF implementation, 
 #define NUM_FFT WIN_LENGTH_SAMPLES // must be Power of 2 because of FFT
 
+// If REAL_FFT is set, the real-valued frame of NUM_FFT samples is transformed 
+// with a complex FFT of NUM_FFT/2 points, followed by a twiddle step which 
+// recovers the spectrum of the real signal. Otherwise, a complex FFT of NUM_FFT
+// points with zero imaginary parts is computed.
+
+#ifndef REAL_FFT
+#define REAL_FFT 1
+#endif
+
+// Pipelines whose tables are allocated by malloc_mfcc_module. The PC build, 
+// used for training, has both. The ESP32 only has the one selected with 
+// CONFIG_MFCC_FIXED_POINT; the other one returns ESP_ERR_NOT_SUPPORTED.
+
+#if defined(RUN_PC)
+#define MFCC_FLOAT_PIPELINE 1
+#define MFCC_FIXED_PIPELINE 1
+#elif defined(CONFIG_MFCC_FIXED_POINT)
+#define MFCC_FLOAT_PIPELINE 0
+#define MFCC_FIXED_PIPELINE 1
+#else
+#define MFCC_FLOAT_PIPELINE 1
+#define MFCC_FIXED_PIPELINE 0
+#endif
+
 #define N_MELS 40
 #define N_MFCC 32  // NOTE: Must be less than N_MELS
 
@@ -65,8 +90,32 @@ static const char *PREPROCESS_TAG = "PREPROCESS";
 
 // Next functions is based on Librosa implementation. Numerical stability
 
-#define POWER_TO_DB(power) \
-    (10.0 * log10(fmax(1e-10, power)) - 10.0 * log10(fmax(1e-10, 1.0)))
+#define POWER_MIN 1e-10
+
+#define POWER_TO_DB(power, power_min) \
+    (10.0 * log10(fmax(power_min, power)) - 10.0 * log10(fmax(POWER_MIN, 1.0)))
+
+// Floor of the log mel energies before peak normalization (see 
+// mfcc_stream_normalize). The gain is at most INT16_MAX, so any energy below
+// this floor is clamped to POWER_MIN after the gain is applied.
+
+#define POWER_MIN_UNNORMALIZED (POWER_MIN / ((double) INT16_MAX * INT16_MAX))
+
+// Fixed-point pipeline (see mfcc_frame_fixed). Windowed frames are scaled to 
+// at most FIXED_FFT_MAX, which leaves one bit of headroom for the int16 FFT.
+
+#define FIXED_FFT_MAX 16383
+#define MEL_WEIGHT_FRAC_BITS 20 // Max. mel weight is about 0.02
+#define LOG2_TABLE_BITS 8
+#define LOG2_FRAC_BITS 16
+#define DCT_FRAC_BITS 15
+#define MFCC_FIXED_EXPONENT -9 // Output values are scaled by 2^-MFCC_FIXED_EXPONENT
+
+// Fixed-point mel energies are the float ones times 2^FIXED_MEL_GAIN_LOG2: the
+// windowed frame is in Q15 (2^30 in power), the int16 FFT scales its output by
+// 1/NUM_FFT (2^-20 in power) and the mel weights have MEL_WEIGHT_FRAC_BITS.
+
+#define FIXED_MEL_GAIN_LOG2 (30 - 20 + MEL_WEIGHT_FRAC_BITS)
 
 
 // The following variables must be global if their sizes are too big.
@@ -74,17 +123,41 @@ static const char *PREPROCESS_TAG = "PREPROCESS";
 
 static float *s_window;
 static float *s_fft_operand;
+static float *s_fft_twiddle; // Twiddle factors of the REAL_FFT post-processing
 static float *s_power_spectrum;
-static float **s_mel_filt;
+static float *s_mel_filt;          // Non-zero weights of all bands, packed
+static size_t s_mel_start[N_MELS];  // First FFT bin of each band
+static size_t s_mel_length[N_MELS]; // Number of FFT bins of each band
 static float *s_mel_buffer;
+static float *s_dct_basis; // Cosine basis of the kept DCT-II coefficients
+
+// Fixed-point counterparts (see mfcc_frame_fixed)
+
+static int16_t *s_window_fixed;          // Q15
+static int16_t *s_fft_operand_fixed;
+static uint32_t *s_power_spectrum_fixed;
+static int16_t *s_mel_filt_fixed;        // Same layout as s_mel_filt
+static int32_t *s_mel_buffer_fixed;      // log2 of the mel energies
+static int16_t *s_dct_basis_fixed;       // Basis in dB, rows sum to zero
+static int32_t *s_log2_table;            // log2(1 + i / 2^LOG2_TABLE_BITS)
+static int32_t s_log2_mel_min;           // log2 of POWER_MIN in fixed point
+static int32_t s_log2_mel_min_unnormalized; // Floor before peak normalization
+
+// State of the streaming interface (see mfcc_stream_push)
+
+static int16_t *s_stream_buffer; // Last WIN_LENGTH_SAMPLES samples
+static size_t s_stream_fill;      // Number of valid samples in s_stream_buffer
+static int32_t s_stream_peak;     // Max. absolute sample since the last reset
 
 // Another way to implement these variables, but memory can't be deallocated.
 
 // static float s_window[WIN_LENGTH_SAMPLES];
 // static float s_fft_operand[2*WIN_LENGTH_SAMPLES];
+// static float s_fft_twiddle[NUM_FFT + 2];
 // static float s_power_spectrum[NUM_FFT/2 + 1];
-// static float s_mel_filt[N_MELS][NUM_FFT / 2 + 1];
-// static float s_mel_buffer[2*N_MELS];
+// static float s_mel_filt[N_MELS * (NUM_FFT / 2 + 1)];
+// static float s_mel_buffer[N_MELS];
+// static float s_dct_basis[N_MFCC * N_MELS];
 
 #ifdef __cplusplus
 extern "C" {
@@ -97,11 +170,31 @@ size_t get_num_mfcc()
     return N_MFCC;
 }
 
+size_t get_num_mels() 
+{
+    return N_MELS;
+}
+
+size_t get_hop_length() 
+{
+    return HOP_LENGTH_SAMPLES;
+}
+
+size_t get_win_length() 
+{
+    return WIN_LENGTH_SAMPLES;
+}
+
 size_t get_num_frames(size_t num_samples) 
 {
     return (num_samples - WIN_LENGTH_SAMPLES) / HOP_LENGTH_SAMPLES;
 }
 
+int get_mfcc_fixed_exponent() 
+{
+    return MFCC_FIXED_EXPONENT;
+}
+
 void fft_frequencies(float *fft_freq) 
 {
     float h = SAMPLE_RATE / (float) NUM_FFT;
@@ -111,6 +204,18 @@ void fft_frequencies(float *fft_freq)
     }
 }
 
+void fft_twiddle(float *twiddle) 
+{
+    // W^k = exp(-2*pi*i*k / NUM_FFT) for k = 0, ..., NUM_FFT/2
+
+    for (int i=0; i < NUM_FFT / 2 + 1; ++i) {
+        double angle = -2.0 * M_PI * i / NUM_FFT;
+
+        twiddle[2*i] = cos(angle);
+        twiddle[2*i + 1] = sin(angle);
+    }
+}
+
 void mel_frequencies(double *mel_freq, int num_points) 
 {
     double min_mel = HZ_TO_MEL(FMIN);
@@ -121,7 +226,13 @@ void mel_frequencies(double *mel_freq, int num_points)
     }
 }
 
-void mel_filters(float **weights) 
+// Each triangular filter only covers the FFT bins between its lower and upper
+// mel frequency, so the filter bank is stored sparsely: band i has 
+// length[i] weights for the bins start[i], ..., start[i] + length[i] - 1, 
+// packed one band after the other. Returns the total number of weights. If 
+// weights is NULL, only start and length are computed.
+
+size_t mel_filters(size_t *start, size_t *length, float *weights) 
 {
     float fft_freq[NUM_FFT / 2 + 1]; // Checked
     fft_frequencies(fft_freq);
@@ -131,29 +242,139 @@ void mel_filters(float **weights)
 
     // Computation of mel filter bank
 
+    size_t num_weights = 0;
+
     for (size_t i=0; i < N_MELS; ++i) {
+        double lower = mel_freq[i];
+        double center = mel_freq[i + 1];
+        double upper = mel_freq[i + 2];
+
+        start[i] = 0;
+        length[i] = 0;
+
         for (size_t j=0; j < NUM_FFT/2 + 1; ++j) {
-            double lower = mel_freq[i];
-            double center = mel_freq[i + 1];
-            double upper = mel_freq[i + 2];
+            if (fft_freq[j] < lower || fft_freq[j] > upper) {
+                continue;
+            }
+
+            if (length[i] == 0) {
+                start[i] = j;
+            }
+
+            if (weights != NULL) {
+                float weight;
 
-            if (fft_freq[j] >= lower && fft_freq[j] <= upper) {
                 if (fft_freq[j] < center) {
-                    weights[i][j] = (fft_freq[j] - lower) / (center - lower);
+                    weight = (fft_freq[j] - lower) / (center - lower);
                 } else {
-                    weights[i][j] = (upper - fft_freq[j]) / (upper - center);
+                    weight = (upper - fft_freq[j]) / (upper - center);
                 }
-            } else {
-                weights[i][j] = 0;
-            }
 
-            // Slaney normalization
+                // Slaney normalization
+
+                weight *= 2.0 / (mel_freq[i + 2] - mel_freq[i]);
+
+                weights[num_weights + length[i]] = weight;
+            }
 
-            weights[i][j] *= 2.0 / (mel_freq[i + 2] - mel_freq[i]);
+            ++length[i];
         }
+
+        num_weights += length[i];
     }
+
+    return num_weights;
 };
 
+// Orthonormal DCT-II as in Librosa (and sim_dsp's dsps_dct_f32_ref). The first
+// coefficient is discarded, as in Librosa's implementation, so row i of the 
+// basis holds the cosines of coefficient i + 1, premultiplied by 2. The 
+// remaining scaling is DCT_SCALE.
+
+#define DCT_SCALE sqrt(1.0f / (2*N_MELS))
+
+void dct_basis(float *basis) 
+{
+    float factor = M_PI / (2*N_MELS);
+
+    for (size_t i=0; i < N_MFCC; ++i) {
+        for (size_t j=0; j < N_MELS; ++j) {
+            basis[i * N_MELS + j] = 2 * cosf(factor * (i + 1) * (2*j + 1));
+        }
+    }
+}
+
+// Quantized DCT basis of the fixed-point pipeline. The mel energies are given 
+// as log2, so the basis also converts to dB. Rounding errors are moved to the
+// largest entry of each row, so rows sum to exactly zero, as the cosines do.
+// Thus a constant offset of the log mel energies of a frame, e.g. due to block
+// scaling, does not change the result.
+
+void dct_basis_fixed(const float *basis, int16_t *basis_fixed) 
+{
+    double scale = DCT_SCALE * 10.0 * log10(2.0) * (1 << DCT_FRAC_BITS);
+
+    for (size_t i=0; i < N_MFCC; ++i) {
+        int32_t sum = 0;
+        size_t largest = 0;
+
+        for (size_t j=0; j < N_MELS; ++j) {
+            int16_t value = (int16_t) lround(basis[i * N_MELS + j] * scale);
+
+            basis_fixed[i * N_MELS + j] = value;
+            sum += value;
+
+            if (abs(value) > abs(basis_fixed[i * N_MELS + largest])) {
+                largest = j;
+            }
+        }
+
+        basis_fixed[i * N_MELS + largest] -= sum;
+    }
+}
+
+void log2_table(int32_t *table) 
+{
+    for (int i=0; i <= (1 << LOG2_TABLE_BITS); ++i) {
+        double value = 1.0 + i / (double) (1 << LOG2_TABLE_BITS);
+        table[i] = (int32_t) lround(log2(value) * (1 << LOG2_FRAC_BITS));
+    }
+}
+
+// Arithmetic right shift by shift > 0 bits, rounding half up.
+
+static inline int32_t round_shift(int32_t value, int shift) 
+{
+    return (value + (1 << (shift - 1))) >> shift;
+}
+
+// log2 with LOG2_FRAC_BITS fractional bits of value > 0. The mantissa is looked
+// up in s_log2_table and linearly interpolated.
+
+static int32_t log2_fixed(uint64_t value) 
+{
+    int exponent = 63 - __builtin_clzll(value);
+
+    // Fractional bits of the mantissa, i.e. value / 2^exponent - 1
+    uint32_t mantissa;
+
+    if (exponent >= LOG2_FRAC_BITS) {
+        mantissa = (uint32_t)(value >> (exponent - LOG2_FRAC_BITS));
+    } else {
+        mantissa = (uint32_t)(value << (LOG2_FRAC_BITS - exponent));
+    }
+
+    mantissa &= (1 << LOG2_FRAC_BITS) - 1;
+
+    uint32_t index = mantissa >> (LOG2_FRAC_BITS - LOG2_TABLE_BITS);
+    int32_t weight = mantissa & ((1 << (LOG2_FRAC_BITS - LOG2_TABLE_BITS)) - 1);
+    int32_t lower = s_log2_table[index];
+    int32_t upper = s_log2_table[index + 1];
+
+    return (exponent << LOG2_FRAC_BITS) + lower + 
+           (((upper - lower) * weight) >> (LOG2_FRAC_BITS - LOG2_TABLE_BITS));
+}
+
 void preemphasis(float *wav_values, size_t num_samples, float coeff) 
 {
     for (size_t i = num_samples - 1; i > 0; --i) {
@@ -165,37 +386,103 @@ void preemphasis(float *wav_values, size_t num_samples, float coeff)
 
 esp_err_t malloc_mfcc_module() 
 {
-    // Memory allocation
+    // Memory allocation. The window, mel filter bank and DCT basis in float are
+    // also needed to derive the fixed-point tables, and freed afterwards if the
+    // float pipeline is not built.
 
     s_window = (float *)malloc(WIN_LENGTH_SAMPLES * sizeof(float));
-    s_fft_operand = (float *)malloc(2*WIN_LENGTH_SAMPLES * sizeof(float));
-    s_power_spectrum = (float *)malloc((NUM_FFT/2 + 1) * sizeof(float));
-    s_mel_buffer = (float *)malloc(2*N_MELS * sizeof(float));
-
-    s_mel_filt = (float **)malloc(N_MELS * sizeof(float *));
+    s_dct_basis = (float *)malloc(N_MFCC * N_MELS * sizeof(float));
+    s_stream_buffer = (int16_t *)malloc(WIN_LENGTH_SAMPLES * sizeof(int16_t));
+    s_stream_fill = 0;
 
-    for (size_t i = 0; i < N_MELS; ++i) {
-        s_mel_filt[i] = (float *)malloc((NUM_FFT/2 + 1) * sizeof(float));
+    size_t num_mel_weights = mel_filters(s_mel_start, s_mel_length, NULL);
+    s_mel_filt = (float *)malloc(num_mel_weights * sizeof(float));
 
-        if (s_mel_filt[i] == NULL) {
-            ESP_LOGE(PREPROCESS_TAG, "Error memory allocation");
-            return ESP_ERR_NO_MEM;
-        }
+    if (s_window == NULL || s_dct_basis == NULL || s_stream_buffer == NULL || 
+        s_mel_filt == NULL) {
+        ESP_LOGE(PREPROCESS_TAG, "Error memory allocation");
+        return ESP_ERR_NO_MEM;
     }
 
-    // Abort if any memory allocation fails.
+    dsps_wind_hann_f32(s_window, WIN_LENGTH_SAMPLES); // Checked
+    mel_filters(s_mel_start, s_mel_length, s_mel_filt);
+    dct_basis(s_dct_basis);
 
-    if (s_window == NULL || s_fft_operand == NULL || s_power_spectrum == NULL || 
-       s_mel_filt == NULL || s_mel_buffer == NULL) {
+#if MFCC_FLOAT_PIPELINE
+#if REAL_FFT
+    s_fft_operand = (float *)malloc(WIN_LENGTH_SAMPLES * sizeof(float));
+    s_fft_twiddle = (float *)malloc((NUM_FFT + 2) * sizeof(float));
+#else
+    s_fft_operand = (float *)malloc(2*WIN_LENGTH_SAMPLES * sizeof(float));
+    s_fft_twiddle = NULL;
+#endif
+    s_power_spectrum = (float *)malloc((NUM_FFT/2 + 1) * sizeof(float));
+    s_mel_buffer = (float *)malloc(N_MELS * sizeof(float));
+
+    if (s_fft_operand == NULL || s_power_spectrum == NULL || 
+       (REAL_FFT && s_fft_twiddle == NULL) || s_mel_buffer == NULL) {
         ESP_LOGE(PREPROCESS_TAG, "Error memory allocation");
         return ESP_ERR_NO_MEM;
     }
 
     // fft -> possible optimization: have it as a global variable
 
+#if REAL_FFT
+    dsps_fft2r_init_fc32(NULL, NUM_FFT / 2);
+    fft_twiddle(s_fft_twiddle);
+#else
     dsps_fft2r_init_fc32(NULL, NUM_FFT);
-    dsps_wind_hann_f32(s_window, WIN_LENGTH_SAMPLES); // Checked
-    mel_filters(s_mel_filt);
+#endif
+#endif
+
+#if MFCC_FIXED_PIPELINE
+    s_window_fixed = (int16_t *)malloc(WIN_LENGTH_SAMPLES * sizeof(int16_t));
+    s_fft_operand_fixed = (int16_t *)malloc(WIN_LENGTH_SAMPLES * sizeof(int16_t));
+    s_power_spectrum_fixed = (uint32_t *)malloc((NUM_FFT/2 + 1) * sizeof(uint32_t));
+    s_mel_filt_fixed = (int16_t *)malloc(num_mel_weights * sizeof(int16_t));
+    s_mel_buffer_fixed = (int32_t *)malloc(N_MELS * sizeof(int32_t));
+    s_dct_basis_fixed = (int16_t *)malloc(N_MFCC * N_MELS * sizeof(int16_t));
+    s_log2_table = (int32_t *)malloc(((1 << LOG2_TABLE_BITS) + 1) * sizeof(int32_t));
+
+    if (s_window_fixed == NULL || s_fft_operand_fixed == NULL || 
+        s_power_spectrum_fixed == NULL || s_mel_filt_fixed == NULL || 
+        s_mel_buffer_fixed == NULL || s_dct_basis_fixed == NULL || 
+        s_log2_table == NULL) {
+        ESP_LOGE(PREPROCESS_TAG, "Error memory allocation");
+        return ESP_ERR_NO_MEM;
+    }
+
+    // Fixed-point tables are derived from the float ones
+
+    dsps_fft2r_init_sc16(NULL, NUM_FFT / 2);
+
+    for (size_t i = 0; i < WIN_LENGTH_SAMPLES; ++i) {
+        s_window_fixed[i] = (int16_t) lroundf(s_window[i] * INT16_MAX);
+    }
+
+    for (size_t i = 0; i < num_mel_weights; ++i) {
+        s_mel_filt_fixed[i] = (int16_t) lroundf(s_mel_filt[i] * (1 << MEL_WEIGHT_FRAC_BITS));
+    }
+
+    dct_basis_fixed(s_dct_basis, s_dct_basis_fixed);
+    log2_table(s_log2_table);
+
+    s_log2_mel_min = (int32_t) lround((log2(POWER_MIN) + FIXED_MEL_GAIN_LOG2) * 
+                                      (1 << LOG2_FRAC_BITS));
+
+    // The gain of mfcc_fixed_stream_normalize is at most 2 * log2_fixed(INT16_MAX)
+
+    s_log2_mel_min_unnormalized = s_log2_mel_min - 2 * log2_fixed(INT16_MAX);
+#endif
+
+#if !MFCC_FLOAT_PIPELINE
+    free(s_window);
+    free(s_mel_filt);
+    free(s_dct_basis);
+    s_window = NULL;
+    s_mel_filt = NULL;
+    s_dct_basis = NULL;
+#endif
 
     // Inform user
 
@@ -205,10 +492,349 @@ esp_err_t malloc_mfcc_module()
 }
 
 
-esp_err_t mfcc(int16_t *wav_values, size_t num_samples, 
-               float ***output, size_t *output_frames) 
+/**
+ * @brief Compute the log mel energies of a single frame.
+ * 
+ * @param frame [in] First sample of the frame (WIN_LENGTH_SAMPLES samples).
+ * @param power_min [in] Floor of the mel energies before the log.
+ * @param output [out] N_MELS log mel energies in dB.
+ * 
+ * @return Error values according to ESP-IDF coding style.
+*/
+static esp_err_t mel_frame(const int16_t *frame, double power_min, float *output) 
+{
+    esp_err_t ret = ESP_OK;
+
+#if !MFCC_FLOAT_PIPELINE
+    ESP_LOGE(PREPROCESS_TAG, "Float pipeline not built (CONFIG_MFCC_FIXED_POINT)");
+    return ESP_ERR_NOT_SUPPORTED;
+#endif
+
+#if REAL_FFT
+
+    // Even samples are packed into the real parts, odd samples into the 
+    // imaginary parts, which is the natural layout of the frame.
+
+    for (size_t j=0; j < WIN_LENGTH_SAMPLES; ++j) {
+        float value = frame[j] / (float) INT16_MAX;
+        s_fft_operand[j] = value * s_window[j];
+    }
+
+    ret = dsps_fft2r_fc32(s_fft_operand, NUM_FFT / 2);
+    ret = dsps_bit_rev_fc32(s_fft_operand, NUM_FFT / 2);
+
+    if (ret != ESP_OK) {
+        ESP_LOGE(PREPROCESS_TAG, "Error FFT computation");
+        return ret;
+    }
+
+    // Power spectrum computation
+
+    // Z = FFT(z) with z[n] = x[2n] + i*x[2n+1] is split into the spectra of the
+    // even and odd samples E[k] = (Z[k] + Z*[M-k]) / 2 and 
+    // O[k] = -i (Z[k] - Z*[M-k]) / 2, where M = NUM_FFT/2 and Z[M] = Z[0].
+    // Then X[k] = E[k] + W^k O[k] with W = exp(-2*pi*i / NUM_FFT).
+
+    for (size_t j=0; j < NUM_FFT/2 + 1; ++j) {
+        size_t k = j % (NUM_FFT/2);
+        size_t l = (NUM_FFT/2 - j) % (NUM_FFT/2);
+
+        float z_re = s_fft_operand[2*k], z_im = s_fft_operand[2*k + 1];
+        float zc_re = s_fft_operand[2*l], zc_im = -s_fft_operand[2*l + 1];
+
+        float even_re = 0.5f * (z_re + zc_re);
+        float even_im = 0.5f * (z_im + zc_im);
+        float odd_re = 0.5f * (z_im - zc_im);
+        float odd_im = -0.5f * (z_re - zc_re);
+
+        float w_re = s_fft_twiddle[2*j], w_im = s_fft_twiddle[2*j + 1];
+
+        float re_part = even_re + w_re * odd_re - w_im * odd_im; // Re
+        float im_part = even_im + w_re * odd_im + w_im * odd_re; // Im
+
+        float power = re_part * re_part + im_part * im_part;
+
+        s_power_spectrum[j] = power; 
+    }
+
+#else
+
+    for (size_t j=0; j < WIN_LENGTH_SAMPLES; ++j) {
+        float value = frame[j] / (float) INT16_MAX;
+        // float value = frame[j];
+        s_fft_operand[2*j] = value * s_window[j]; // Re
+        s_fft_operand[2*j + 1] = 0; // Im
+    }
+
+    ret = dsps_fft2r_fc32(s_fft_operand, WIN_LENGTH_SAMPLES);
+    ret = dsps_bit_rev_fc32(s_fft_operand, WIN_LENGTH_SAMPLES);
+
+    if (ret != ESP_OK) {
+        ESP_LOGE(PREPROCESS_TAG, "Error FFT computation");
+        return ret;
+    }
+
+    // Power spectrum computation
+
+    // Notice that we only need the first half of the FFT result,
+    // since the second half has the same values but in reverse order. 
+
+    for (size_t j=0; j < NUM_FFT/2 + 1; ++j) {
+        float re_part = s_fft_operand[2*j]; // Re
+        float im_part = s_fft_operand[2*j + 1]; // Im
+
+        float power = re_part * re_part + im_part * im_part;
+
+        s_power_spectrum[j] = power; 
+    }
+
+#endif
+
+    // Mel filter bank computation
+
+    const float *mel_weights = s_mel_filt;
+
+    for (size_t j = 0; j < N_MELS; ++j) {
+        const float *power_spectrum = &s_power_spectrum[s_mel_start[j]];
+        double mel_power = 0;
+
+        for (size_t k=0; k < s_mel_length[j]; ++k) {
+            mel_power += power_spectrum[k] * mel_weights[k]; // Checked
+        }
+
+        mel_weights += s_mel_length[j];
+
+        output[j] = POWER_TO_DB(mel_power, power_min);
+    }
+
+    return ret;
+}
+
+
+// DCT of N_MELS log mel energies. Only the kept coefficients are computed.
+
+static void mel_dct(const float *mels, float *output) 
+{
+    const float *basis = s_dct_basis;
+
+    for (size_t j=0; j<N_MFCC; ++j) {
+        float sum = 0;
+
+        for (size_t k=0; k < N_MELS; ++k) {
+            sum += mels[k] * basis[k];
+        }
+
+        basis += N_MELS;
+
+        output[j] = DCT_SCALE * sum;
+    }
+}
+
+
+/**
+ * @brief Compute the MFCC coefficients of a single frame.
+ * 
+ * @param frame [in] First sample of the frame (WIN_LENGTH_SAMPLES samples).
+ * @param output [out] N_MFCC coefficients.
+ * 
+ * @return Error values according to ESP-IDF coding style.
+*/
+static esp_err_t mfcc_frame(const int16_t *frame, float *output) 
+{
+    esp_err_t ret = mel_frame(frame, POWER_MIN, s_mel_buffer);
+
+    if (ret == ESP_OK) {
+        mel_dct(s_mel_buffer, output);
+    }
+
+    return ret;
+}
+
+
+/**
+ * @brief Compute the log mel energies of a single frame in fixed-point 
+ * arithmetic: Q15 windowing, int16 FFT, integer mel filter bank and log2 via 
+ * lookup table.
+ * 
+ * The frame is scaled by a power of two before the FFT (block floating point),
+ * up for quiet frames and down for loud ones, such that it fits the int16 FFT
+ * with one bit of headroom. The scaling is undone on the log mel energies.
+ * 
+ * @param frame [in] First sample of the frame (WIN_LENGTH_SAMPLES samples).
+ * @param log_min [in] Floor of the log mel energies.
+ * @param output [out] N_MELS log2 mel energies with LOG2_FRAC_BITS.
+ * 
+ * @return Error values according to ESP-IDF coding style.
+*/
+static esp_err_t mel_frame_fixed(const int16_t *frame, int32_t log_min, 
+                                 int32_t *output) 
+{
+    esp_err_t ret = ESP_OK;
+
+#if !MFCC_FIXED_PIPELINE
+    ESP_LOGE(PREPROCESS_TAG, "Fixed-point pipeline not built (CONFIG_MFCC_FIXED_POINT not set)");
+    return ESP_ERR_NOT_SUPPORTED;
+#endif
+
+    // Block floating point: the windowed frame (a Q30 product) is rounded to 
+    // its Q15 value times 2^block_shift, such that its maximum is at most 
+    // FIXED_FFT_MAX, but larger than FIXED_FFT_MAX / 2. Scaling before the 
+    // rounding keeps the precision of quiet frames.
+
+    int32_t max_product = 0;
+
+    for (size_t j=0; j < WIN_LENGTH_SAMPLES; ++j) {
+        int32_t product = abs(frame[j] * s_window_fixed[j]);
+        max_product = (product > max_product) ? product : max_product;
+    }
+
+    int window_shift = 15;
+
+    while (round_shift(max_product, window_shift) > FIXED_FFT_MAX) {
+        ++window_shift;
+    }
+
+    while (window_shift > 1 && round_shift(max_product, window_shift - 1) <= FIXED_FFT_MAX) {
+        --window_shift;
+    }
+
+    int block_shift = 15 - window_shift;
+
+    for (size_t j=0; j < WIN_LENGTH_SAMPLES; ++j) {
+        s_fft_operand_fixed[j] = round_shift(frame[j] * s_window_fixed[j], window_shift);
+    }
+
+    // The ANSI kernel is used, since the SIMD kernels of esp-dsp round 
+    // differently, which would break bit-exactness with the PC build.
+
+    ret = dsps_fft2r_sc16_ansi(s_fft_operand_fixed, NUM_FFT / 2);
+    ret = dsps_bit_rev_sc16_ansi(s_fft_operand_fixed, NUM_FFT / 2);
+
+    if (ret != ESP_OK) {
+        ESP_LOGE(PREPROCESS_TAG, "Error FFT computation");
+        return ret;
+    }
+
+    ret = dsps_cplx2real_sc16_ansi(s_fft_operand_fixed, NUM_FFT / 2);
+
+    // Power spectrum computation. The real part of bin 0 holds the DC 
+    // component, its imaginary part the Nyquist component.
+
+    for (size_t j=0; j < NUM_FFT/2; ++j) {
+        int32_t re_part = s_fft_operand_fixed[2*j]; // Re
+        int32_t im_part = (j > 0) ? s_fft_operand_fixed[2*j + 1] : 0; // Im
+
+        s_power_spectrum_fixed[j] = re_part * re_part + im_part * im_part;
+    }
+
+    int32_t nyquist = s_fft_operand_fixed[1];
+    s_power_spectrum_fixed[NUM_FFT/2] = nyquist * nyquist;
+
+    // Mel filter bank computation
+
+    const int16_t *mel_weights = s_mel_filt_fixed;
+
+    for (size_t j = 0; j < N_MELS; ++j) {
+        const uint32_t *power_spectrum = &s_power_spectrum_fixed[s_mel_start[j]];
+        uint64_t mel_power = 0;
+
+        for (size_t k=0; k < s_mel_length[j]; ++k) {
+            mel_power += (uint64_t) power_spectrum[k] * mel_weights[k];
+        }
+
+        mel_weights += s_mel_length[j];
+
+        // The power spectrum is scaled by 2^(2 * block_shift), which is undone
+        // in the log domain. As in the float pipeline, mel energies are 
+        // clamped to a floor, which also covers empty bands.
+
+        int32_t log_power = log_min;
+
+        if (mel_power > 0) {
+            log_power = log2_fixed(mel_power) - 2 * block_shift * (1 << LOG2_FRAC_BITS);
+        }
+
+        output[j] = (log_power > log_min) ? log_power : log_min;
+    }
+
+    return ret;
+}
+
+
+// Integer DCT of N_MELS log2 mel energies. Only the kept coefficients are 
+// computed.
+
+static void mel_dct_fixed(const int32_t *mels, int16_t *output) 
 {
+    const int16_t *basis = s_dct_basis_fixed;
+    const int shift = LOG2_FRAC_BITS + DCT_FRAC_BITS + MFCC_FIXED_EXPONENT;
+
+    for (size_t j=0; j<N_MFCC; ++j) {
+        int64_t sum = 0;
+
+        for (size_t k=0; k < N_MELS; ++k) {
+            sum += (int64_t) mels[k] * basis[k];
+        }
+
+        basis += N_MELS;
+
+        sum = (sum + ((int64_t) 1 << (shift - 1))) >> shift;
+        output[j] = (sum > INT16_MAX) ? INT16_MAX : (sum < INT16_MIN) ? INT16_MIN : sum;
+    }
+}
+
+
+/**
+ * @brief Compute the MFCC coefficients of a single frame in fixed-point 
+ * arithmetic, see mel_frame_fixed, followed by an integer DCT.
+ * 
+ * @param frame [in] First sample of the frame (WIN_LENGTH_SAMPLES samples).
+ * @param output [out] N_MFCC coefficients, scaled by 2^-MFCC_FIXED_EXPONENT.
+ * 
+ * @return Error values according to ESP-IDF coding style.
+*/
+static esp_err_t mfcc_frame_fixed(const int16_t *frame, int16_t *output) 
+{
+    esp_err_t ret = mel_frame_fixed(frame, s_log2_mel_min, s_mel_buffer_fixed);
+
+    if (ret == ESP_OK) {
+        mel_dct_fixed(s_mel_buffer_fixed, output);
+    }
+
+    return ret;
+}
 
+
+/**
+ * @brief Compute the MFCC coefficients of all frames of a signal into a 
+ * contiguous buffer. The FFT tables are left initialized.
+ * 
+ * @param wav_values [in] Input audio signal.
+ * @param num_frames [in] Number of frames to compute.
+ * @param output [out] Frame i is stored at output[i * N_MFCC].
+ * 
+ * @return Error values according to ESP-IDF coding style.
+*/
+static esp_err_t mfcc_frames(const int16_t *wav_values, size_t num_frames, 
+                             float *output) 
+{
+    esp_err_t ret = ESP_OK;
+
+    for (size_t i = 0; i<num_frames; ++i) {
+        ret = mfcc_frame(&wav_values[i * HOP_LENGTH_SAMPLES], &output[i * N_MFCC]);
+
+        if (ret != ESP_OK) {
+            return ret;
+        }
+    }
+
+    return ret;
+}
+
+
+esp_err_t mfcc(int16_t *wav_values, size_t num_samples, 
+               float *output, size_t *output_frames) 
+{
     esp_err_t ret = ESP_OK;
 
     size_t num_frames = get_num_frames(num_samples);
@@ -218,120 +844,416 @@ esp_err_t mfcc(int16_t *wav_values, size_t num_samples,
 
     // Parameters check
 
-    if (wav_values == NULL) {
-        ESP_LOGE(PREPROCESS_TAG, "Error wav_values is NULL");
+    if (wav_values == NULL || output == NULL) {
+        ESP_LOGE(PREPROCESS_TAG, "Error wav_values or output is NULL");
         *output_frames = 0;
         ret = ESP_ERR_INVALID_ARG;
         return ret;
     }
+
+    // Preemphasis
+
+    // preemphasis(wav_values, num_samples, 0.97); // 0.97 usual value
     
-    *output = (float **)malloc(num_frames * sizeof(float *));
+    // Framing computation
+
+    ret = mfcc_frames(wav_values, num_frames, output);
 
-    if (*output == NULL) {
-        ESP_LOGE(PREPROCESS_TAG, "Error output allocation");
-        ret = ESP_ERR_NO_MEM;
+    *output_frames = num_frames; // Save number of frames within output_frames.
+
+    // Free memory
+    
+    dsps_fft2r_deinit_fc32();
+    
+    return ret;
+}
+
+
+esp_err_t mfcc_batch(int16_t *clips, size_t num_clips, size_t num_samples, 
+                     float *output) 
+{
+    esp_err_t ret = ESP_OK;
+
+    size_t num_frames = get_num_frames(num_samples);
+
+    // Parameters check
+
+    if (clips == NULL || output == NULL) {
+        ESP_LOGE(PREPROCESS_TAG, "Error clips or output is NULL");
+        ret = ESP_ERR_INVALID_ARG;
         return ret;
     }
-    
-    for (size_t i = 0; i<num_frames; ++i) {
-        (*output)[i] = (float *)malloc(N_MFCC * sizeof(float));
 
-        if ((*output)[i] == NULL) {
-            ESP_LOGE(PREPROCESS_TAG, "Error output[%d] allocation", i);
-            ret = ESP_ERR_NO_MEM;
-            return ret;
+    // Window, mel filter bank and FFT tables are shared by all clips.
+
+    for (size_t i = 0; i < num_clips; ++i) {
+        ret = mfcc_frames(&clips[i * num_samples], num_frames, 
+                          &output[i * num_frames * N_MFCC]);
+
+        if (ret != ESP_OK) {
+            ESP_LOGE(PREPROCESS_TAG, "Error computing MFCC of clip %d", i);
+            break;
         }
     }
 
-    // Preemphasis
-
-    // preemphasis(wav_values, num_samples, 0.97); // 0.97 usual value
+    // Free memory
     
-    // Framing computation
+    dsps_fft2r_deinit_fc32();
 
-    for (size_t i = 0; i<num_frames; ++i) {
-        size_t ref_frame = i * HOP_LENGTH_SAMPLES;
+    return ret;
+}
 
-        for (size_t j=0; j < WIN_LENGTH_SAMPLES; ++j) {
-            float value = wav_values[ref_frame + j] / (float) INT16_MAX;
-            // float value = wav_values[ref_frame + j];
-            s_fft_operand[2*j] = value * s_window[j]; // Re
-            s_fft_operand[2*j + 1] = 0; // Im
-        }
 
-        ret = dsps_fft2r_fc32(s_fft_operand, WIN_LENGTH_SAMPLES);
-        ret = dsps_bit_rev_fc32(s_fft_operand, WIN_LENGTH_SAMPLES);
+esp_err_t mfcc_stream_reset() 
+{
+    s_stream_fill = 0;
+    s_stream_peak = 0;
 
-        if (ret != ESP_OK) {
-            ESP_LOGE(PREPROCESS_TAG, "Error FFT computation");
-            return ret;
+    return ESP_OK;
+}
+
+
+esp_err_t mfcc_fixed_batch(int16_t *clips, size_t num_clips, size_t num_samples,
+                           int16_t *output) 
+{
+    esp_err_t ret = ESP_OK;
+
+    size_t num_frames = get_num_frames(num_samples);
+
+    // Parameters check
+
+    if (clips == NULL || output == NULL) {
+        ESP_LOGE(PREPROCESS_TAG, "Error clips or output is NULL");
+        ret = ESP_ERR_INVALID_ARG;
+        return ret;
+    }
+
+    for (size_t i = 0; i < num_clips; ++i) {
+        for (size_t j = 0; j < num_frames; ++j) {
+            ret = mfcc_frame_fixed(&clips[i * num_samples + j * HOP_LENGTH_SAMPLES],
+                                   &output[(i * num_frames + j) * N_MFCC]);
+
+            if (ret != ESP_OK) {
+                ESP_LOGE(PREPROCESS_TAG, "Error computing MFCC of clip %d", i);
+                return ret;
+            }
         }
+    }
 
-        // Power spectrum computation
+    return ret;
+}
 
-        // Notice that we only need the first half of the FFT result,
-        // since the second half has the same values but in reverse order. 
 
-        for (size_t j=0; j < NUM_FFT/2 + 1; ++j) {
-            float re_part = s_fft_operand[2*j]; // Re
-            float im_part = s_fft_operand[2*j + 1]; // Im
+/**
+ * @brief Shared implementation of mfcc_stream_push, mfcc_fixed_stream_push, 
+ * mel_stream_push and mel_fixed_stream_push.
+ * 
+ * @param fixed [in] Whether output holds fixed-point (int16_t MFCCs or int32_t
+ * log2 mel energies) or float values.
+ * @param mels [in] Whether unclamped log mel energies (N_MELS per frame) are 
+ * emitted instead of MFCCs.
+*/
+static esp_err_t stream_push(const int16_t *samples, size_t num_samples, 
+                             void *output, size_t max_frames, 
+                             size_t *output_frames, bool fixed, bool mels) 
+{
+    esp_err_t ret = ESP_OK;
 
-            float power = re_part * re_part + im_part * im_part;
+    *output_frames = 0;
 
-            s_power_spectrum[j] = power; 
+    // Parameters check
+
+    if (samples == NULL || (output == NULL && max_frames > 0)) {
+        ESP_LOGE(PREPROCESS_TAG, "Error samples or output is NULL");
+        ret = ESP_ERR_INVALID_ARG;
+        return ret;
+    }
+
+    for (size_t i = 0; i < num_samples; ++i) {
+        int32_t value = abs(samples[i]);
+        s_stream_peak = (value > s_stream_peak) ? value : s_stream_peak;
+    }
+
+    while (num_samples > 0) {
+
+        // Fill the window
+
+        size_t count = WIN_LENGTH_SAMPLES - s_stream_fill;
+        count = (count < num_samples) ? count : num_samples;
+
+        memcpy(&s_stream_buffer[s_stream_fill], samples, count * sizeof(int16_t));
+        s_stream_fill += count;
+        samples += count;
+        num_samples -= count;
+
+        if (s_stream_fill < WIN_LENGTH_SAMPLES) {
+            break;
         }
 
-        // Mel filter bank computation
+        // Window is full: emit frame (dropped if output is full) and hop
 
-        for (size_t j = 0; j < N_MELS; ++j) {
-            double mel_power = 0;
+        if (*output_frames < max_frames) {
+            size_t offset = *output_frames * (mels ? N_MELS : N_MFCC);
+
+            if (mels && fixed) {
+                ret = mel_frame_fixed(s_stream_buffer, s_log2_mel_min_unnormalized, 
+                                      &((int32_t *)output)[offset]);
+            } else if (mels) {
+                ret = mel_frame(s_stream_buffer, POWER_MIN_UNNORMALIZED, 
+                                &((float *)output)[offset]);
+            } else if (fixed) {
+                ret = mfcc_frame_fixed(s_stream_buffer, &((int16_t *)output)[offset]);
+            } else {
+                ret = mfcc_frame(s_stream_buffer, &((float *)output)[offset]);
+            }
 
-            for (size_t k=0; k < NUM_FFT/2 + 1; ++k) {
-                mel_power += s_power_spectrum[k] * s_mel_filt[j][k]; // Checked
+            if (ret != ESP_OK) {
+                return ret;
             }
 
-            s_mel_buffer[j] = POWER_TO_DB(mel_power); // Re
+            ++(*output_frames);
         }
 
-        for (size_t j = N_MELS; j < 2*N_MELS; ++j) {
-            s_mel_buffer[j] = 0; // Im
+        memmove(s_stream_buffer, &s_stream_buffer[HOP_LENGTH_SAMPLES], 
+                (WIN_LENGTH_SAMPLES - HOP_LENGTH_SAMPLES) * sizeof(int16_t));
+        s_stream_fill -= HOP_LENGTH_SAMPLES;
+    }
+
+    return ret;
+}
+
+
+esp_err_t mfcc_stream_push(const int16_t *samples, size_t num_samples, 
+                           float *output, size_t max_frames, 
+                           size_t *output_frames) 
+{
+    return stream_push(samples, num_samples, output, max_frames, 
+                       output_frames, false, false);
+}
+
+
+esp_err_t mfcc_fixed_stream_push(const int16_t *samples, size_t num_samples, 
+                                 int16_t *output, size_t max_frames, 
+                                 size_t *output_frames) 
+{
+    return stream_push(samples, num_samples, output, max_frames, 
+                       output_frames, true, false);
+}
+
+
+esp_err_t mel_stream_push(const int16_t *samples, size_t num_samples, 
+                          float *output, size_t max_frames, 
+                          size_t *output_frames) 
+{
+    return stream_push(samples, num_samples, output, max_frames, 
+                       output_frames, false, true);
+}
+
+
+esp_err_t mel_fixed_stream_push(const int16_t *samples, size_t num_samples, 
+                                int32_t *output, size_t max_frames, 
+                                size_t *output_frames) 
+{
+    return stream_push(samples, num_samples, output, max_frames, 
+                       output_frames, true, true);
+}
+
+
+// Peak normalization of the streamed signal. Training clips are scaled such 
+// that their peak is INT16_MAX (see _load_audio in audio_processing.py). Such
+// a gain adds a constant to the log mel energies of all frames, which cancels
+// in the kept DCT coefficients, except where the energies are clamped to 
+// POWER_MIN. Hence the gain is applied to the unclamped energies, before the
+// clamp and the DCT. A silent signal is left unscaled.
+
+esp_err_t mfcc_stream_normalize(const float *mels, size_t num_frames, 
+                                float *output) 
+{
+    // Parameters check
+
+    if (mels == NULL || output == NULL) {
+        ESP_LOGE(PREPROCESS_TAG, "Error mels or output is NULL");
+        return ESP_ERR_INVALID_ARG;
+    }
+
+#if !MFCC_FLOAT_PIPELINE
+    ESP_LOGE(PREPROCESS_TAG, "Float pipeline not built (CONFIG_MFCC_FIXED_POINT)");
+    return ESP_ERR_NOT_SUPPORTED;
+#endif
+
+    float gain = (s_stream_peak > 0) ? 
+        20.0 * log10(INT16_MAX / (double) s_stream_peak) : 0;
+    float min_db = POWER_TO_DB(0, POWER_MIN);
+
+    for (size_t i = 0; i < num_frames; ++i) {
+        for (size_t j = 0; j < N_MELS; ++j) {
+            float value = mels[i * N_MELS + j] + gain;
+            s_mel_buffer[j] = (value > min_db) ? value : min_db;
         }
 
-        // DCT computation. This output is different than Librosa's. 
-        float dct_output[N_MELS];
-        dsps_dct_f32_ref(s_mel_buffer, N_MELS, dct_output); 
+        mel_dct(s_mel_buffer, &output[i * N_MFCC]);
+    }
+
+    return ESP_OK;
+}
 
-        // Store result
-        
-        // The first coefficient is discarded, as in Librosa's implementation.
 
-        for (size_t j=0; j<N_MFCC; ++j) {
-            (*output)[i][j] = dct_output[j+1];
+esp_err_t mfcc_fixed_stream_normalize(const int32_t *mels, size_t num_frames, 
+                                      int16_t *output) 
+{
+    // Parameters check
+
+    if (mels == NULL || output == NULL) {
+        ESP_LOGE(PREPROCESS_TAG, "Error mels or output is NULL");
+        return ESP_ERR_INVALID_ARG;
+    }
+
+#if !MFCC_FIXED_PIPELINE
+    ESP_LOGE(PREPROCESS_TAG, "Fixed-point pipeline not built (CONFIG_MFCC_FIXED_POINT not set)");
+    return ESP_ERR_NOT_SUPPORTED;
+#endif
+
+    int32_t gain = (s_stream_peak > 0) ? 
+        2 * (log2_fixed(INT16_MAX) - log2_fixed(s_stream_peak)) : 0;
+
+    for (size_t i = 0; i < num_frames; ++i) {
+        for (size_t j = 0; j < N_MELS; ++j) {
+            int32_t value = mels[i * N_MELS + j] + gain;
+            s_mel_buffer_fixed[j] = (value > s_log2_mel_min) ? value : s_log2_mel_min;
         }
-        
+
+        mel_dct_fixed(s_mel_buffer_fixed, &output[i * N_MFCC]);
     }
 
-    *output_frames = num_frames; // Save number of frames within output_frames.
+    return ESP_OK;
+}
 
-    // Free memory
-    
-    dsps_fft2r_deinit_fc32();
-    
-    return ret;
-    
-};
+
+// Quantization of the model input. Same specification as quantize_features in
+// audio_processing.py: in single precision, each value v becomes
+// min(floor((v - min) / (max - min) * 2^-exponent), 2^(bits - 1) - 1), and 0 if
+// max == min. Fixed-point values are converted to float exactly beforehand.
+
+static inline int32_t quantize_value(float value, float min_value, float range, 
+                                     float scale, int32_t max_quant) 
+{
+    float quant = (value - min_value) / range * scale;
+    return (quant >= max_quant) ? max_quant : (int32_t) quant;
+}
+
+
+void mfcc_range_update(const float *values, size_t num_values, 
+                       float *min_value, float *max_value) 
+{
+    for (size_t i = 0; i < num_values; ++i) {
+        *min_value = (values[i] < *min_value) ? values[i] : *min_value;
+        *max_value = (values[i] > *max_value) ? values[i] : *max_value;
+    }
+}
+
+
+void mfcc_fixed_range_update(const int16_t *values, size_t num_values, 
+                             int16_t *min_value, int16_t *max_value) 
+{
+    for (size_t i = 0; i < num_values; ++i) {
+        *min_value = (values[i] < *min_value) ? values[i] : *min_value;
+        *max_value = (values[i] > *max_value) ? values[i] : *max_value;
+    }
+}
+
+
+esp_err_t mfcc_quantize(const float *values, size_t num_values, 
+                        float min_value, float max_value, int exponent, 
+                        int bits, int output_bits, void *output) 
+{
+    // Parameters check
+
+    if (values == NULL || output == NULL || (bits != 8 && bits != 16) || 
+        (output_bits != 8 && output_bits != 16) || bits > output_bits) {
+        ESP_LOGE(PREPROCESS_TAG, "Error values or output is NULL or bits invalid");
+        return ESP_ERR_INVALID_ARG;
+    }
+
+    float range = max_value - min_value;
+    float scale = ldexpf(1.0f, -exponent);
+    int32_t max_quant = (1 << (bits - 1)) - 1;
+
+    for (size_t i = 0; i < num_values; ++i) {
+        int32_t quant = (range > 0) ? 
+            quantize_value(values[i], min_value, range, scale, max_quant) : 0;
+
+        if (output_bits == 8) {
+            ((int8_t *)output)[i] = quant;
+        } else {
+            ((int16_t *)output)[i] = quant;
+        }
+    }
+
+    return ESP_OK;
+}
+
+
+esp_err_t mfcc_fixed_quantize(const int16_t *values, size_t num_values, 
+                              int16_t min_value, int16_t max_value, 
+                              int exponent, int bits, int output_bits, 
+                              void *output) 
+{
+    // Parameters check
+
+    if (values == NULL || output == NULL || (bits != 8 && bits != 16) || 
+        (output_bits != 8 && output_bits != 16) || bits > output_bits) {
+        ESP_LOGE(PREPROCESS_TAG, "Error values or output is NULL or bits invalid");
+        return ESP_ERR_INVALID_ARG;
+    }
+
+    float min_float = ldexpf(min_value, MFCC_FIXED_EXPONENT);
+    float range = ldexpf(max_value, MFCC_FIXED_EXPONENT) - min_float;
+    float scale = ldexpf(1.0f, -exponent);
+    int32_t max_quant = (1 << (bits - 1)) - 1;
+
+    for (size_t i = 0; i < num_values; ++i) {
+        float value = ldexpf(values[i], MFCC_FIXED_EXPONENT);
+        int32_t quant = (range > 0) ? 
+            quantize_value(value, min_float, range, scale, max_quant) : 0;
+
+        if (output_bits == 8) {
+            ((int8_t *)output)[i] = quant;
+        } else {
+            ((int16_t *)output)[i] = quant;
+        }
+    }
+
+    return ESP_OK;
+}
 
 
 esp_err_t free_mfcc_module() 
 {
+    // FFT tables are only freed by mfcc() if the streaming interface is not used
+
+#if MFCC_FLOAT_PIPELINE
+    dsps_fft2r_deinit_fc32();
+#endif
+
     free(s_window);
     free(s_fft_operand);
+    free(s_fft_twiddle);
     free(s_power_spectrum);
     free(s_mel_buffer);
+    free(s_dct_basis);
 
-    for (size_t i = 0; i < N_MELS; ++i) {
-        free(s_mel_filt[i]);
-    }
+#if MFCC_FIXED_PIPELINE
+    dsps_fft2r_deinit_sc16();
+#endif
+
+    free(s_window_fixed);
+    free(s_fft_operand_fixed);
+    free(s_power_spectrum_fixed);
+    free(s_mel_filt_fixed);
+    free(s_mel_buffer_fixed);
+    free(s_dct_basis_fixed);
+    free(s_log2_table);
+    free(s_stream_buffer);
 
     free(s_mel_filt);
 
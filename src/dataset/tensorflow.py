@@ -1,5 +1,6 @@
-from typing import Tuple
+from typing import List, Optional, Tuple
 
+import time
 import logging
 import pathlib
 import numpy as np
@@ -13,6 +14,58 @@ logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
+def _get_slab_dataset(
+    path: pathlib.Path,
+    group: Optional[str],
+    labels: np.array,
+    mfcc_shape: Tuple[int, int],
+    start: int,
+    stop: int,
+    slab_size: int,
+    seed: Optional[int] = None,
+) -> tf.data.Dataset:
+    """Create a dataset of single samples read in contiguous slabs.
+
+    :param path: h5 (or memory-mappable .npy) file path
+    :param group: feature configuration (see audio_processing.preprocess_sweep)
+    :param labels: class ids of all samples
+    :param mfcc_shape: shape of the mfcc features
+    :param start: first sample
+    :param stop: last sample (exclusive)
+    :param slab_size: number of samples per read
+    :param seed: if given, slabs are read in an order shuffled with this seed,
+        reshuffled each epoch, defaults to None
+    :return: dataset of (features, label) pairs
+    """
+
+    def _read_slab(slab_start):
+        slab_stop = min(slab_start + slab_size, stop)
+        # Open the file per slab, so no handle outlives the dataset
+        with audio_processing.FeatureReader(path, group) as reader:
+            data = reader[slab_start:slab_stop]
+        data = np.transpose(data, (0, 2, 3, 1))
+        return data, labels[slab_start:slab_stop, np.newaxis]
+
+    def _map_fn(slab_start):
+        data, label = tf.numpy_function(
+            _read_slab, [slab_start], (tf.float32, tf.int32), stateful=False
+        )
+        data.set_shape((None, *mfcc_shape, 1))
+        label.set_shape((None, 1))
+        return data, label
+
+    slab_starts = tf.data.Dataset.range(start, stop, slab_size)
+    if seed is not None:
+        num_slabs = -(-(stop - start) // slab_size)
+        slab_starts = slab_starts.shuffle(
+            buffer_size=max(num_slabs, 1), seed=seed, reshuffle_each_iteration=True
+        )
+
+    return slab_starts.map(
+        _map_fn, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True
+    ).unbatch()
+
+
 def get_dataset(
     data_dir: pathlib.Path,
     annotation_path: pathlib.Path,
@@ -20,51 +73,67 @@ def get_dataset(
     mfcc_shape: Tuple[int, int],
     train_test_split: float = 0.80,
     batch_size: int = 32,
+    slab_size: int = 256,
+    cache_dir: Optional[pathlib.Path] = None,
+    seed: int = 0,
+    group: Optional[str] = None,
+    shuffle_buffer: int = 2048,
 ) -> tf.data.Dataset:
     """Create a TensorFlow dataset from the preprocessed audio data.
 
+    Features are read in contiguous slabs. The training dataset is shuffled
+    deterministically with respect to seed, in two bounded stages: the order of
+    the slabs, then the samples within a buffer of shuffle_buffer samples. It is
+    read anew each epoch, so memory stays bounded by the shuffle buffer and the
+    slabs in flight. The test dataset is cached after the first epoch (in
+    memory, or on disk if cache_dir is given).
+
     :param data_dir: data directory
     :param annotation_path: annotation file path
-    :param h5file: h5 file name
+    :param h5file: h5 (or memory-mappable .npy) file name
     :param mfcc_shape: shape of the mfcc features
     :param train_test_split: train_test_split, defaults to 0.8
     :param batch_size: batch_size, defaults to 32
+    :param slab_size: number of samples per read, defaults to 256
+    :param cache_dir: directory for on-disk cache files, defaults to None
+    :param seed: shuffle seed, defaults to 0
+    :param group: feature configuration of an HDF5 file written by
+        audio_processing.preprocess_sweep, defaults to None
+    :param shuffle_buffer: number of samples shuffled after reading, defaults to 2048
     :return: tuple of train and test dataset
     """
 
-    labels = pd.read_csv(annotation_path)
-    labels.set_index("idx", inplace=True)
-    h5_path = data_dir / h5file
-
-    def _generator_fn():
-        for idx in labels.index:
-            data = audio_processing.load_features([idx], h5_path)
-            data = np.squeeze(data, axis=0)
-            data = np.transpose(data, (1, 2, 0))
-            label = labels.loc[idx, "class_id"]
-            yield data, np.array([label], dtype=np.int32)
-
-    dataset = tf.data.Dataset.from_generator(
-        _generator_fn,
-        output_signature=(
-            tf.TensorSpec(shape=(*mfcc_shape, 1), dtype=tf.float32),
-            tf.TensorSpec(shape=(1,), dtype=tf.int32),
-        ),
-    )
+    labels = pd.read_csv(annotation_path).sort_values("idx")
+    labels = labels["class_id"].to_numpy(dtype=np.int32)
+    path = data_dir / h5file
 
-    dataset_size = labels.index.max() + 1
+    dataset_size = len(labels)
     train_size = int(train_test_split * dataset_size)
     test_size = dataset_size - train_size
 
+    def _cache(dataset, name):
+        if cache_dir is None:
+            return dataset.cache()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        return dataset.cache(str(cache_dir / name))
+
     train_dataset = (
-        dataset.take(train_size)
+        _get_slab_dataset(
+            path, group, labels, mfcc_shape, 0, train_size, slab_size, seed
+        )
+        .shuffle(buffer_size=shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
         .batch(batch_size)
-        .prefetch(buffer_size=tf.data.experimental.AUTOTUNE)
+        .prefetch(buffer_size=tf.data.AUTOTUNE)
     )
     test_dataset = (
-        dataset.skip(train_size)
+        _cache(
+            _get_slab_dataset(
+                path, group, labels, mfcc_shape, train_size, dataset_size, slab_size
+            ),
+            "test",
+        )
         .batch(batch_size)
-        .prefetch(buffer_size=tf.data.experimental.AUTOTUNE)
+        .prefetch(buffer_size=tf.data.AUTOTUNE)
     )
 
     logger.info(f"Train dataset size: {train_size}")
@@ -73,6 +142,28 @@ def get_dataset(
     return train_dataset, test_dataset, train_size, test_size
 
 
+def benchmark_dataset(dataset: tf.data.Dataset, num_epochs: int = 2) -> List[float]:
+    """Measure the throughput of a dataset without a model attached.
+
+    :param dataset: batched dataset
+    :param num_epochs: number of epochs, defaults to 2
+    :return: samples per second for each epoch
+    """
+
+    throughput = []
+    for epoch in range(num_epochs):
+        num_samples = 0
+        start = time.perf_counter()
+        for data, _ in dataset:
+            num_samples += data.shape[0]
+        elapsed = time.perf_counter() - start
+
+        throughput.append(num_samples / elapsed)
+        logger.info(f"Epoch {epoch}: {throughput[-1]:.0f} samples/sec")
+
+    return throughput
+
+
 def train_model(
     model_dir: pathlib.Path,
     model_name: str,
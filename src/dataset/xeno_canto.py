@@ -1,7 +1,10 @@
-from typing import Dict, List
+from typing import Dict, List, NamedTuple, Optional
 
 import os
 import csv
+import json
+import shutil
+import hashlib
 import pathlib
 import asyncio
 from PIL import Image
@@ -47,6 +50,7 @@ def download_xeno_canto_audio(
     audio_dir: pathlib.Path,
     annotation_path: pathlib.Path,
     assets_dir: pathlib.Path,
+    cache_dir: pathlib.Path = None,
 ) -> Dict[str, int]:
     """Use xeno-canto interface to async. download bird audio files and create annotation file
 
@@ -55,13 +59,14 @@ def download_xeno_canto_audio(
     :param audio_dir: audio directory
     :param annotation_path: annotation file path
     :param assets_dir: assets directory
+    :param cache_dir: directory for cached API responses, defaults to None
     :return: map of species names to numeric values
     """
 
     logger.info("Downloading Xeno-Canto audio files ...")
 
     # Query xeno-canto API
-    page = get_composite_page(query)
+    page = get_composite_page(query, cache_dir=cache_dir)
     # plot_distribution(assets_dir, "bird_species", page, threshold=0.8)
 
     # Filter top-k species
@@ -88,20 +93,84 @@ class Page:
         return f"(Page {self.page}/{self.numPages}) numRecordings: {len(self.recordings)}, totalRecordings: {self.numRecordings}, numSpecies: {self.numSpecies}"
 
 
-def get_page(query: Dict[str, str], page: int = 1) -> Page:
-    """Get a page of recordings from the Xeno-Canto API
+def _get_page_params(query: Dict[str, str], page: int) -> Dict:
+    """Get the API parameters of a page request
 
     :param query: xeno-canto query
-    :param page: page number, defaults to 1
-    :return: page of recordings
+    :param page: page number
+    :return: request parameters
     """
-
-    # Set query and params
     query = " ".join([f"{k}:{v}" for k, v in query.items()])
-    params = {"query": query, "page": page}
-    logger.info(f"Query: {params}")
+    return {"query": query, "page": page}
+
+
+def _get_query_cache_dir(
+    cache_dir: Optional[pathlib.Path],
+    query: Dict[str, str],
+    num_recordings: int,
+    num_pages: int,
+) -> Optional[pathlib.Path]:
+    """Get the cache directory of the pages of a query, keyed by the number of
+    recordings and pages reported by its first page. Pages cached for other
+    numbers are deleted, so all pages of a query are invalidated together and
+    never mixed with pages of an older result set.
+
+    :param cache_dir: cache directory or None if caching is disabled
+    :param query: xeno-canto query
+    :param num_recordings: numRecordings of the first page
+    :param num_pages: numPages of the first page
+    :return: cache directory of the query or None
+    """
+    if cache_dir is None:
+        return None
+
+    key = hashlib.sha1(json.dumps(query, sort_keys=True).encode()).hexdigest()
+    query_dir = pathlib.Path(cache_dir) / key
+    result_dir = query_dir / f"{num_recordings}_{num_pages}"
+
+    if query_dir.is_dir():
+        for stale_dir in query_dir.iterdir():
+            if stale_dir != result_dir:
+                logger.info(f"Invalidating cached pages {stale_dir}")
+                shutil.rmtree(stale_dir, ignore_errors=True)
+
+    return result_dir
+
 
-    response = httpx.get(API_URL, timeout=60, params=params).raise_for_status().json()
+def _get_cache_path(cache_dir: Optional[pathlib.Path], page: int):
+    """Get the path of a cached API response
+
+    :param cache_dir: cache directory of the query (see _get_query_cache_dir)
+        or None if caching is disabled
+    :param page: page number
+    :return: cache file path or None
+    """
+    if cache_dir is None:
+        return None
+    return pathlib.Path(cache_dir) / f"page_{page}.json"
+
+
+def _write_cache(cache_path: Optional[pathlib.Path], response: Dict):
+    """Store an API response in the cache
+
+    :param cache_path: cache file path or None
+    :param response: API response
+    """
+    if cache_path is None:
+        return
+    os.makedirs(cache_path.parent, exist_ok=True)
+    tmp_path = cache_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as file:
+        json.dump(response, file)
+    os.replace(tmp_path, cache_path)
+
+
+def _parse_page(response: Dict) -> Page:
+    """Parse an API response
+
+    :param response: API response
+    :return: page of recordings
+    """
 
     # Store "recordings" as Pandas DataFrame with index: "id"
     recordings_df = pd.json_normalize(response.pop("recordings"))
@@ -114,30 +183,130 @@ def get_page(query: Dict[str, str], page: int = 1) -> Page:
     return Page(**response, recordings=recordings_df)
 
 
-def get_composite_page(query: Dict[str, str]) -> Page:
+def _get_page_response(query: Dict[str, str], page: int) -> Dict:
+    """Request a page of recordings from the Xeno-Canto API
+
+    :param query: xeno-canto query
+    :param page: page number
+    :return: API response
+    """
+
+    params = _get_page_params(query, page)
+    logger.info(f"Query: {params}")
+
+    return httpx.get(API_URL, timeout=60, params=params).raise_for_status().json()
+
+
+def get_page(query: Dict[str, str], page: int = 1) -> Page:
+    """Get a page of recordings from the Xeno-Canto API
+
+    :param query: xeno-canto query
+    :param page: page number, defaults to 1
+    :return: page of recordings
+    """
+
+    return _parse_page(_get_page_response(query, page))
+
+
+async def _get_page_async(
+    client: httpx.AsyncClient,
+    query: Dict[str, str],
+    page: int,
+    cache_dir: pathlib.Path,
+    semaphore,
+) -> Page:
+    """Get a page of recordings from the Xeno-Canto API asynchronously
+
+    :param client: shared HTTP client
+    :param query: xeno-canto query
+    :param page: page number
+    :param cache_dir: cache directory of the query (see _get_query_cache_dir)
+    :param semaphore: shared semaphore
+    :return: page of recordings
+    """
+
+    params = _get_page_params(query, page)
+
+    cache_path = _get_cache_path(cache_dir, page)
+    if cache_path is not None and cache_path.is_file():
+        with open(cache_path) as file:
+            return _parse_page(json.load(file))
+
+    async with semaphore:
+        logger.info(f"Query: {params}")
+        response = await client.get(API_URL, params=params)
+        response = response.raise_for_status().json()
+
+    _write_cache(cache_path, response)
+
+    return _parse_page(response)
+
+
+async def _get_pages(
+    query: Dict[str, str],
+    pages: List[int],
+    cache_dir: pathlib.Path,
+    max_connections: int,
+) -> List[Page]:
+    """Get multiple pages of recordings concurrently
+
+    :param query: xeno-canto query
+    :param pages: page numbers
+    :param cache_dir: cache directory of the query (see _get_query_cache_dir)
+    :param max_connections: max. concurrent requests
+    :return: pages of recordings in the order of pages
+    """
+
+    semaphore = asyncio.Semaphore(max_connections)
+
+    async with httpx.AsyncClient(timeout=60) as client:
+        return await asyncio.gather(
+            *[
+                _get_page_async(client, query, page, cache_dir, semaphore)
+                for page in pages
+            ]
+        )
+
+
+def get_composite_page(
+    query: Dict[str, str], cache_dir: pathlib.Path = None, max_connections: int = 8
+) -> Page:
     """Get combined pages of recordings from the Xeno-Canto API
 
+    The first page is always requested. The remaining pages are cached per
+    numRecordings and numPages of the first page (see _get_query_cache_dir),
+    so a changed result set invalidates all of them.
+
     :param query: xenocanto query
+    :param cache_dir: directory for cached API responses, defaults to None
+    :param max_connections: max. concurrent requests, defaults to 8
     :return: combined page of recordings
     """
 
     # Fetch first page
-    composite_page = get_page(query, page=1)
+    response = _get_page_response(query, page=1)
+    query_cache_dir = _get_query_cache_dir(
+        cache_dir, query, int(response["numRecordings"]), int(response["numPages"])
+    )
+    composite_page = _parse_page(response)
     composite_recordings = len(composite_page.recordings)
 
-    # Fetch and aggregate remaining pages
-    for num_page in range(2, composite_page.numPages + 1):
-        page = get_page(query, num_page)
+    # Fetch remaining pages concurrently
+    num_pages = list(range(2, composite_page.numPages + 1))
+    pages = asyncio.run(_get_pages(query, num_pages, query_cache_dir, max_connections))
 
+    for num_page, page in zip(num_pages, pages):
         composite_recordings += len(page.recordings)
         assert page.numRecordings == composite_page.numRecordings
         assert page.numSpecies == composite_page.numSpecies
         assert page.numPages == composite_page.numPages
         assert page.page == num_page
 
-        composite_page.recordings = pd.concat(
-            [composite_page.recordings, page.recordings], verify_integrity=True
-        )
+    # Aggregate all pages at once
+    composite_page.recordings = pd.concat(
+        [composite_page.recordings, *[page.recordings for page in pages]],
+        verify_integrity=True,
+    )
 
     assert composite_recordings == int(
         composite_page.numRecordings
@@ -148,97 +317,206 @@ def get_composite_page(query: Dict[str, str]) -> Page:
     return composite_page
 
 
-async def _get_audio(url: str, path: str):
+def _is_transient(error: httpx.HTTPError) -> bool:
+    """Check if a failed request is worth retrying: transport errors, rate
+    limiting (429) and server errors (5xx). Other status codes, e.g. 403 or
+    404, are permanent.
+
+    :param error: error raised by the request
+    :return: whether to retry
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return status_code == 429 or status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+async def _stream_audio(client: httpx.AsyncClient, url: str, part_path: str):
+    """Stream audio file from url to part_path, resuming a partial file
+
+    :param client: shared HTTP client
+    :param url: URL of audio file
+    :param part_path: path of the (partial) download
+    """
+
+    offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    async with client.stream("GET", url, headers=headers) as response:
+        if response.status_code == 416:
+            # Requested range not satisfiable: the partial file is complete if
+            # it has the size reported by the server ("bytes */<size>")
+            size = response.headers.get("Content-Range", "").rpartition("/")[2]
+            if size.isdigit() and int(size) == offset:
+                return
+        else:
+            response.raise_for_status()
+
+            # Server may ignore the range and send the full file
+            mode = "ab" if response.status_code == 206 else "wb"
+            with open(part_path, mode) as file:
+                async for chunk in response.aiter_bytes():
+                    file.write(chunk)
+            return
+
+    # Partial file does not match the file on the server, restart without range
+    logger.warning(f"Restarting download of {url}: {offset} bytes of {size or '?'}")
+    os.remove(part_path)
+    await _stream_audio(client, url, part_path)
+
+
+async def _get_audio(client: httpx.AsyncClient, url: str, path: str, retries: int = 3):
     """Download audio file from url to path
 
+    The file is streamed to path + ".part" and renamed once complete. A partial
+    file left by an earlier attempt is resumed via an HTTP Range request.
+
+    :param client: shared HTTP client
     :param url: URL of audio file
     :param path: path to save audio file
+    :param retries: number of retries with exponential backoff of transient
+        errors (see _is_transient), defaults to 3
     """
 
-    async with httpx.AsyncClient() as client:
-        response = None
+    part_path = path + ".part"
+
+    for attempt in range(retries + 1):
         try:
-            response = await client.get(url)
-            response.raise_for_status()
+            await _stream_audio(client, url, part_path)
+            break
 
-            with open(path, "wb") as file:
-                for chunk in response.iter_bytes():
-                    file.write(chunk)
+        except httpx.HTTPError as error:
+            if attempt == retries or not _is_transient(error):
+                raise
+            await asyncio.sleep(2**attempt)
 
-        finally:
-            if response is not None:
-                await response.aclose()
+    os.replace(part_path, path)
+
+
+class Recording(NamedTuple):
+
+    """Metadata of a recording needed for its download and annotation."""
+
+    id_: str
+    cls_str: str
+    cls_id: int
+    file_name: str
+    url: str
+    quality: str
+    length: str
+    sampling_rate: str
+
+
+class AnnotationWriter:
+    """Buffers annotation rows and appends them to the annotation file in batches.
+
+    Each file is documented once: rows of files already in the annotation file,
+    e.g. downloaded by an earlier run that stopped before its last flush, are
+    skipped. All methods are synchronous, so tasks of one event loop can share a
+    writer without a lock.
+    """
+
+    def __init__(
+        self, annotation_path: pathlib.Path, columns: List[str], batch_size: int = 100
+    ):
+        self._annotation_path = annotation_path
+        self._columns = columns
+        self._batch_size = batch_size
+        self._rows = []
+
+        self._file_names = set()
+        if os.path.isfile(annotation_path):
+            annotations = pd.read_csv(annotation_path, usecols=["file_name"])
+            self._file_names = set(annotations["file_name"])
+
+    def add(self, row: Dict):
+        if row["file_name"] in self._file_names:
+            return
+        self._file_names.add(row["file_name"])
+        self._rows.append(row)
+        if len(self._rows) >= self._batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        with open(self._annotation_path, mode="a", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=self._columns)
+            writer.writerows(self._rows)
+        self._rows = []
+
+
+def _get_recordings(
+    page: Page, species_map: Dict[str, int], ids: List[str]
+) -> List[Recording]:
+    """Extract the metadata of recordings from a page
+
+    :param page: page of recordings
+    :param species_map: map of species names to numeric values
+    :param ids: xeno-canto recording ids
+    :return: list of recordings
+    """
+
+    df = page.recordings.loc[ids, ["en", "file-name", "file", "q", "length", "smp"]]
+
+    return [
+        Recording(id_, en, species_map[en], file_name, url, q, length, smp)
+        for id_, en, file_name, url, q, length, smp in df.itertuples(name=None)
+    ]
 
 
 async def _download_audio(
-    id_: str,
-    page: Page,
-    species_map: Dict[str, int],
+    recording: Recording,
     audio_dir: pathlib.Path,
-    annotation_path: pathlib.Path,
-    columns: List[str],
+    annotation_writer: AnnotationWriter,
+    client: httpx.AsyncClient,
     semaphore,
     progress_bar,
     num_errors,
-    lock,
 ):
     """Download audio file from xeno-canto and document in annotation file.
 
-    :param id_: xeno-canto recording id
-    :param page: page of recordings
-    :param species_map: map of species names to numeric values
+    :param recording: recording metadata
     :param audio_dir: audio directory
-    :param annotation_path: annotation file path
-    :param columns: csv columns
+    :param annotation_writer: shared annotation writer
+    :param client: shared HTTP client
     :param semaphore: shared semaphore
     :param progress_bar: progress bar
     :param num_errors: shared counter
-    :param lock: shared lock
     :raises ValueError: if file is not .mp3 or .wav
     """
 
+    id_, cls_id = recording.id_, recording.cls_id
+
     async with semaphore:
         try:
-            # Extract species name from 'en' field and map to numeric value
-            cls_str = page.recordings.loc[id_].en
-            cls_id = species_map[cls_str]
-
             # Get file names
-            file_name = page.recordings.loc[id_]["file-name"]
-
-            if ".mp3" in file_name:
+            if ".mp3" in recording.file_name:
                 file_name = f"x-{id_}-{cls_id}-0.mp3"
-            elif ".wav" in file_name:
+            elif ".wav" in recording.file_name:
                 file_name = f"x-{id_}-{cls_id}-0.wav"
             else:
-                raise ValueError(f"{file_name} not .mp3 or .wav")
+                raise ValueError(f"{recording.file_name} not .mp3 or .wav")
 
             audio_path = os.path.join(audio_dir, file_name)
             if not os.path.isfile(audio_path):
-                await asyncio.create_task(
-                    _get_audio(
-                        page.recordings.loc[id_]["file"],
-                        audio_path,
-                    )
-                )
-
-                async with lock:
-                    # Document audio file in annotation file
-                    with open(annotation_path, mode="a", newline="") as file:
-                        writer = csv.DictWriter(file, fieldnames=columns)
-                        writer.writerow(
-                            {
-                                "idx": "",
-                                "file_name": file_name,
-                                "class_id": cls_id,
-                                "class": cls_str,
-                                "xeno_id": id_,
-                                "slice": 0,
-                                "quality": page.recordings.loc[id_]["q"],
-                                "length": page.recordings.loc[id_]["length"],
-                                "sampling_rate": page.recordings.loc[id_]["smp"],
-                            }
-                        )
+                await _get_audio(client, recording.url, audio_path)
+
+            # Document audio file in annotation file, also if it was downloaded
+            # by an earlier run whose rows were not flushed
+            annotation_writer.add(
+                {
+                    "idx": "",
+                    "file_name": file_name,
+                    "class_id": cls_id,
+                    "class": recording.cls_str,
+                    "xeno_id": id_,
+                    "slice": 0,
+                    "quality": recording.quality,
+                    "length": recording.length,
+                    "sampling_rate": recording.sampling_rate,
+                }
+            )
 
         except (httpx.HTTPError, ValueError) as e:
             logger.debug(f"Error downloading {id_}: {str(e)}")
@@ -291,6 +569,7 @@ async def get_page_audio(
     audio_dir: str,
     annotation_path: str,
     ids: List[str] = None,
+    max_connections: int = 5,
 ) -> Dict[str, int]:
     """Download audio files from page and document in annotation file
 
@@ -298,6 +577,7 @@ async def get_page_audio(
     :param audio_dir: audio directory
     :param annotation_path: annotation file path
     :param ids: xeno-canto recording ids, defaults to None
+    :param max_connections: max. concurrent downloads, defaults to 5
     :return: map of species names to numeric values
     """
     os.makedirs(audio_dir, exist_ok=True)
@@ -325,33 +605,47 @@ async def get_page_audio(
         pd.DataFrame(columns=columns).to_csv(annotation_path, index=False)
 
     tasks = []
-    lock = asyncio.Lock()
     num_errors = Counter()
-    semaphore = asyncio.Semaphore(5)
+    annotation_writer = AnnotationWriter(annotation_path, columns)
+    semaphore = asyncio.Semaphore(max_connections)
+
+    # Shared client, connections are kept alive and reused across downloads
+    client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        ),
+        timeout=60,
+        follow_redirects=True,
+    )
 
     total_downloads = len(ids)
 
     progress_bar = None
     # progress_bar = tqdm(total=total_downloads, unit="download", dynamic_ncols=True)
 
-    for id_ in ids:
+    # Extract metadata up front, so tasks do not index the DataFrame
+    recordings = _get_recordings(page, species_map, ids)
+
+    for recording in recordings:
         task = asyncio.create_task(
             _download_audio(
-                id_,
-                page,
-                species_map,
+                recording,
                 audio_dir,
-                annotation_path,
-                columns,
+                annotation_writer,
+                client,
                 semaphore,
                 None,  # progress_bar,
                 num_errors,
-                lock,
             )
         )
         tasks.append(task)
 
-    await asyncio.gather(*tasks)
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        await client.aclose()
+        annotation_writer.flush()
 
     if progress_bar is not None:
         progress_bar.close()
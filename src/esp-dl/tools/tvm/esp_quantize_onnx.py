@@ -6,31 +6,41 @@ from onnxruntime.quantization import CalibrationDataReader, CalibrationMethod, Q
 from esp_quantizer import esp_quantize_static
 
 class DataReader(CalibrationDataReader):
-    def __init__(self, calibration_image_npy: str, model_path: str):
-        self.enum_data = None
+    def __init__(self, calibration_image_npy: str, model_path: str, batch_size: int = 1, indices: np.ndarray = None):
+        self.batch = 0
+        self.batch_size = batch_size
 
         # Use inference session to get input shape.
         session = onnxruntime.InferenceSession(model_path, None)
 
-        self.calib_data_list = np.load(calibration_image_npy)
+        # Memory-mapped, so only the current batch is read into memory.
+        self.calib_data_list = np.load(calibration_image_npy, mmap_mode="r")
         self.input_name = session.get_inputs()[0].name
 
+        # Optional sub-sample of the calibration data, e.g. the positions drawn by
+        # stratified_sample in src/quantization/quantization.py. The calibration
+        # data cached by load_calibration_data is already such a sub-sample.
+        self.indices = np.arange(len(self.calib_data_list))
+        if indices is not None:
+            self.indices = np.sort(np.asarray(indices, dtype=np.int64))
+
     def get_next(self):
-        if self.enum_data is None:
-            self.enum_data = iter(
-                [{self.input_name: calib_data[np.newaxis, ...]} for calib_data in self.calib_data_list]
-            )
-        return next(self.enum_data, None)
+        indices = self.indices[self.batch * self.batch_size:(self.batch + 1) * self.batch_size]
+        if len(indices) == 0:
+            return None
+        self.batch += 1
+        return {self.input_name: np.asarray(self.calib_data_list[indices])}
 
     def rewind(self):
-        self.enum_data = None
+        self.batch = 0
 
 
-def main(input_model_path, output_model_path, calibration_dataset_path, per_channel_):
+def main(input_model_path, output_model_path, calibration_dataset_path, per_channel_, batch_size=1, indices_path=None):
     model_proto = onnx.load(input_model_path)
     
     dr = DataReader(
-        calibration_dataset_path, input_model_path
+        calibration_dataset_path, input_model_path, batch_size,
+        np.load(indices_path) if indices_path is not None else None
     )
 
     extra_options_ = {
@@ -66,6 +76,9 @@ if __name__ == "__main__":
         "--calibrate_dataset", required=True, help="calibration data set")
 
     parser.add_argument("--per_channel", default=False, type=bool)
+    parser.add_argument("--batch_size", default=1, type=int, help="calibration batch size")
+    parser.add_argument(
+        "--indices", default=None, help="npy file of the calibration sample positions, e.g. of a stratified sub-sample")
     args = parser.parse_args()
     
-    main(args.input_model, args.output_model, args.calibrate_dataset, args.per_channel)
\ No newline at end of file
+    main(args.input_model, args.output_model, args.calibrate_dataset, args.per_channel, args.batch_size, args.indices)
\ No newline at end of file
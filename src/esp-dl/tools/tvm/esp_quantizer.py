@@ -66,19 +66,50 @@ class ESPQuantizer(ONNXQuantizer):
 		- *z*: zero point
 		"""
 
-		rmin = 0
-		rmax = 0
-		zero_point = 0
-		scale = 1.0
-		if len(data):
-			rmin = min(data)
-			rmax = max(data)
-			qmin, qmax = get_qmin_qmax_for_qType(qType, reduce_range, symmetric=symmetric)
+		rmin, rmax, zero_point, scale, quantized_data = self.quantize_data_per_channel(
+			np.asarray(data).reshape(1, -1), qType, symmetric, reduce_range
+		)
 
-			zero_point, scale = compute_scale_zp(rmin, rmax, qmin, qmax, symmetric)
-			scale = conver_scale_to_2_exponent(scale)
+		return rmin[0], rmax[0], zero_point[0], scale[0], quantized_data[0]
 
-		quantized_data = quantize_nparray(qType, np.asarray(data), scale, zero_point)
+	def quantize_data_per_channel(self, data, qType, symmetric, reduce_range=False):
+		"""
+		Vectorized quantize_data, quantizing every row of data as one channel with its own scale and zero point.
+
+		:param data: array of shape (channels, values)
+		:param qType: data type to quantize to. Supported types UINT8 and INT8
+		:param symmetric: whether symmetric quantization is used or not. This is applied to INT8.
+		:return: per-channel minimum, maximum, zero point and scale arrays, and quantized data of the same shape as data
+		"""
+		data = np.asarray(data, dtype=np.float32)
+		channel_count = data.shape[0]
+
+		rmin = np.zeros(channel_count)
+		rmax = np.zeros(channel_count)
+		if data.size:
+			rmin = data.min(axis=1).astype(np.float64)
+			rmax = data.max(axis=1).astype(np.float64)
+		qmin, qmax = get_qmin_qmax_for_qType(qType, reduce_range, symmetric=symmetric)
+
+		# same as compute_scale_zp, for all channels at once: 0 must be representable
+		range_min = np.minimum(rmin, 0)
+		range_max = np.maximum(rmax, 0)
+		if symmetric:
+			absmax = np.maximum(np.abs(range_min), np.abs(range_max))
+			range_min, range_max = -absmax, absmax
+
+		scale = (range_max - range_min) / (float(qmax) - float(qmin))
+		constant = scale == 0
+		scale[constant] = 1.0
+		zero_point = np.round(qmin - range_min / scale).astype(np.int64)
+		if data.size and constant.any():
+			# all-zero channels: their zero point differs between onnxruntime versions, so compute_scale_zp decides
+			zero_point[constant], scale[constant] = compute_scale_zp(
+				rmin[constant][0], rmax[constant][0], qmin, qmax, symmetric
+			)
+		scale = conver_scale_to_2_exponent(scale)
+
+		quantized_data = quantize_nparray(qType, data, scale[:, np.newaxis], zero_point[:, np.newaxis])
 
 		return rmin, rmax, zero_point, scale, quantized_data
 	
@@ -133,7 +164,7 @@ class ESPQuantizer(ONNXQuantizer):
 		# Update packed weight, zero point, and scale initializers
 		weight_data = tensor_proto_to_array(weight)
 		_, _, zero_point, scale, q_weight_data = self.quantize_data(
-			weight_data.flatten().tolist(),
+			weight_data.reshape(-1),
 			qType,
 			self.is_weight_symmetric,
 			self.reduce_range and reduce_range,
@@ -184,33 +215,15 @@ class ESPQuantizer(ONNXQuantizer):
 			raise ValueError("{} is not an initializer", weight_name)
 
 		weights = tensor_proto_to_array(initializer)
-		channel_count = weights.shape[channel_axis]
-		rmin_list = []
-		rmax_list = []
-		zero_point_list = []
-		scale_list = []
-		quantized_per_channel_data_list = []
-		for i in range(channel_count):
-			per_channel_data = weights.take(i, channel_axis)
-			rmin, rmax, zero_point, scale, quantized_per_channel_data = self.quantize_data(
-				per_channel_data.flatten().tolist(),
-				weight_qType,
-				self.is_weight_symmetric or weight_qType == onnx_proto.TensorProto.INT8,
-				self.reduce_range and reduce_range,
-			)
-			rmin_list.append(rmin)
-			rmax_list.append(rmax)
-			zero_point_list.append(zero_point)
-			scale_list.append(scale)
-			quantized_per_channel_data_list.append(quantized_per_channel_data)
-
-		# combine per_channel_data into one
-		reshape_dims = list(weights.shape)  # deep copy
-		reshape_dims[channel_axis] = 1  # only one per channel for reshape
-		quantized_weights = np.asarray(quantized_per_channel_data_list[0]).reshape(reshape_dims)
-		for i in range(1, len(quantized_per_channel_data_list)):
-			channel_weights = np.asarray(quantized_per_channel_data_list[i]).reshape(reshape_dims)
-			quantized_weights = np.concatenate((quantized_weights, channel_weights), channel_axis)
+		# one row per channel, quantized in a single pass
+		channel_first = np.moveaxis(weights, channel_axis, 0)
+		_, _, zero_point, scale, quantized_weights = self.quantize_data_per_channel(
+			channel_first.reshape(channel_first.shape[0], -1),
+			weight_qType,
+			self.is_weight_symmetric or weight_qType == onnx_proto.TensorProto.INT8,
+			self.reduce_range and reduce_range,
+		)
+		quantized_weights = np.moveaxis(quantized_weights.reshape(channel_first.shape), 0, channel_axis)
 
 		q_weight_name = weight_name + TENSOR_NAME_QUANT_SUFFIX
 		zp_name = weight_name + "_zero_point"
@@ -229,9 +242,9 @@ class ESPQuantizer(ONNXQuantizer):
 		# Update packed weight, zero point, and scale initializers
 		zero_scale_shape = [initializer.dims[channel_axis]]
 		scale_initializer = onnx.helper.make_tensor(
-			scale_name, onnx_proto.TensorProto.FLOAT, zero_scale_shape, scale_list
+			scale_name, onnx_proto.TensorProto.FLOAT, zero_scale_shape, scale.tolist()
 		)
-		zero_initializer = onnx.helper.make_tensor(zp_name, weight_qType, zero_scale_shape, zero_point_list)
+		zero_initializer = onnx.helper.make_tensor(zp_name, weight_qType, zero_scale_shape, zero_point.tolist())
 
 		self.model.initializer().extend([scale_initializer, zero_initializer])
 
@@ -11,6 +11,8 @@
 
 #include <time.h>
 #include <sys/time.h>
+#include <limits>
+#include <algorithm>
 #include "esp_sleep.h"
 #include "driver/rtc_io.h"
 
@@ -45,6 +47,29 @@ static int input_exponent = -7;
 
 #define SAMPLE_RATE 16000
 #define AUDIO_BUFFER_SIZE SAMPLE_RATE * 5
+#define AUDIO_CHUNK_SIZE 1024
+
+#ifdef CONFIG_MFCC_FIXED_POINT
+typedef int16_t mfcc_t;
+typedef int32_t mel_t;
+#else
+typedef float mfcc_t;
+typedef float mel_t;
+#endif
+
+// The model is trained on features quantized to 8 bits (INPUT_BITS in 
+// pipeline.py). The int16 model input holds the same values, so the quantized
+// models of both bit widths see the input range of the training data.
+
+#define INPUT_BITS 8
+
+#ifdef CONFIG_QUANTIZATION_BITS_16
+#define OUTPUT_BITS 16
+typedef int16_t input_t;
+#else
+#define OUTPUT_BITS 8
+typedef int8_t input_t;
+#endif
 
 static gpio_num_t wakeup_pin = GPIO_NUM_4;
 
@@ -68,9 +93,17 @@ extern "C" void record_and_infer_sound()
     log_heap();
     #endif
 
-    int16_t *audio_buffer = (int16_t *)malloc(AUDIO_BUFFER_SIZE * sizeof(int16_t));
+    size_t num_frames = get_num_frames(AUDIO_BUFFER_SIZE);
+    int num_mfcc = get_num_mfcc();
+    int num_mels = get_num_mels();
+
+    int16_t *audio_buffer = (int16_t *)malloc(AUDIO_CHUNK_SIZE * sizeof(int16_t));
+    mel_t *mel_output = (mel_t *)malloc(num_frames * num_mels * sizeof(mel_t));
+
+    malloc_mfcc_module();
+    mfcc_stream_reset();
 
-    ESP_LOGI(TAG, "Allocated audio buffer...");
+    ESP_LOGI(TAG, "Allocated audio buffer and MFCC module...");
     #ifdef CONFIG_HEAP_LOG
     log_heap();
     #endif
@@ -78,52 +111,55 @@ extern "C" void record_and_infer_sound()
     // Set led to red
     set_esp_led_rgb(255, 0, 0);
 
-    ESP_ERROR_CHECK(read_i2s_mic(audio_buffer, AUDIO_BUFFER_SIZE));
-
-    // Set led to green
-    set_esp_led_rgb(0, 255, 0);
-
     #ifdef CONFIG_TIME_LOG
     dl::tool::Latency latency;
     latency.start();
     #endif
 
-    // Rescale to int16_t range
-    int16_t max_sample = 0;
-    for (size_t i = 0; i < AUDIO_BUFFER_SIZE; ++i)
-    {
-        max_sample = std::max(max_sample, static_cast<int16_t>(std::abs(audio_buffer[i])));
-    }
-
-    if (max_sample > 0)
+    // Compute the log mel energies chunk by chunk while recording. The training
+    // clips are peak normalized to the int16_t range, which only shifts the mel
+    // energies in dB (ending up in the discarded 0th cepstral coefficient), 
+    // except where they are clamped to the floor. Thus the energies are kept
+    // unclamped until the peak of the recording is known.
+    size_t computed_frames = 0;
+    for (size_t recorded = 0; recorded < AUDIO_BUFFER_SIZE; recorded += AUDIO_CHUNK_SIZE)
     {
-        const double scale = 32767.0 / max_sample;
-        for (size_t i = 0; i < AUDIO_BUFFER_SIZE; ++i)
-        {
-            audio_buffer[i] = static_cast<int16_t>(audio_buffer[i] * scale);
-        }
+        size_t chunk_size = std::min((size_t)AUDIO_CHUNK_SIZE, (size_t)AUDIO_BUFFER_SIZE - recorded);
+        size_t chunk_frames = 0;
+
+        ESP_ERROR_CHECK(read_i2s_mic(audio_buffer, chunk_size));
+        mel_t *chunk_output = mel_output + computed_frames * num_mels;
+
+        #ifdef CONFIG_MFCC_FIXED_POINT
+        ESP_ERROR_CHECK(mel_fixed_stream_push(audio_buffer, chunk_size, chunk_output,
+                                              num_frames - computed_frames, &chunk_frames));
+        #else
+        ESP_ERROR_CHECK(mel_stream_push(audio_buffer, chunk_size, chunk_output,
+                                        num_frames - computed_frames, &chunk_frames));
+        #endif
+        computed_frames += chunk_frames;
     }
 
-    float **mfcc_output;
-    size_t num_frames = 0;
-    int num_mfcc = get_num_mfcc();
+    // Set led to green
+    set_esp_led_rgb(0, 255, 0);
 
-    malloc_mfcc_module();
+    free(audio_buffer);
 
-    ESP_LOGI(TAG, "Allocated MFCC module...");
-    #ifdef CONFIG_HEAP_LOG
-    log_heap();
-    #endif
-    
-    mfcc(audio_buffer, AUDIO_BUFFER_SIZE, &mfcc_output, &num_frames);
+    // Apply the gain of the peak normalization, the floor and the DCT
+    mfcc_t *mfcc_output = (mfcc_t *)malloc(num_frames * num_mfcc * sizeof(mfcc_t));
+    mfcc_t min_value = std::numeric_limits<mfcc_t>::max();
+    mfcc_t max_value = std::numeric_limits<mfcc_t>::lowest();
 
-    ESP_LOGI(TAG, "MFCC module...");
-    #ifdef CONFIG_HEAP_LOG
-    log_heap();
+    #ifdef CONFIG_MFCC_FIXED_POINT
+    ESP_ERROR_CHECK(mfcc_fixed_stream_normalize(mel_output, computed_frames, mfcc_output));
+    mfcc_fixed_range_update(mfcc_output, computed_frames * num_mfcc, &min_value, &max_value);
+    #else
+    ESP_ERROR_CHECK(mfcc_stream_normalize(mel_output, computed_frames, mfcc_output));
+    mfcc_range_update(mfcc_output, computed_frames * num_mfcc, &min_value, &max_value);
     #endif
 
+    free(mel_output);
     free_mfcc_module();
-    free(audio_buffer);
 
     ESP_LOGI(TAG, "Computed MFCCs...");
     #ifdef CONFIG_HEAP_LOG
@@ -135,52 +171,17 @@ extern "C" void record_and_infer_sound()
 
     int num_frames_int = static_cast<int>(num_frames);
 
-    #ifdef CONFIG_QUANTIZATION_BITS_16
-    int16_t *model_input = (int16_t *)malloc(num_frames_int * num_mfcc * sizeof(int16_t));
+    input_t *model_input = (input_t *)malloc(num_frames_int * num_mfcc * sizeof(input_t));
+
+    // Normalize and quantize in a single pass, as done for the training data
+    #ifdef CONFIG_MFCC_FIXED_POINT
+    ESP_ERROR_CHECK(mfcc_fixed_quantize(mfcc_output, num_frames * num_mfcc, min_value, max_value,
+                                        input_exponent, INPUT_BITS, OUTPUT_BITS, model_input));
     #else
-    int8_t *model_input = (int8_t *)malloc(num_frames_int * num_mfcc * sizeof(int8_t));
+    ESP_ERROR_CHECK(mfcc_quantize(mfcc_output, num_frames * num_mfcc, min_value, max_value,
+                                  input_exponent, INPUT_BITS, OUTPUT_BITS, model_input));
     #endif
-    
-    float min_value = std::numeric_limits<float>::max();
-    float max_value = std::numeric_limits<float>::lowest();
 
-    // Find minimum and maximum values
-    for (size_t i = 0; i < num_frames; ++i)
-    {
-        for (size_t j = 0; j < num_mfcc; ++j)
-        {
-            float value = mfcc_output[i][j];
-            min_value = std::min(min_value, value);
-            max_value = std::max(max_value, value);
-        }
-    }
-
-    // Normalize and clip values
-    if (max_value != min_value)
-    {
-        int pos = 0;
-
-        for (size_t i = 0; i < num_frames && pos < num_frames * num_mfcc; ++i)
-        {
-            for (size_t j = 0; j < num_mfcc && pos < num_frames * num_mfcc; ++j)
-            {
-                float normalized_input = (mfcc_output[i][j] - min_value) / (max_value - min_value);
-
-                #ifdef CONFIG_QUANTIZATION_BITS_16
-                model_input[pos] = (int16_t)DL_CLIP(normalized_input * (1 << -input_exponent), -32768, 32767);
-                #else
-                model_input[pos] = (int8_t)DL_CLIP(normalized_input * (1 << -input_exponent), -128, 127);
-                #endif
-                
-                ++pos;
-            }
-        }
-    }
-
-    for (size_t i = 0; i < num_frames; ++i)
-    {
-        free(mfcc_output[i]);
-    }
     free(mfcc_output);
 
     #ifdef CONFIG_TIME_LOG
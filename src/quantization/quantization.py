@@ -1,32 +1,175 @@
 import io
 import os
+import copy
 import onnx
+import shutil
+import hashlib
+import logging
+import functools
 import pathlib
+import collections
 import numpy as np
 import onnxoptimizer
 import onnxruntime
 import tensorflow as tf
+import tf2onnx
 from tensorflow.keras import models
 from contextlib import redirect_stdout
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from src.audio import audio_processing
+
+logger = logging.getLogger(__name__)
+
+PROVIDER = "CPUExecutionProvider"
+
+# ESP-DL evaluator holding the quantized model of each model, quantization
+# parameters, bit width and granularity (see _prepare_evaluator). Bounded, since
+# every entry keeps an evaluator alive.
+_quantized_models = collections.OrderedDict()
+_MAX_QUANTIZED_MODELS = 4
+
+
+def materialize_dataset(dataset: tf.data.Dataset) -> Tuple[np.array, np.array]:
+    """Read a batched dataset into NumPy arrays, so it can be evaluated
+    repeatedly without running the input pipeline again.
+
+    :param dataset: batched dataset of data and labels
+    :return: data and flattened labels
+    """
+    data, labels = [], []
+    for batch_data, batch_labels in dataset.as_numpy_iterator():
+        data.append(batch_data)
+        labels.append(batch_labels.reshape(-1))
+
+    return np.concatenate(data), np.concatenate(labels).astype(np.int64)
+
+
+@functools.lru_cache(maxsize=_MAX_QUANTIZED_MODELS)
+def _get_session(model_path: str, mtime: int) -> onnxruntime.InferenceSession:
+    """Create an inference session once per model file. The modification
+    time is part of the cache key, so rewritten models get a new session. The
+    cache is bounded, since convert_model rewrites the models on every run.
+
+    :param model_path: onnx model path
+    :param mtime: modification time of the model in ns
+    :return: inference session
+    """
+    return onnxruntime.InferenceSession(model_path, providers=[PROVIDER])
+
+
+def _prepare_evaluator(
+    evaluator,
+    model_path: str,
+    quantization_params_path: pathlib.Path,
+    quantization_bit: str,
+    granularity: str,
+) -> None:
+    """Generate the quantized model of an evaluator, unless it already holds the
+    model for the same (unchanged) model and quantization parameters.
+
+    :param evaluator: ESP-DL evaluator initialized with quantization_bit and
+        granularity
+    :param model_path: optimized onnx model path
+    :param quantization_params_path: quantization parameters of the calibrator
+    :param quantization_bit: quantization_bit of the evaluator
+    :param granularity: granularity of the evaluator
+    """
+    key = (
+        model_path,
+        os.stat(model_path).st_mtime_ns,
+        str(quantization_params_path),
+        os.stat(quantization_params_path).st_mtime_ns,
+        quantization_bit,
+        granularity,
+    )
+
+    if _quantized_models.get(key) is not evaluator:
+        evaluator.set_providers([PROVIDER])
+        evaluator.generate_quantized_model(
+            onnx.load(model_path), quantization_params_path
+        )
+        _quantized_models[key] = evaluator
+
+    _quantized_models.move_to_end(key)
+    while len(_quantized_models) > _MAX_QUANTIZED_MODELS:
+        _quantized_models.popitem(last=False)
+
+
+def _predict(predict_fn, data: np.array, batch_size: int) -> np.array:
+    """Predict the classes of data in batches.
+
+    :param predict_fn: function returning the model output of a batch
+    :param data: model input
+    :param batch_size: number of samples per inference call
+    :return: predicted classes
+    """
+    return np.concatenate(
+        [
+            np.argmax(predict_fn(data[i : i + batch_size]), axis=1)
+            for i in range(0, len(data), batch_size)
+        ]
+    )
+
+
+def classification_metrics(
+    labels: np.array, predictions: np.array, num_classes: int
+) -> Dict:
+    """Compute accuracy, confusion matrix and per-class metrics.
+
+    :param labels: true classes
+    :param predictions: predicted classes
+    :param num_classes: number of classes
+    :return: accuracy in percent, confusion matrix (rows are true classes) and
+        per-class precision, recall, f1 and support
+    """
+    confusion = np.bincount(
+        labels * num_classes + predictions, minlength=num_classes**2
+    ).reshape(num_classes, num_classes)
+    true_positives = np.diag(confusion)
+    support = confusion.sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.nan_to_num(true_positives / confusion.sum(axis=0))
+        recall = np.nan_to_num(true_positives / support)
+        f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+
+    return {
+        "accuracy": (true_positives.sum() / max(len(labels), 1)) * 100,
+        "confusion_matrix": confusion,
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "support": support,
+    }
 
 
 def evaluate_model(
     model_dir: pathlib.Path,
     model_name: str,
     quantization_bit: str,
-    dataset: tf.data.Dataset,
-    dataset_size: int,
+    datasets: Dict[str, Tuple[np.array, np.array]],
     evaluator,
-):
-    """Evaluats a onnx model and its quantized version.
+    num_classes: Optional[int] = None,
+    batch_size: int = 256,
+    granularity: str = "per-tensor",
+) -> Dict[str, Dict[str, Dict]]:
+    """Evaluates a onnx model and its quantized version.
+
+    The inference session is created once per model and the quantized model
+    once per evaluator (see _prepare_evaluator). Both models run over the
+    materialized datasets (see materialize_dataset) in a single pass each.
 
     :param model_dir: the directory containing the onnx model
     :param model_name: the name of the optimized onnx model
     :param quantization_bit: quantization_bit
-    :param dataset: the dataset to evaluate the model on
-    :param dataset_size: size of the dataset
+    :param datasets: data and labels by dataset name, e.g. "train" and "test"
     :param evaluator: initialized ESP-DL evaluator
-    :return: accuracy of the floating-point model and the quantized model
+    :param num_classes: number of classes, defaults to None (model output size)
+    :param batch_size: number of samples per inference call, defaults to 256
+    :param granularity: granularity of the evaluator, defaults to "per-tensor"
+    :return: metrics (see classification_metrics) of the floating-point
+        ("float") and the quantized model ("quantized") by dataset name
     """
 
     optimized_model_path = str(
@@ -38,33 +181,42 @@ def evaluate_model(
         / f"{model_name}_{quantization_bit}_params.pickle"
     )
 
-    provider = "CPUExecutionProvider"
-    model_proto = onnx.load(optimized_model_path)
-    session = onnxruntime.InferenceSession(optimized_model_path, providers=[provider])
-
-    evaluator.set_providers([provider])
-    evaluator.generate_quantized_model(model_proto, quantization_params_path)
+    session = _get_session(
+        optimized_model_path, os.stat(optimized_model_path).st_mtime_ns
+    )
+    _prepare_evaluator(
+        evaluator,
+        optimized_model_path,
+        quantization_params_path,
+        quantization_bit,
+        granularity,
+    )
 
     input_name = session.get_inputs()[0].name
-    output_names = [n.name for n in model_proto.graph.output]
-
-    num_correct = 0
-    num_correct_quant = 0
+    output_name = session.get_outputs()[0].name
 
-    for (data, labels) in dataset.as_numpy_iterator():
+    if num_classes is None:
+        num_classes = session.get_outputs()[0].shape[-1]
 
-        # Floating-point model
-        prediction = session.run(output_names, {input_name: data})
-        num_correct += sum(np.argmax(prediction[0], axis=1) == labels.flatten())
+    def predict_float(data):
+        return session.run([output_name], {input_name: data.astype(np.float32)})[0]
 
-        # Quantized model
+    def predict_quantized(data):
         [prediction, _] = evaluator.evalute_quantized_model(data, False)
-        num_correct_quant += sum(np.argmax(prediction[0], axis=1) == labels.flatten())
+        return prediction[0]
 
-    return (
-        (num_correct / dataset_size) * 100,
-        (num_correct_quant / dataset_size) * 100,
-    )
+    results = {}
+    for name, (data, labels) in datasets.items():
+        results[name] = {
+            "float": classification_metrics(
+                labels, _predict(predict_float, data, batch_size), num_classes
+            ),
+            "quantized": classification_metrics(
+                labels, _predict(predict_quantized, data, batch_size), num_classes
+            ),
+        }
+
+    return results
 
 
 def _convert_model_batch_to_dynamic(model_proto):
@@ -111,13 +263,13 @@ def _add_fused_gemm_name(model_proto):
             node_name_counter += 1
 
 
-def optimize_model(onnx_model_path: pathlib.Path):
-    """Optimizes the onnx model.
+def optimize_model_proto(model_proto: onnx.ModelProto) -> onnx.ModelProto:
+    """Optimizes an onnx model in memory.
 
-    :param onnx_model_path: onnx model path
+    :param model_proto: model proto
+    :return: optimized model proto
     """
 
-    model_proto = onnx.load(onnx_model_path)
     model_proto = _convert_model_batch_to_dynamic(model_proto)
     model_proto = onnxoptimizer.optimize(
         model_proto,
@@ -135,18 +287,382 @@ def optimize_model(onnx_model_path: pathlib.Path):
     )
 
     _add_fused_gemm_name(model_proto)
-    model_name = onnx_model_path.split(".onnx")
+    return model_proto
+
+
+def optimize_model(onnx_model_path: pathlib.Path):
+    """Optimizes the onnx model.
+
+    :param onnx_model_path: onnx model path
+    """
+
+    model_proto = optimize_model_proto(onnx.load(onnx_model_path))
+    model_name = str(onnx_model_path).split(".onnx")
     onnx_model_path = model_name[0] + "_optimized.onnx"
     onnx.save(model_proto, onnx_model_path)
 
 
+def _get_latest_checkpoint(model_dir: pathlib.Path, model_name: str) -> pathlib.Path:
+    """Get the latest checkpoint of a model.
+
+    :param model_dir: model directory
+    :param model_name: model name
+    :return: checkpoint path (without the .index and .data suffixes)
+    """
+    checkpoint_dir = model_dir / "checkpoints" / model_name
+    checkpoints = [f for f in os.listdir(checkpoint_dir) if f != "checkpoint"]
+    num_checkpoint = max([int(f.split(".")[0]) for f in checkpoints])
+
+    return checkpoint_dir / f"{num_checkpoint}.ckpt"
+
+
+def _get_artifact_dir(
+    model_dir: pathlib.Path, model_name: str, checkpoint_path: pathlib.Path, opset: int
+) -> pathlib.Path:
+    """Get the artifact directory of a checkpoint, which is addressed by the
+    hash of the checkpoint files and the conversion parameters. Conversion
+    (see convert_model) and calibration data (see load_calibration_data) are
+    cached in separate subdirectories, so neither overwrites the other.
+
+    :param model_dir: model directory
+    :param model_name: model name
+    :param checkpoint_path: checkpoint path (see _get_latest_checkpoint)
+    :param opset: onnx opset
+    :return: artifact directory
+    """
+    h = hashlib.sha1(f"opset={opset}".encode())
+    prefix = checkpoint_path.name
+    for file in sorted(checkpoint_path.parent.glob(f"{prefix}.*")):
+        h.update(file.name[len(prefix) :].encode())
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+
+    return model_dir / "artifacts" / model_name / h.hexdigest()
+
+
+def convert_model(
+    model: models.Sequential,
+    model_dir: pathlib.Path,
+    model_name: str,
+    opset: int = 13,
+) -> onnx.ModelProto:
+    """Converts the latest checkpoint of a trained model to an optimized onnx
+    model. The conversion runs in-process with tf2onnx, without a new
+    interpreter, so it is done once and shared by all bit widths.
+
+    The SavedModel, the onnx model and the optimized onnx model are cached in
+    the conversion subdirectory of the artifact directory of the checkpoint
+    (see _get_artifact_dir), so they are reused as long as the checkpoint does
+    not change. The onnx
+    models are also copied to onnx_birdnet (read by evaluate_model).
+
+    :param model: trained model, the checkpoint weights are loaded into it
+    :param model_dir: model directory
+    :param model_name: model name
+    :param opset: onnx opset, defaults to 13
+    :return: optimized model proto
+    """
+
+    checkpoint_path = _get_latest_checkpoint(model_dir, model_name)
+    artifact_dir = _get_artifact_dir(model_dir, model_name, checkpoint_path, opset)
+    conversion_dir = artifact_dir / "conversion"
+
+    model.load_weights(checkpoint_path)
+
+    if not (conversion_dir / "model_optimized.onnx").exists():
+        tmp_dir = conversion_dir.with_suffix(".tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+
+        tf.saved_model.save(model, str(tmp_dir / "saved_model"))
+
+        # Convert the model to onnx
+        input_signature = [
+            tf.TensorSpec((None, *model.input_shape[1:]), tf.float32, name="input")
+        ]
+        model_proto, _ = tf2onnx.convert.from_keras(
+            model, input_signature=input_signature, opset=opset
+        )
+        onnx.save(model_proto, str(tmp_dir / "model.onnx"))
+
+        # Optimize onnx model
+        model_proto = optimize_model_proto(model_proto)
+        onnx.save(model_proto, str(tmp_dir / "model_optimized.onnx"))
+
+        shutil.rmtree(conversion_dir, ignore_errors=True)
+        os.replace(tmp_dir, conversion_dir)
+        logger.info(f"Converted {checkpoint_path} to {conversion_dir}")
+    else:
+        logger.info(f"Reusing the conversion of {checkpoint_path} in {conversion_dir}")
+
+    onnx_dir = model_dir / "onnx_birdnet"
+    onnx_dir.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(conversion_dir / "model.onnx", onnx_dir / f"{model_name}.onnx")
+    shutil.copyfile(
+        conversion_dir / "model_optimized.onnx",
+        onnx_dir / f"{model_name}_optimized.onnx",
+    )
+
+    return onnx.load(str(conversion_dir / "model_optimized.onnx"))
+
+
+def stratified_sample(labels: np.array, num_samples: int, seed: int = 0) -> np.array:
+    """Draw a sub-sample with the class proportions of labels. Every class
+    keeps at least one sample (so very small targets can be exceeded by up to
+    one sample per class), the remaining quota goes to the classes with the
+    largest fractional shares.
+
+    :param labels: class ids
+    :param num_samples: target number of samples
+    :param seed: random seed, defaults to 0
+    :return: sorted positions of the drawn samples in labels
+    """
+    labels = np.asarray(labels)
+    if num_samples >= len(labels):
+        return np.arange(len(labels))
+
+    rng = np.random.default_rng(seed)
+    classes, counts = np.unique(labels, return_counts=True)
+
+    shares = counts * num_samples / len(labels)
+    quota = np.minimum(np.maximum(np.floor(shares).astype(np.int64), 1), counts)
+    for i in np.argsort(np.floor(shares) - shares):
+        if quota.sum() >= num_samples:
+            break
+        quota[i] += quota[i] < counts[i]
+
+    positions = [
+        rng.choice(np.flatnonzero(labels == c), n, replace=False)
+        for c, n in zip(classes, quota)
+    ]
+    return np.sort(np.concatenate(positions))
+
+
+class CalibrationReader:
+    """Streams calibration data from the feature store with bounded memory.
+
+    The samples are a stratified sub-sample (see stratified_sample) of the
+    given rows, visited in a random order, so every prefix of the stream is
+    representative. Only one batch is resident while iterating.
+    """
+
+    def __init__(
+        self,
+        h5_path: pathlib.Path,
+        labels: np.array,
+        idxs: Iterable[int],
+        num_samples: Optional[int] = None,
+        batch_size: int = 256,
+        seed: int = 0,
+        group: Optional[str] = None,
+    ):
+        """
+        :param h5_path: HDF5 file path of the features
+        :param labels: class ids of all samples
+        :param idxs: rows to calibrate on, e.g. the test rows
+        :param num_samples: target number of samples, defaults to None (all)
+        :param batch_size: number of samples per read, defaults to 256
+        :param seed: sampling seed, defaults to 0
+        :param group: feature configuration (see preprocess_sweep), defaults to None
+        """
+        self.h5_path = h5_path
+        self.group = group
+        self.batch_size = batch_size
+
+        idxs = np.asarray(list(idxs), dtype=np.int64)
+        if num_samples is not None:
+            idxs = idxs[stratified_sample(np.asarray(labels)[idxs], num_samples, seed)]
+        self.idxs = np.random.default_rng(seed).permutation(idxs)
+
+    def __len__(self) -> int:
+        return len(self.idxs)
+
+    def __iter__(self) -> Iterator[np.array]:
+        with audio_processing.FeatureReader(self.h5_path, self.group) as reader:
+            for i in range(0, len(self.idxs), self.batch_size):
+                data = reader[self.idxs[i : i + self.batch_size]]
+                yield np.transpose(data, (0, 2, 3, 1))
+
+    def get_key(self) -> str:
+        """Get a key of the content of the stream (see load_calibration_data).
+
+        :return: hex digest of the features and their order
+        """
+        return audio_processing.get_feature_digest(self.h5_path, self.idxs, self.group)
+
+    def write(self, path: pathlib.Path) -> None:
+        """Write the stream into a .npy file batch by batch, so only one batch
+        is resident.
+
+        :param path: output file path
+        """
+        data = None
+        for i, batch in enumerate(self):
+            if data is None:
+                data = np.lib.format.open_memmap(
+                    path, "w+", np.float32, (len(self), *batch.shape[1:])
+                )
+            data[i * self.batch_size : i * self.batch_size + len(batch)] = batch
+
+        if data is not None:
+            data.flush()
+
+
+def iterate_batches(data: np.array, batch_size: int = 256) -> Iterator[np.array]:
+    """Iterate over an array in batches, e.g. over the memory-mapped
+    calibration data of load_calibration_data, in the order of the
+    CalibrationReader.
+
+    :param data: samples along the first axis
+    :param batch_size: number of samples per batch, defaults to 256
+    :return: iterator of batches (views of data)
+    """
+    return (data[i : i + batch_size] for i in range(0, len(data), batch_size))
+
+
+def calibration_convergence(
+    model_proto: onnx.ModelProto, batches: Iterable[np.array]
+) -> List[Dict]:
+    """Report how the calibration ranges converge as samples are added.
+
+    Every batch is run through the floating-point model with all intermediate
+    tensors as outputs, and the running max. absolute value of each tensor is
+    updated. After each batch, the report holds the largest relative change
+    of these ranges and the number of tensors whose power-of-two exponent
+    (as used by ESP-DL) changed. Both should reach zero well before the end
+    of the calibration data.
+
+    This is a diagnostic with an extra inference pass over the calibration
+    data (see CALIBRATION_CONVERGENCE in pipeline.py). To avoid reading the
+    features again, pass the data of load_calibration_data (see
+    iterate_batches).
+
+    :param model_proto: optimized model proto
+    :param batches: calibration batches, e.g. iterate_batches(calibration_data)
+    :return: one dictionary with num_samples, max_relative_change and
+        exponent_changes per batch
+    """
+
+    model_proto = copy.deepcopy(model_proto)
+    output_names = [o.name for o in model_proto.graph.output]
+    for node in model_proto.graph.node:
+        for name in node.output:
+            if name not in output_names:
+                model_proto.graph.output.append(
+                    onnx.helper.make_tensor_value_info(
+                        name, onnx.TensorProto.FLOAT, None
+                    )
+                )
+                output_names.append(name)
+
+    session = onnxruntime.InferenceSession(
+        model_proto.SerializeToString(), providers=[PROVIDER]
+    )
+    input_name = session.get_inputs()[0].name
+
+    ranges = None
+    num_samples = 0
+    report = []
+
+    for batch in batches:
+        outputs = session.run(output_names, {input_name: batch.astype(np.float32)})
+        batch_ranges = np.array(
+            [np.max(np.abs(o)) if o.size else 0.0 for o in [batch, *outputs]]
+        )
+        num_samples += len(batch)
+
+        if ranges is None:
+            ranges = batch_ranges
+            continue
+
+        new_ranges = np.maximum(ranges, batch_ranges)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            change = np.nan_to_num((new_ranges - ranges) / ranges, posinf=1.0)
+            exponents = np.ceil(np.log2(ranges))
+            new_exponents = np.ceil(np.log2(new_ranges))
+
+        report.append(
+            {
+                "num_samples": num_samples,
+                "max_relative_change": float(change.max()),
+                "exponent_changes": int(np.sum(exponents != new_exponents)),
+            }
+        )
+        ranges = new_ranges
+
+    for entry in report:
+        logger.info(
+            f"Calibration ranges after {entry['num_samples']} samples: max. relative change {entry['max_relative_change']:.4f}, {entry['exponent_changes']} exponent changes"
+        )
+
+    return report
+
+
+def load_calibration_data(
+    model_dir: pathlib.Path,
+    model_name: str,
+    calibration_dataset: Union[tf.data.Dataset, CalibrationReader],
+    calibration_key: Optional[str] = None,
+    opset: int = 13,
+) -> np.array:
+    """Get the calibration data of the latest checkpoint as one array.
+
+    If calibration_key identifies the content of calibration_dataset (e.g.
+    the digest of its features), the array is cached in the calibration
+    subdirectory of the artifact directory of the checkpoint (see
+    _get_artifact_dir) and reused, e.g. by later bit widths and
+    granularities. The cached array is memory-mapped, so samples are only
+    read when they are used, e.g. batch by batch with iterate_batches. A
+    CalibrationReader provides its own key and writes its batches directly
+    into the cache file, so the data is never fully resident.
+
+    :param model_dir: model directory
+    :param model_name: model name
+    :param calibration_dataset: batched dataset of data and labels, or a
+        CalibrationReader
+    :param calibration_key: content key of the dataset, defaults to None (no
+        caching, unless calibration_dataset is a CalibrationReader)
+    :param opset: onnx opset of convert_model, defaults to 13
+    :return: calibration data, memory-mapped if cached
+    """
+
+    is_reader = isinstance(calibration_dataset, CalibrationReader)
+    if calibration_key is None and is_reader:
+        calibration_key = calibration_dataset.get_key()
+
+    if calibration_key is None:
+        return materialize_dataset(calibration_dataset)[0]
+
+    checkpoint_path = _get_latest_checkpoint(model_dir, model_name)
+    artifact_dir = _get_artifact_dir(model_dir, model_name, checkpoint_path, opset)
+    calibration_dir = artifact_dir / "calibration"
+    calibration_path = calibration_dir / f"calibration_{calibration_key}.npy"
+
+    if calibration_path.exists():
+        logger.info(f"Reusing calibration data {calibration_path}")
+        return np.load(calibration_path, mmap_mode="r")
+
+    calibration_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = calibration_path.with_suffix(".tmp")
+    if is_reader:
+        calibration_dataset.write(tmp_path)
+    else:
+        with open(tmp_path, "wb") as f:
+            np.save(f, materialize_dataset(calibration_dataset)[0])
+    os.replace(tmp_path, calibration_path)
+
+    return np.load(calibration_path, mmap_mode="r")
+
+
 def quantize_model(
     model: models.Sequential,
     model_dir: pathlib.Path,
     model_name: str,
     quantization_bit: str,
     calibrator,
-    calibration_dataset: tf.data.Dataset,
+    calibration_dataset: Union[tf.data.Dataset, np.array],
+    model_proto: Optional[onnx.ModelProto] = None,
 ):
     """Quantizes a trained model.
 
@@ -155,41 +671,24 @@ def quantize_model(
     :param model_name: model name
     :param quantization_bit: int8 or int16
     :param calibrator: initialized ESP-DL calibrator
-    :param calibration_dataset: calibration dataset
+    :param calibration_dataset: calibration dataset, or calibration data (see
+        load_calibration_data)
+    :param model_proto: optimized model proto of convert_model, defaults to
+        None (convert the model)
     :return: ESP-DL quantization log
     """
 
-    tf_model_path = str(model_dir / "tf_birdnet" / f"{model_name}")
-    onnx_model_path = str(model_dir / "onnx_birdnet" / f"{model_name}.onnx")
-
-    # Load the latest checkpoint
-    checkpoint_dir = model_dir / "checkpoints" / model_name
-    checkpoints = [f for f in os.listdir(checkpoint_dir) if f != "checkpoint"]
-    num_checkpoint = max([int(f.split(".")[0]) for f in checkpoints])
-
-    model.load_weights(checkpoint_dir / f"{num_checkpoint}.ckpt")
-    tf.saved_model.save(model, tf_model_path)
-
     target_chip = "esp32s3"
     provider = "CPUExecutionProvider"
 
-    # Convert the model to onnx
-    os.system(
-        f"python -m tf2onnx.convert --saved-model {tf_model_path} --output {onnx_model_path} --opset 13"
-    )
-
-    # Optimize onnx model
-    optimize_model(onnx_model_path)
-
-    c_data = []
-    for (data, _) in calibration_dataset.as_numpy_iterator():
-        c_data.append(data)
+    if model_proto is None:
+        model_proto = convert_model(model, model_dir, model_name)
 
-    calibration_dataset = np.concatenate(c_data, axis=0)
+    # The calibrator gets its own copy, so model_proto can be shared
+    model_proto = copy.deepcopy(model_proto)
 
-    optimized_model_path = model_dir / "onnx_birdnet" / f"{model_name}_optimized.onnx"
-    model_proto = onnx.load_model(optimized_model_path)
-    # checker.check_graph(model_proto.graph)
+    if isinstance(calibration_dataset, tf.data.Dataset):
+        calibration_dataset = materialize_dataset(calibration_dataset)[0]
 
     # Quantize the model
     calibrator.set_providers([provider])
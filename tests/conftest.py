@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# conftest.py
+#
+# Description: Shared fixtures of the test suite
+# The C library is built from src/audio/preprocess.cpp with gcc, as described
+# in its header, so the tests do not depend on a previous build.
+
+import shutil
+import functools
+import pathlib
+import subprocess
+import numpy as np
+import pytest
+
+from src.audio import audio_processing
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+
+def _build_library(directory: pathlib.Path, **defines) -> pathlib.Path:
+    """Build the PC version of the C library.
+
+    :param directory: output directory
+    :param defines: additional preprocessor definitions, e.g. REAL_FFT=0
+    :return: path of the shared library
+    """
+    if shutil.which("gcc") is None:
+        pytest.skip("gcc is required to build the C library")
+
+    name = "_".join(["preprocess"] + [f"{k}{v}" for k, v in defines.items()])
+    path = directory / f"{name}.so"
+    flags = [f"-D{k}={v}" for k, v in defines.items()]
+
+    subprocess.run(
+        ["gcc", "-x", "c", "-o", str(path), "-D", "RUN_PC", *flags, "-shared"]
+        + ["-fPIC", "-I", str(ROOT / "include"), str(ROOT / "src/audio/preprocess.cpp")]
+        + ["-lm"],
+        check=True,
+        capture_output=True,
+    )
+    return path
+
+
+@pytest.fixture(scope="session")
+def build_library(tmp_path_factory):
+    """Build the C library with the given preprocessor definitions (once per
+    set of definitions)."""
+    directory = tmp_path_factory.mktemp("lib")
+    return functools.lru_cache(maxsize=None)(
+        lambda **defines: _build_library(directory, **defines)
+    )
+
+
+@pytest.fixture(scope="session")
+def library_path(build_library) -> pathlib.Path:
+    return build_library()
+
+
+@pytest.fixture
+def use_library(monkeypatch):
+    """Make audio_processing use the given build of the C library."""
+
+    def _use(path: pathlib.Path):
+        monkeypatch.setattr(audio_processing, "CDLL", str(path))
+        audio_processing._load_library.cache_clear()
+        return audio_processing._load_library()
+
+    yield _use
+    audio_processing._load_library.cache_clear()
+
+
+@pytest.fixture
+def lib(use_library, library_path):
+    return use_library(library_path)
+
+
+def make_clips() -> np.array:
+    """Three-second test clips: white noise, a tone with 1% noise and silence."""
+    rng = np.random.default_rng(0)
+    t = np.arange(3 * audio_processing.SAMPLE_RATE) / audio_processing.SAMPLE_RATE
+    noise = rng.standard_normal(t.size)
+
+    clips = np.stack(
+        [
+            3000 * noise,
+            3000 * np.sin(2 * np.pi * 440 * t) + 30 * noise,
+            np.zeros_like(t),
+        ]
+    )
+    return np.round(clips).astype(np.int16)
+
+
+@pytest.fixture(scope="session")
+def clips() -> np.array:
+    return make_clips()
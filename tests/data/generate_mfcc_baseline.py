@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+# generate_mfcc_baseline.py
+#
+# Description: Generate mfcc_baseline.npz, the MFCC features of the test clips
+# (see conftest.make_clips) computed by the original implementation: mfcc() of
+# preprocess.cpp returning a float** array, copied into NumPy element by
+# element through ctypes.
+#
+# The baseline library is built from the first revision of the repository:
+#
+#   git worktree add /tmp/baseline <baseline commit>
+#   cd /tmp/baseline
+#   gcc -x c -o /tmp/baseline.so -D RUN_PC -shared -fPIC -I include/ src/audio/preprocess.cpp -lm
+#
+# Usage (from the root directory): python -m tests.data.generate_mfcc_baseline /tmp/baseline.so
+
+import sys
+import ctypes
+import pathlib
+import numpy as np
+
+from tests.conftest import make_clips
+
+OUTPUT_PATH = pathlib.Path(__file__).parent / "mfcc_baseline.npz"
+
+
+def _mfcc_baseline(lib: ctypes.CDLL, audio_data: np.array) -> np.array:
+    """mfcc() of the original Python wrapper.
+
+    :param lib: baseline C library
+    :param audio_data: raw audio data
+    :return: MFCC features
+    """
+    lib.mfcc.argtypes = [
+        ctypes.POINTER(ctypes.c_int16),
+        ctypes.c_size_t,
+        ctypes.POINTER(ctypes.POINTER(ctypes.POINTER(ctypes.c_float))),
+        ctypes.POINTER(ctypes.c_size_t),
+    ]
+    lib.mfcc.restype = ctypes.c_int
+
+    audio_data = np.array(audio_data, dtype=np.int16)
+    audio_values_ptr = ctypes.cast(
+        audio_data.ctypes.data, ctypes.POINTER(ctypes.c_int16)
+    )
+
+    output_frames = ctypes.c_size_t()
+    output = ctypes.POINTER(ctypes.POINTER(ctypes.c_float))()
+
+    lib.malloc_mfcc_module()
+    lib.mfcc(
+        audio_values_ptr,
+        len(audio_data),
+        ctypes.byref(output),
+        ctypes.byref(output_frames),
+    )
+    lib.free_mfcc_module()
+
+    num_mfcc = int(lib.get_num_mfcc())
+
+    mfcc = np.zeros((output_frames.value, num_mfcc))
+
+    for i in range(output_frames.value):
+        for j in range(num_mfcc):
+            mfcc[i][j] = output[i][j]
+
+    return mfcc
+
+
+def main(library_path: str) -> None:
+    lib = ctypes.CDLL(library_path)
+    mfcc = np.stack([_mfcc_baseline(lib, clip) for clip in make_clips()])
+    np.savez_compressed(OUTPUT_PATH, mfcc=mfcc.astype(np.float32))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
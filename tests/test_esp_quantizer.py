@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# test_esp_quantizer.py
+#
+# Description: Vectorized per-channel weight quantization of the ESP-DL TVM
+# quantizer (esp_quantizer.py) against the original loop over the channels,
+# with the compute_scale_zp of onnxruntime 1.7 (see requirements.txt).
+
+import pathlib
+import sys
+
+import numpy as np
+import pytest
+from onnx import onnx_pb as onnx_proto
+
+TVM_TOOLS_DIR = pathlib.Path(__file__).parents[1] / "src" / "esp-dl" / "tools" / "tvm"
+
+sys.path.insert(0, str(TVM_TOOLS_DIR))
+try:
+    import esp_quantizer
+except ImportError as error:
+    pytest.skip(
+        f"esp_quantizer needs the onnxruntime of the TVM tools: {error}",
+        allow_module_level=True,
+    )
+finally:
+    sys.path.remove(str(TVM_TOOLS_DIR))
+
+
+def _compute_scale_zp(rmin, rmax, qmin, qmax, symmetric=False):
+    """compute_scale_zp of onnxruntime 1.7."""
+    rmin = min(rmin, 0)
+    rmax = max(rmax, 0)
+
+    if symmetric:
+        absmax = max(abs(rmin), abs(rmax))
+        rmin = -absmax
+        rmax = +absmax
+
+    scale = (rmax - rmin) / float(qmax - qmin) if rmax != rmin else 1.0
+    zero_point = round(qmin - rmin / scale)
+
+    return [zero_point, scale]
+
+
+def _quantize_data_loop(data, qType, symmetric, reduce_range):
+    """Original per-channel loop of ESPQuantizer.quantize_weight_per_channel,
+    with the original ESPQuantizer.quantize_data for each channel."""
+    results = []
+    for channel in data:
+        channel = channel.flatten().tolist()
+        rmin, rmax, zero_point, scale = 0, 0, 0, 1.0
+        if len(channel):
+            rmin = min(channel)
+            rmax = max(channel)
+            qmin, qmax = esp_quantizer.get_qmin_qmax_for_qType(
+                qType, reduce_range, symmetric=symmetric
+            )
+            zero_point, scale = _compute_scale_zp(rmin, rmax, qmin, qmax, symmetric)
+            scale = esp_quantizer.conver_scale_to_2_exponent(scale)
+
+        quantized = esp_quantizer.quantize_nparray(
+            qType, np.asarray(channel), scale, zero_point
+        )
+        results.append((rmin, rmax, zero_point, scale, quantized))
+
+    return [np.asarray(values) for values in zip(*results)]
+
+
+def _weights() -> np.array:
+    """Channels with mixed signs, only positive and only negative values,
+    different magnitudes and only zeros."""
+    rng = np.random.default_rng(0)
+    weights = rng.standard_normal((6, 48)).astype(np.float32)
+    weights[1] = np.abs(weights[1])
+    weights[2] = -np.abs(weights[2]) * 100
+    weights[3] = 0
+    weights[4] *= 1e-3
+    weights[5] = weights[5] * 0.1 + 0.5
+    return weights
+
+
+@pytest.mark.parametrize(
+    "qType, symmetric",
+    [
+        (onnx_proto.TensorProto.INT8, True),
+        (onnx_proto.TensorProto.INT8, False),
+        (onnx_proto.TensorProto.UINT8, False),
+    ],
+)
+@pytest.mark.parametrize("reduce_range", [False, True])
+def test_quantize_data_per_channel(monkeypatch, qType, symmetric, reduce_range):
+    monkeypatch.setattr(esp_quantizer, "compute_scale_zp", _compute_scale_zp)
+    quantizer = esp_quantizer.ESPQuantizer.__new__(esp_quantizer.ESPQuantizer)
+    weights = _weights()
+
+    expected = _quantize_data_loop(weights, qType, symmetric, reduce_range)
+    result = quantizer.quantize_data_per_channel(
+        weights, qType, symmetric, reduce_range
+    )
+
+    for name, value, expected_value in zip(
+        ["rmin", "rmax", "zero_point", "scale", "quantized_data"], result, expected
+    ):
+        np.testing.assert_array_equal(value, expected_value, err_msg=name)
+    assert result[4].dtype == expected[4].dtype
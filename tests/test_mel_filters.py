@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+# test_mel_filters.py
+#
+# Description: The sparse mel filter bank of preprocess.cpp (start, length and
+# packed weights per band) against the dense filter bank matrix.
+
+import ctypes
+import librosa
+import numpy as np
+
+from src.audio import audio_processing
+
+
+def _sparse_mel_filters(lib: ctypes.CDLL):
+    """Read the sparse mel filter bank of the C library.
+
+    :param lib: loaded C library
+    :return: start and length of each band, packed weights
+    """
+    num_mels = lib.get_num_mels()
+    start = (ctypes.c_size_t * num_mels)()
+    length = (ctypes.c_size_t * num_mels)()
+
+    lib.mel_filters.restype = ctypes.c_size_t
+    num_weights = lib.mel_filters(start, length, None)
+
+    weights = np.zeros(num_weights, dtype=np.float32)
+    assert (
+        lib.mel_filters(start, length, weights.ctypes.data_as(ctypes.c_void_p))
+        == num_weights
+    )
+
+    return np.array(start, dtype=np.int64), np.array(length, dtype=np.int64), weights
+
+
+def _to_dense(
+    start: np.array, length: np.array, weights: np.array, num_bins: int
+) -> np.array:
+    dense = np.zeros((len(start), num_bins), dtype=np.float32)
+    offsets = np.concatenate([[0], np.cumsum(length)])
+    for i in range(len(start)):
+        dense[i, start[i] : start[i] + length[i]] = weights[offsets[i] : offsets[i + 1]]
+    return dense
+
+
+def test_sparse_equals_dense(lib):
+    num_bins = audio_processing.WIN_LENGTH_SAMPLES // 2 + 1
+    start, length, weights = _sparse_mel_filters(lib)
+    sparse = _to_dense(start, length, weights, num_bins)
+
+    # Dense matrix of the former mel_filters, as mirrored by the NumPy backend
+    dense = audio_processing._mel_filters(
+        audio_processing.SAMPLE_RATE,
+        audio_processing.WIN_LENGTH_SAMPLES,
+        audio_processing.N_MELS,
+    ).T
+    np.testing.assert_array_equal(sparse, dense)
+
+    # and Librosa's filter bank with the same conventions
+    librosa_dense = librosa.filters.mel(
+        sr=audio_processing.SAMPLE_RATE,
+        n_fft=audio_processing.WIN_LENGTH_SAMPLES,
+        n_mels=audio_processing.N_MELS,
+        fmin=0,
+        fmax=audio_processing.SAMPLE_RATE // 2,
+        htk=True,
+        norm="slaney",
+    )
+    np.testing.assert_allclose(sparse, librosa_dense, rtol=1e-6, atol=0)
+
+
+def test_sparse_covers_all_nonzero_weights(lib):
+    num_bins = audio_processing.WIN_LENGTH_SAMPLES // 2 + 1
+    start, length, weights = _sparse_mel_filters(lib)
+
+    assert np.all(length > 0)
+    assert np.all(start + length <= num_bins)
+    # Only the edges of a triangle may be zero, anything else is wasted storage
+    assert np.count_nonzero(weights) >= len(weights) - 2 * len(start)
+    assert len(weights) * 10 < len(start) * num_bins
+
+
+def test_sparse_mel_stage_matches_dense_product(lib):
+    num_bins = audio_processing.WIN_LENGTH_SAMPLES // 2 + 1
+    start, length, weights = _sparse_mel_filters(lib)
+    dense = _to_dense(start, length, weights, num_bins)
+    power = np.random.default_rng(0).exponential(size=(16, num_bins)).astype(np.float32)
+
+    # Accumulation over each band's bins only, as in mfcc_frame
+    offsets = np.concatenate([[0], np.cumsum(length)])
+    sparse_product = np.stack(
+        [
+            power[:, start[i] : start[i] + length[i]].astype(np.float64)
+            @ weights[offsets[i] : offsets[i + 1]]
+            for i in range(len(start))
+        ],
+        axis=-1,
+    )
+    np.testing.assert_allclose(
+        sparse_product, power @ dense.T.astype(np.float64), rtol=1e-12
+    )
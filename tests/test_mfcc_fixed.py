@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+# test_mfcc_fixed.py
+#
+# Description: Difference of the fixed-point MFCC pipeline of preprocess.cpp
+# against the float pipeline on tonal, noisy and silent frames.
+
+import numpy as np
+import pytest
+
+from src.audio import audio_processing
+
+SAMPLE_RATE = audio_processing.SAMPLE_RATE
+
+# Max. absolute MFCC difference on frames of a tone with 1% noise, for full-scale
+# (block scaled down) and 40 dB quieter (block scaled up) frames. Measured: 1.4 to 2.3
+# full-scale and 3.1 quiet at 250 Hz to 6 kHz, with means of 0.09 to 0.48. White
+# noise: 0.076.
+ATOL_TONAL = 3.5
+ATOL_NOISE = 0.1
+
+# Max. difference in int8 steps (exponent -7) after per-clip normalization.
+# Measured: 4 to 8 on the tonal clips, 1 on white noise.
+STEPS_TONAL = 8
+STEPS_NOISE = 1
+
+
+def _tone(frequency: float, amplitude: float, seconds: float = 3) -> np.array:
+    rng = np.random.default_rng(1)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    noise = rng.standard_normal(t.size)
+    return amplitude * 32000 * (np.sin(2 * np.pi * frequency * t) + 0.01 * noise)
+
+
+def _features(clips: np.array):
+    """Float and fixed-point MFCC features of the given clips."""
+    clips = np.round(clips).astype(np.int16)
+    return (
+        audio_processing.mfcc_batch(clips),
+        audio_processing.mfcc_fixed_batch(clips),
+    )
+
+
+def _steps(features: np.array) -> np.array:
+    return audio_processing.quantize_features(features, -7).astype(np.int32)
+
+
+@pytest.mark.parametrize("frequency", [250, 1000, 6000])
+@pytest.mark.parametrize("amplitude", [1.0, 0.01])
+def test_tonal_frames(lib, frequency, amplitude):
+    float_mfcc, fixed_mfcc = _features(_tone(frequency, amplitude)[None])
+
+    np.testing.assert_allclose(fixed_mfcc, float_mfcc, rtol=0, atol=ATOL_TONAL)
+    steps = np.abs(_steps(fixed_mfcc) - _steps(float_mfcc))
+    assert steps.max() <= STEPS_TONAL
+
+
+def test_noise_frames(lib, clips):
+    float_mfcc, fixed_mfcc = _features(clips[:1])
+
+    np.testing.assert_allclose(fixed_mfcc, float_mfcc, rtol=0, atol=ATOL_NOISE)
+    steps = np.abs(_steps(fixed_mfcc) - _steps(float_mfcc))
+    assert steps.max() <= STEPS_NOISE
+
+
+def test_silent_frames(lib):
+    # One second of silence between two tones: frames entirely inside the
+    # silence clamp all mel bands to the same floor in both pipelines.
+    clip = _tone(1000, 1.0)
+    clip[SAMPLE_RATE : 2 * SAMPLE_RATE] = 0
+    float_mfcc, fixed_mfcc = _features(clip[None])
+
+    starts = audio_processing._get_frame_starts(
+        clip.size,
+        audio_processing.HOP_LENGTH_SAMPLES,
+        audio_processing.WIN_LENGTH_SAMPLES,
+    )
+    silent = (starts >= SAMPLE_RATE) & (
+        starts + audio_processing.WIN_LENGTH_SAMPLES <= 2 * SAMPLE_RATE
+    )
+    assert silent.any()
+
+    # The float DCT leaves rounding residue of up to 1.8e-4 on constant input
+    np.testing.assert_array_equal(fixed_mfcc[0, silent], 0)
+    np.testing.assert_allclose(float_mfcc[0, silent], 0, rtol=0, atol=5e-4)
+
+
+def test_silent_clip(lib, clips):
+    _, fixed_mfcc = _features(clips[2:])
+
+    np.testing.assert_array_equal(fixed_mfcc, 0)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+# test_mfcc_parity.py
+#
+# Description: Parity of the NumPy bridge of the C library (audio_processing.mfcc
+# and mfcc_batch) with the features of the original implementation.
+
+import pathlib
+import numpy as np
+import pytest
+
+from src.audio import audio_processing
+
+# MFCC features of the test clips computed by the original implementation (float**
+# output of mfcc(), copied element by element), see data/generate_mfcc_baseline.py
+BASELINE_PATH = pathlib.Path(__file__).parent / "data" / "mfcc_baseline.npz"
+
+# Later changes of the float pipeline (real FFT, precomputed DCT basis) change the
+# rounding. Measured: max. 1.2e-4 on the tonal clip, 6e-6 on noise, 0 on silence.
+ATOL_BASELINE = 2.5e-4
+
+
+@pytest.fixture(scope="module")
+def baseline() -> np.array:
+    return np.load(BASELINE_PATH)["mfcc"]
+
+
+def test_mfcc_matches_baseline(lib, clips, baseline):
+    for clip, expected in zip(clips, baseline):
+        actual = audio_processing.mfcc(clip)
+
+        assert actual.dtype == np.float32
+        assert actual.flags["C_CONTIGUOUS"]
+        assert actual.shape == expected.shape
+        np.testing.assert_allclose(actual, expected, rtol=0, atol=ATOL_BASELINE)
+
+
+def test_mfcc_writes_into_out(lib, clips):
+    out = np.full(
+        (lib.get_num_frames(clips.shape[1]), lib.get_num_mfcc()), np.nan, np.float32
+    )
+
+    assert audio_processing.mfcc(clips[0], out=out) is out
+    np.testing.assert_array_equal(out, audio_processing.mfcc(clips[0]))
+
+
+def test_mfcc_batch_matches_baseline(lib, clips, baseline):
+    np.testing.assert_allclose(
+        audio_processing.mfcc_batch(clips), baseline, rtol=0, atol=ATOL_BASELINE
+    )
+
+
+def test_mfcc_batch_matches_mfcc(lib, clips):
+    batch = audio_processing.mfcc_batch(clips)
+
+    assert batch.shape == (
+        len(clips),
+        lib.get_num_frames(clips.shape[1]),
+        lib.get_num_mfcc(),
+    )
+    for clip, features in zip(clips, batch):
+        np.testing.assert_array_equal(features, audio_processing.mfcc(clip))
+
+
+def test_mfcc_batch_matches_numpy_reference(lib, clips):
+    # Same float pipeline, so they only differ by float32 rounding (max. 1.1e-4
+    # on the tonal clip, where the weakest mel bands are about 90 dB down)
+    np.testing.assert_allclose(
+        audio_processing.mfcc_batch(clips),
+        audio_processing.mfcc_numpy_batch(clips),
+        rtol=0,
+        atol=2e-4,
+    )
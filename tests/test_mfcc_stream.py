@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# test_mfcc_stream.py
+#
+# Description: Peak normalization of the streaming MFCC interface of
+# preprocess.cpp (as used on the ESP32) against clips normalized before the
+# MFCC computation, as the training clips are.
+
+import numpy as np
+import pytest
+
+from src.audio import audio_processing
+
+SAMPLE_RATE = audio_processing.SAMPLE_RATE
+
+# Max. absolute MFCC difference and max. difference in int8 steps (exponent -7)
+# to the normalized clip. The streamed signal is not rounded to int16 after the
+# gain, which is the only difference. Measured: float 0.011 and 1 step, fixed
+# point 3.2 and 6 steps, i.e. within the fixed-point tolerances of
+# test_mfcc_fixed.py.
+ATOL_FLOAT = 0.05
+STEPS_FLOAT = 1
+ATOL_FIXED = 3.5
+STEPS_FIXED = 8
+
+# Without normalization, bands of quiet clips fall below the floor of the log
+# mel energies. Measured: 12 to 26 steps at -50 dBFS.
+STEPS_UNNORMALIZED = 8
+
+
+def _clip(frequency: float, amplitude: float) -> np.array:
+    """Tone with 1% noise and one second of silence, rounded to int16."""
+    rng = np.random.default_rng(1)
+    t = np.arange(3 * SAMPLE_RATE) / SAMPLE_RATE
+    noise = rng.standard_normal(t.size)
+    clip = amplitude * 32000 * (np.sin(2 * np.pi * frequency * t) + 0.01 * noise)
+    clip[SAMPLE_RATE : 2 * SAMPLE_RATE] = 0
+    return np.round(clip).astype(np.int16)
+
+
+def _normalize(clip: np.array) -> np.array:
+    """Peak normalization of _load_audio."""
+    clip = clip / np.max(np.abs(clip))
+    return np.round(clip * 32767).astype(np.int16)
+
+
+def _steps(features: np.array) -> np.array:
+    return audio_processing.quantize_features(features[None], -7).astype(np.int32)
+
+
+def _stream(clip: np.array, num_frames: int, **kwargs) -> np.array:
+    chunks = np.array_split(clip, len(clip) // 1024 + 1)
+    return audio_processing.mfcc_stream(chunks, max_frames=num_frames, **kwargs)
+
+
+@pytest.mark.parametrize("frequency", [250, 1000, 6000])
+@pytest.mark.parametrize("amplitude", [0.01, 0.001])
+def test_stream_normalize(lib, frequency, amplitude):
+    clip = _clip(frequency, amplitude)
+    expected = audio_processing.mfcc_batch(_normalize(clip)[None])[0]
+
+    features = _stream(clip, len(expected), normalize=True)
+
+    np.testing.assert_allclose(features, expected, rtol=0, atol=ATOL_FLOAT)
+    assert np.abs(_steps(features) - _steps(expected)).max() <= STEPS_FLOAT
+
+
+@pytest.mark.parametrize("frequency", [250, 1000, 6000])
+@pytest.mark.parametrize("amplitude", [0.01, 0.001])
+def test_fixed_stream_normalize(lib, frequency, amplitude):
+    clip = _clip(frequency, amplitude)
+    expected = audio_processing.mfcc_fixed_batch(_normalize(clip)[None])[0]
+
+    features = _stream(clip, len(expected), normalize=True, fixed=True)
+
+    np.testing.assert_allclose(features, expected, rtol=0, atol=ATOL_FIXED)
+    assert np.abs(_steps(features) - _steps(expected)).max() <= STEPS_FIXED
+
+
+def test_stream_without_normalize(lib):
+    clip = _clip(1000, 0.001)
+    expected = audio_processing.mfcc_batch(_normalize(clip)[None])[0]
+
+    features = _stream(clip, len(expected))
+
+    np.testing.assert_array_equal(features, audio_processing.mfcc_batch(clip[None])[0])
+    assert np.abs(_steps(features) - _steps(expected)).max() > STEPS_UNNORMALIZED
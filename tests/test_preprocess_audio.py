@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+# test_preprocess_audio.py
+#
+# Description: Reuse of the file digests of the incremental feature store
+# (preprocess_audio), keyed on size and modification time of the audio files.
+
+import os
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+import soundfile
+
+from src.audio import audio_processing
+
+SAMPLE_RATE = audio_processing.SAMPLE_RATE
+DURATION = 1
+
+
+def _write_clip(path, seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    soundfile.write(path, rng.uniform(-0.5, 0.5, SAMPLE_RATE * DURATION), SAMPLE_RATE)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """Three audio files, their annotation and a counter of hashed files."""
+    audio_dir = tmp_path / "audio"
+    audio_dir.mkdir()
+    names = [f"{i}.wav" for i in range(3)]
+    for i, name in enumerate(names):
+        _write_clip(audio_dir / name, i)
+
+    annotation_path = tmp_path / "annotation.csv"
+    pd.DataFrame({"idx": range(3), "file_name": names}).to_csv(annotation_path)
+
+    hashed = []
+    get_file_digest = audio_processing._get_file_digest
+
+    def _get_file_digest(path):
+        hashed.append(os.path.basename(path))
+        return get_file_digest(path)
+
+    monkeypatch.setattr(audio_processing, "_get_file_digest", _get_file_digest)
+
+    def _run():
+        hashed.clear()
+        audio_processing.preprocess_audio(
+            tmp_path,
+            audio_dir,
+            annotation_path,
+            SAMPLE_RATE,
+            DURATION,
+            "features.h5",
+            backend="numpy",
+        )
+        with h5py.File(tmp_path / "features.h5", "r") as f:
+            return sorted(hashed), f["data"][:]
+
+    return audio_dir, _run
+
+
+def test_unchanged_files_are_not_hashed(store):
+    _, run = store
+
+    hashed, data = run()
+    assert hashed == ["0.wav", "1.wav", "2.wav"]
+
+    hashed, data_rerun = run()
+    assert hashed == []
+    np.testing.assert_array_equal(data_rerun, data)
+
+
+def test_changed_file_is_hashed_and_recomputed(store):
+    audio_dir, run = store
+    _, data = run()
+
+    _write_clip(audio_dir / "1.wav", 10)
+    hashed, data_changed = run()
+
+    assert hashed == ["1.wav"]
+    np.testing.assert_array_equal(data_changed[[0, 2]], data[[0, 2]])
+    assert not np.array_equal(data_changed[1], data[1])
+
+
+def test_touched_file_is_hashed_once(store):
+    audio_dir, run = store
+    _, data = run()
+
+    stat = os.stat(audio_dir / "2.wav")
+    os.utime(audio_dir / "2.wav", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    # Same content, so the features are up to date, but the new modification
+    # time is stored
+    hashed, data_touched = run()
+    assert hashed == ["2.wav"]
+    np.testing.assert_array_equal(data_touched, data)
+
+    hashed, _ = run()
+    assert hashed == []
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+# test_quantize.py
+#
+# Description: Quantization of the model input on the ESP32 (mfcc_quantize in
+# preprocess.cpp) against quantize_features, for int8 and int16 model inputs.
+
+import ctypes
+import numpy as np
+import pytest
+
+from src.audio import audio_processing
+
+EXPONENT = -7
+
+
+def _mfcc_quantize(lib, features: np.array, bits: int, output_bits: int) -> np.array:
+    """Quantize the features of one clip with mfcc_quantize.
+
+    :param features: MFCC features of shape (frames, N_MFCC)
+    :return: quantized features, int8 or int16 depending on output_bits
+    """
+    mfcc_quantize = ctypes.CDLL(lib._name).mfcc_quantize
+    mfcc_quantize.argtypes = [
+        np.ctypeslib.ndpointer(dtype=np.float32, flags="C_CONTIGUOUS"),
+        ctypes.c_size_t,
+        ctypes.c_float,
+        ctypes.c_float,
+        ctypes.c_int,
+        ctypes.c_int,
+        ctypes.c_int,
+        np.ctypeslib.ndpointer(flags="C_CONTIGUOUS"),
+    ]
+
+    values = np.ascontiguousarray(features, dtype=np.float32)
+    out = np.empty(values.shape, dtype=np.int8 if output_bits == 8 else np.int16)
+    ret = mfcc_quantize(
+        values,
+        values.size,
+        values.min(),
+        values.max(),
+        EXPONENT,
+        bits,
+        output_bits,
+        out,
+    )
+    assert ret == 0
+    return out
+
+
+@pytest.mark.parametrize("output_bits", [8, 16])
+def test_training_range(lib, clips, output_bits):
+    # The pipeline trains on 8-bit features, so the int16 model input of the
+    # device must hold the same values as the int8 one.
+    features = audio_processing.mfcc_batch(clips)
+    expected = audio_processing.quantize_features(features, EXPONENT, bits=8)
+
+    for feature, exp in zip(features, expected):
+        out = _mfcc_quantize(lib, feature, 8, output_bits)
+        np.testing.assert_array_equal(out, exp)
+        assert out.max() <= np.iinfo(np.int8).max
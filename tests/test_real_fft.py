@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+# test_real_fft.py
+#
+# Description: Numerical difference of the MFCC path of preprocess.cpp (real
+# FFT of NUM_FFT/2 points with twiddle step, precomputed DCT basis) against the
+# previous path (complex FFT of NUM_FFT points, DCT computed per frame).
+
+import ctypes
+import numpy as np
+import pytest
+import scipy.fft
+
+from src.audio import audio_processing
+
+# Max. absolute MFCC difference on the test clips (coefficients up to 35). Measured:
+# 1.2e-4 between the builds (tonal clip), and 1.8e-4 against the double-precision
+# reference (silent clip, all mel bands at -100 dB), for either build.
+ATOL_BUILDS = 2.5e-4
+ATOL_REFERENCE = 5e-4
+
+
+@pytest.fixture
+def complex_fft_lib(use_library, build_library):
+    return use_library(build_library(REAL_FFT=0))
+
+
+def _reference_mfcc(clips: np.array) -> np.array:
+    """MFCC features of the previous path in double precision: complex FFT of
+    the full frame and orthonormal DCT-II, dropping the first coefficient.
+
+    :param clips: raw audio data of shape (clips, samples)
+    :return: MFCC features of shape (clips, frames, N_MFCC)
+    """
+    win_length = audio_processing.WIN_LENGTH_SAMPLES
+    starts = audio_processing._get_frame_starts(
+        clips.shape[1], audio_processing.HOP_LENGTH_SAMPLES, win_length
+    )
+    frames = np.lib.stride_tricks.sliding_window_view(
+        clips.astype(np.float64) / np.iinfo(np.int16).max, win_length, axis=1
+    )[:, starts]
+    frames = frames * audio_processing._hann_window(win_length)
+
+    spectra = np.fft.fft(frames, axis=-1)[..., : win_length // 2 + 1]
+    mel_weights = audio_processing._mel_filters(
+        audio_processing.SAMPLE_RATE, win_length, audio_processing.N_MELS
+    )
+    mel_power = np.abs(spectra) ** 2 @ mel_weights.astype(np.float64)
+    mel_db = 10.0 * np.log10(np.maximum(mel_power, 1e-10))
+
+    mfcc = scipy.fft.dct(mel_db, type=2, norm="ortho", axis=-1)
+    return mfcc[..., 1 : audio_processing.N_MFCC + 1]
+
+
+def test_real_fft_matches_complex_fft_build(
+    use_library, library_path, complex_fft_lib, clips
+):
+    complex_fft = audio_processing.mfcc_batch(clips)
+    use_library(library_path)
+    real_fft = audio_processing.mfcc_batch(clips)
+
+    np.testing.assert_allclose(real_fft, complex_fft, rtol=0, atol=ATOL_BUILDS)
+
+    # The real FFT is not less accurate than the complex one
+    reference = _reference_mfcc(clips)
+    for real, complex_, expected in zip(real_fft, complex_fft, reference):
+        real_error = np.abs(real - expected).max()
+        assert real_error <= 1.1 * np.abs(complex_ - expected).max() + 1e-5
+
+
+def test_real_fft_matches_reference(lib, clips):
+    np.testing.assert_allclose(
+        audio_processing.mfcc_batch(clips),
+        _reference_mfcc(clips),
+        rtol=0,
+        atol=ATOL_REFERENCE,
+    )
+
+
+def test_dct_basis_matches_orthonormal_dct(lib):
+    num_mfcc, num_mels = lib.get_num_mfcc(), lib.get_num_mels()
+    basis = np.zeros((num_mfcc, num_mels), dtype=np.float32)
+    lib.dct_basis(basis.ctypes.data_as(ctypes.c_void_p))
+
+    # Rows are premultiplied by 2, the remaining scaling is sqrt(1 / (2 * N_MELS)).
+    # Cosines are computed in single precision (max. difference 1.2e-6).
+    dct = scipy.fft.dct(np.eye(num_mels), type=2, norm="ortho", axis=0)
+    np.testing.assert_allclose(
+        basis * np.sqrt(1.0 / (2 * num_mels)), dct[1 : num_mfcc + 1], rtol=0, atol=2e-6
+    )
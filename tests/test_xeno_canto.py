@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+# test_xeno_canto.py
+#
+# Description: Retries and resumption of audio downloads (xeno_canto._get_audio)
+# and the page cache of get_composite_page against a mocked server.
+
+import asyncio
+import httpx
+import pytest
+
+from src.dataset import xeno_canto
+
+URL = "https://xeno-canto.org/1/download"
+CONTENT = bytes(range(256)) * 4
+
+
+def _download(handler, path, retries: int = 3):
+    async def _run():
+        transport = httpx.MockTransport(handler)
+        async with httpx.AsyncClient(transport=transport) as client:
+            await xeno_canto._get_audio(client, URL, str(path), retries=retries)
+
+    asyncio.run(_run())
+
+
+def _serve(request: httpx.Request) -> httpx.Response:
+    """Serve CONTENT, honoring Range requests like the xeno-canto server."""
+    range_ = request.headers.get("Range")
+    if range_ is None:
+        return httpx.Response(200, content=CONTENT)
+
+    offset = int(range_[len("bytes=") : -1])
+    if offset >= len(CONTENT):
+        return httpx.Response(416, headers={"Content-Range": f"bytes */{len(CONTENT)}"})
+    return httpx.Response(206, content=CONTENT[offset:])
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    async def _sleep(seconds):
+        pass
+
+    monkeypatch.setattr(xeno_canto.asyncio, "sleep", _sleep)
+
+
+@pytest.mark.parametrize("status_code", [403, 404])
+def test_permanent_errors_fail_fast(tmp_path, status_code):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(status_code)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        _download(handler, tmp_path / "a.mp3")
+    assert len(requests) == 1
+
+
+@pytest.mark.parametrize("status_code", [429, 503])
+def test_transient_errors_are_retried(tmp_path, status_code):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if len(requests) < 3:
+            return httpx.Response(status_code)
+        return _serve(request)
+
+    _download(handler, tmp_path / "a.mp3")
+    assert len(requests) == 3
+    assert (tmp_path / "a.mp3").read_bytes() == CONTENT
+
+
+def test_transport_errors_are_retried(tmp_path):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if len(requests) == 1:
+            raise httpx.ConnectError("connection refused", request=request)
+        return _serve(request)
+
+    _download(handler, tmp_path / "a.mp3")
+    assert (tmp_path / "a.mp3").read_bytes() == CONTENT
+
+
+def test_partial_file_is_resumed(tmp_path):
+    (tmp_path / "a.mp3.part").write_bytes(CONTENT[:100])
+
+    _download(_serve, tmp_path / "a.mp3")
+    assert (tmp_path / "a.mp3").read_bytes() == CONTENT
+
+
+def test_complete_partial_file_is_kept(tmp_path):
+    (tmp_path / "a.mp3.part").write_bytes(CONTENT)
+
+    _download(_serve, tmp_path / "a.mp3")
+    assert (tmp_path / "a.mp3").read_bytes() == CONTENT
+    assert not (tmp_path / "a.mp3.part").exists()
+
+
+def test_oversized_partial_file_is_restarted(tmp_path):
+    # 416 for a partial file larger than the file on the server
+    (tmp_path / "a.mp3.part").write_bytes(CONTENT + b"garbage")
+
+    _download(_serve, tmp_path / "a.mp3")
+    assert (tmp_path / "a.mp3").read_bytes() == CONTENT
+
+
+def test_416_without_size_is_restarted(tmp_path):
+    (tmp_path / "a.mp3.part").write_bytes(CONTENT)
+
+    def handler(request):
+        if "Range" in request.headers:
+            return httpx.Response(416)
+        return _serve(request)
+
+    _download(handler, tmp_path / "a.mp3")
+    assert (tmp_path / "a.mp3").read_bytes() == CONTENT
+
+
+class _Api:
+    """Mocked xeno-canto API with a given number of recordings per page."""
+
+    def __init__(self, per_page, num_recordings):
+        self.per_page = per_page
+        self.num_recordings = num_recordings
+        self.requested = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        page = int(request.url.params["page"])
+        self.requested.append(page)
+        num_pages = -(-self.num_recordings // self.per_page)
+        ids = range(
+            (page - 1) * self.per_page, min(page * self.per_page, self.num_recordings)
+        )
+        return httpx.Response(
+            200,
+            json={
+                "numRecordings": str(self.num_recordings),
+                "numSpecies": "1",
+                "page": page,
+                "numPages": num_pages,
+                "recordings": [{"id": str(i), "en": "Common Blackbird"} for i in ids],
+            },
+        )
+
+
+@pytest.fixture
+def api(monkeypatch):
+    api = _Api(per_page=2, num_recordings=5)
+    transport = httpx.MockTransport(api.handler)
+    async_client = httpx.AsyncClient
+
+    def _get(url, params, **kwargs):
+        with httpx.Client(transport=transport) as client:
+            return client.get(url, params=params)
+
+    monkeypatch.setattr(xeno_canto.httpx, "get", _get)
+    monkeypatch.setattr(
+        xeno_canto.httpx,
+        "AsyncClient",
+        lambda **kwargs: async_client(transport=transport, **kwargs),
+    )
+    return api
+
+
+def test_cached_pages_are_reused(api, tmp_path):
+    page = xeno_canto.get_composite_page({"grp": "1"}, cache_dir=tmp_path)
+    assert len(page.recordings) == 5
+    assert sorted(api.requested) == [1, 2, 3]
+
+    api.requested.clear()
+    page = xeno_canto.get_composite_page({"grp": "1"}, cache_dir=tmp_path)
+    assert len(page.recordings) == 5
+    assert api.requested == [1]
+
+
+def test_changed_result_set_invalidates_all_pages(api, tmp_path):
+    xeno_canto.get_composite_page({"grp": "1"}, cache_dir=tmp_path)
+
+    # Page 3 gains a recording: cached pages 2 and 3 must not be mixed in
+    api.num_recordings = 6
+    api.requested.clear()
+    page = xeno_canto.get_composite_page({"grp": "1"}, cache_dir=tmp_path)
+
+    assert len(page.recordings) == 6
+    assert sorted(api.requested) == [1, 2, 3]
+    assert len(list(tmp_path.glob("*/*"))) == 1